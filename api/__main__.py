@@ -0,0 +1,7 @@
+"""python -m api [serve | migrate | retention ...]: the index.py CLI, `serve` by default."""
+
+import sys
+
+from . import index
+
+sys.exit(index._cli(sys.argv[1:] or ['serve']))
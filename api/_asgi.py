@@ -0,0 +1,328 @@
+"""
+ASGI entry point: the same routes as the Vercel handler in index.py, for a
+server that keeps many requests in flight in one process:
+
+    uvicorn api._asgi:app --workers 1
+
+(Vercel does not deploy api/ files starting with an underscore, so this is
+not a second serverless function; `handler` in index.py stays the deployed
+entry point.)
+
+Routes in _ASYNC_ROUTES (the chatbot, whose time is spent waiting for the
+completion backend) run on the event loop and await the backend's
+.acomplete / .astream, so a slow answer holds no thread. Every other route
+runs the regular synchronous handler in a bounded worker pool
+(ASGI_THREADS, by default DB_POOL_MAX on Neon). A request keeps one worker
+from the handler call to its last body chunk: SQLite connections and
+streamed cursors belong to the thread that opened them. The blocking steps
+of async routes (history, answer cache, saving the exchange) go through the
+same pool; psycopg2 has no async API and the query layer (connection pool,
+PREPARE, statement cache) is shared with the synchronous path.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+try:
+    from . import index as api
+except ImportError:
+    import index as api
+
+# Every synchronous route holds a pooled connection for as long as it holds a worker, so on
+# Neon more workers than DB_POOL_MAX would only queue on the pool (and time out with 503s).
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS') or (api.DB_POOL_MAX if api.USE_NEON else 16))
+if api.USE_NEON and ASGI_THREADS > api.DB_POOL_MAX:
+    print(f"⚠️ ASGI_THREADS={ASGI_THREADS} is above DB_POOL_MAX={api.DB_POOL_MAX}: "
+          f"the extra workers wait for a database connection")
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi')
+
+async def run_sync(fn, *args):
+    """Run a blocking call in the worker pool."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(fn, *args))
+
+_DONE = object()
+
+async def _iterate_sync(iterator):
+    """Async iterator over a blocking iterator, one worker call per item."""
+    while True:
+        item = await run_sync(next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+def _after_response():
+    # Same deferred writes as handler._handle_request
+    api.flush_visits(due_only=True)
+    api.maybe_run_retention()
+
+# ============================================================
+# Chatbot (async)
+# ============================================================
+
+async def _backend_pieces(backend, messages, stream):
+    """Answer pieces from the backend, preferring its async methods."""
+    if stream and hasattr(backend, 'astream'):
+        async for piece in backend.astream(messages):
+            yield piece
+    elif hasattr(backend, 'acomplete'):
+        yield await backend.acomplete(messages)
+    elif stream and hasattr(backend, 'stream'):
+        async for piece in _iterate_sync(iter(backend.stream(messages))):
+            yield piece
+    else:
+        yield await run_sync(backend, messages)
+
+async def _chatbot_reply_pieces(conversation_id, user_message, stream=False):
+    """Async counterpart of index._chatbot_reply_pieces (same fallbacks and answer cache)."""
+    answer, call = await run_sync(api._chatbot_plan, conversation_id, user_message)
+    if call is None:
+        yield answer
+        return
+    backend, matcher, question, messages = call
+
+    parts = []
+    started = time.perf_counter()
+    try:
+        async for piece in _backend_pieces(backend, messages, stream):
+            if piece:
+                parts.append(piece)
+                yield piece
+    except ImportError:
+        raise
+    except Exception as e:
+        api._log_chatbot_backend_error(e)
+        if not parts:
+            yield matcher.respond(user_message, api._CHATBOT_ERROR_RESPONSE)
+        return
+    await run_sync(api._chatbot_answered, matcher, question, ''.join(parts).strip(), started)
+
+async def _chatbot_event_stream(conversation_id, user_message, asked_at):
+    """Async counterpart of index._chatbot_event_stream."""
+    yield api._sse_event('conversation', {'conversation_id': conversation_id})
+    parts = []
+    try:
+        async for piece in _chatbot_reply_pieces(conversation_id, user_message, stream=True):
+            parts.append(piece)
+            yield api._sse_event('delta', {'text': piece})
+    except ImportError:
+        yield api._sse_event('error', {'error': 'OpenAI library not installed'})
+        return
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /chatbot-ai (stream): {str(e)}\n{traceback.format_exc()}")
+        yield api._sse_event('error', {'error': str(e)})
+        return
+    reply = ''.join(parts).strip()
+    await run_sync(api._save_chatbot_exchange, conversation_id, user_message, asked_at, reply)
+    yield api._sse_event('done', {'response': reply, 'conversation_id': conversation_id})
+
+async def _post_chatbot_ai(req):
+    try:
+        error, chat = api._chatbot_request(req)
+        if error:
+            return error
+        conversation_id, user_message, asked_at, stream = chat
+        if stream:
+            return 200, api._sse_headers(), _chatbot_event_stream(conversation_id, user_message, asked_at)
+
+        try:
+            reply = ''.join([piece async for piece in _chatbot_reply_pieces(conversation_id, user_message)]).strip()
+        except ImportError:
+            return api._json_response(500, {'error': 'OpenAI library not installed'})
+        await run_sync(api._save_chatbot_exchange, conversation_id, user_message, asked_at, reply)
+        return api._json_response(200, {'response': reply, 'conversation_id': conversation_id})
+
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /chatbot-ai: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return api._json_response(500, {'error': str(e)})
+
+# Sync route handler -> async implementation
+_ASYNC_ROUTES = {
+    api._post_chatbot_ai: _post_chatbot_ai,
+}
+
+# ============================================================
+# ASGI application
+# ============================================================
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def _parse_request(scope, body):
+    """(path, method, query, body_data, headers, client) as handler._handle_request builds them."""
+    method = scope['method']
+    query = {}
+    if scope.get('query_string'):
+        query_params = parse_qs(scope['query_string'].decode('latin-1'))
+        query = {k: v[0] if len(v) == 1 else v for k, v in query_params.items()}
+    headers = http.client.HTTPMessage()
+    for key, value in scope.get('headers', ()):
+        headers[key.decode('latin-1')] = value.decode('latin-1')
+    body_data = ''
+    if method in ('POST', 'PUT', 'PATCH') and body:
+        body_str = body.decode('utf-8')
+        try:
+            body_data = json.loads(body_str)
+        except ValueError:
+            body_data = body_str
+    client = scope.get('client')
+    return scope['path'], method, query, body_data, headers, client[0] if client else None
+
+async def _send_start(send, status, headers, length=None):
+    raw = [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers.items()]
+    if length is not None and status != 304:
+        raw.append((b'content-length', str(length).encode('ascii')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw})
+
+async def _send_async_route(send, handler, request):
+    """Serve a route from _ASYNC_ROUTES on the event loop."""
+    try:
+        route, prepared = api._prepare_request(*request)
+        if route is None:
+            status, headers, body = prepared
+        else:
+            status, headers, body = await handler(prepared)
+            status, headers, body = api._encode_response(status, headers, body, prepared.headers)
+    except Exception as e:
+        status, headers, body = api._error_response(e)
+    if isinstance(body, (str, bytes)):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        await _send_start(send, status, headers, len(body))
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    await _send_start(send, status, headers)
+    try:
+        async for chunk in body:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    except Exception as e:
+        import traceback
+        print(f"❌ Error while streaming response: {str(e)}\n{traceback.format_exc()}")
+        return  # no final chunk: the server drops the connection and the client sees a truncated body
+    finally:
+        await body.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+# Chunks a worker may have queued ahead of a slow client; once the queue is
+# full the worker waits, so a streamed list is read from its cursor no faster
+# than the client takes it.
+_STREAM_QUEUE_CHUNKS = 8
+_FAILED = object()  # queued instead of the end marker when producing the body raised
+
+class _ClientGone(Exception):
+    pass
+
+def _produce_sync(loop, queue, stop, request):
+    """Worker: run the synchronous API for one request, feeding its response to queue."""
+    def put(item):
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            try:
+                return future.result(timeout=1)
+            except concurrent.futures.TimeoutError:
+                if stop.is_set():  # the consumer is gone and will not make room
+                    future.cancel()
+                    raise _ClientGone() from None
+    body = None
+    end = None
+    try:
+        status, headers, body = api.handle_api_request(*request)
+        whole = isinstance(body, (str, bytes))
+        put((status, headers, body if whole else None))
+        if not whole:
+            for chunk in body:
+                if stop.is_set():
+                    break  # client went away
+                if chunk:
+                    put(chunk)
+    except _ClientGone:
+        end = _ClientGone
+    except Exception as e:
+        import traceback
+        print(f"❌ Error while streaming response: {str(e)}\n{traceback.format_exc()}")
+        end = _FAILED
+    finally:
+        if body is not None and hasattr(body, 'close'):
+            body.close()
+    if end is not _ClientGone:
+        try:
+            put(end)
+        except _ClientGone:
+            pass
+    _after_response()
+
+async def _send_sync_route(send, request):
+    """Serve a request with the synchronous API in one worker thread."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=_STREAM_QUEUE_CHUNKS)
+    stop = threading.Event()
+    loop.run_in_executor(_executor, _produce_sync, loop, queue, stop, request)
+    try:
+        start = await queue.get()
+        if start is None or start is _FAILED:
+            start = api._error_response(RuntimeError('No response'))
+        status, headers, body = start
+        if body is not None:
+            body = body.encode('utf-8') if isinstance(body, str) else body
+            await _send_start(send, status, headers, len(body))
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        await _send_start(send, status, headers)
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if chunk is _FAILED:
+                return  # no final chunk: the server drops the connection and the client sees a truncated body
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        stop.set()
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await run_sync(api.prewarm)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await run_sync(api.flush_visits)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI 3 application."""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    body = await _read_body(receive)
+    if body is None:
+        return  # client disconnected before sending the whole request
+    request = _parse_request(scope, body)
+    path, method, query = request[:3]
+    route, _ = api._match_route(method, api._normalize_api_path(path, dict(query)))
+    handler = _ASYNC_ROUTES.get(route.handler) if route is not None else None
+    if handler is None:
+        await _send_sync_route(send, request)
+    else:
+        await _send_async_route(send, handler, request)
+        await run_sync(_after_response)
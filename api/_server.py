@@ -0,0 +1,322 @@
+"""
+Standalone server for self-hosting: the Vercel `handler` class behind a
+multi-threaded HTTP/1.1 server, plus the static Astro build (dist/).
+
+    python -m api                       # or: python api/index.py serve
+    python -m api serve --port 8080 --workers 32
+
+Connections are accepted by the main thread and queued (at most
+SERVER_QUEUE) for a fixed pool of SERVER_WORKERS threads; when the queue is
+full the client gets an immediate 503. Connections are kept alive between
+requests for up to SERVER_KEEPALIVE_TIMEOUT seconds, and an idle one is
+closed early when other connections are waiting for a worker. SIGTERM (or
+Ctrl-C) stops accepting, closes idle connections, lets in-flight requests
+finish for up to SERVER_DRAIN_TIMEOUT seconds and flushes buffered visits.
+
+Everything outside /api/ is served from dist/, with the redirects and
+headers of vercel.json, so the site behaves as it does on Vercel.
+"""
+
+import json
+import mimetypes
+import os
+import queue
+import re
+import shutil
+import signal
+import socket
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import HTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+try:
+    from . import index as api
+except ImportError:
+    import index as api
+
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('PORT') or os.environ.get('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '16'))
+SERVER_QUEUE = int(os.environ.get('SERVER_QUEUE', '64'))
+SERVER_KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '5'))
+SERVER_DRAIN_TIMEOUT = float(os.environ.get('SERVER_DRAIN_TIMEOUT', '30'))
+
+_ROOT = Path(__file__).resolve().parent.parent
+SERVER_STATIC_DIR = os.environ.get('SERVER_STATIC_DIR') or str(_ROOT / 'dist')
+
+_BUSY_RESPONSE = (b'HTTP/1.1 503 Service Unavailable\r\nContent-Type: text/plain\r\nContent-Length: 12\r\n'
+                  b'Retry-After: 1\r\nConnection: close\r\n\r\nServer busy\n')
+
+# ============================================================
+# Static files (dist/)
+# ============================================================
+
+def _load_vercel_rules():
+    """(redirects {source: (destination, permanent)}, [(compiled source, headers)]) from vercel.json."""
+    try:
+        config = json.loads((_ROOT / 'vercel.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}, []
+    redirects = {r['source']: (r['destination'], r.get('permanent', False)) for r in config.get('redirects', [])}
+    headers = [(re.compile(rule['source']), {h['key']: h['value'] for h in rule.get('headers', [])})
+               for rule in config.get('headers', [])]
+    return redirects, headers
+
+_REDIRECTS, _HEADER_RULES = _load_vercel_rules()
+
+def _resolve_static(root, url_path):
+    """File under root for a URL path (clean URLs: /x -> x/index.html or x.html), or None."""
+    relative = unquote(url_path).lstrip('/')
+    base = os.path.realpath(os.path.join(root, relative))
+    if base != root and not base.startswith(root + os.sep):
+        return None  # path traversal
+    for candidate in (base, os.path.join(base, 'index.html'), base + '.html'):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+# ============================================================
+# Request handler
+# ============================================================
+
+class _ServerHandler(api.handler):
+    """`handler` with HTTP/1.1 keep-alive, drain awareness and static files."""
+    protocol_version = 'HTTP/1.1'
+    timeout = SERVER_KEEPALIVE_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        # True only between requests: a fresh connection may have its first request on the way
+        self.idle = False
+        self.server.track(self, True)
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.track(self, False)
+
+    def parse_request(self):
+        # The request line has arrived: this connection is no longer idle
+        self.idle = False
+        return super().parse_request()
+
+    def handle_one_request(self):
+        try:
+            super().handle_one_request()
+        finally:
+            self.idle = True
+            if self.server.draining or self.server.waiting():
+                self.close_connection = True
+
+    def _is_api(self):
+        path = urlparse(self.path).path
+        return path == '/api' or path.startswith('/api/')
+
+    def do_GET(self):
+        if self._is_api():
+            super().do_GET()
+        else:
+            self._send_static()
+
+    def do_HEAD(self):
+        if self._is_api():
+            self.send_error(405)
+        else:
+            self._send_static(head=True)
+
+    # Outside /api/ only static files exist: other methods never reach the API router
+    def do_POST(self):
+        self._api_only(super().do_POST)
+
+    def do_PUT(self):
+        self._api_only(super().do_PUT)
+
+    def do_DELETE(self):
+        self._api_only(super().do_DELETE)
+
+    def do_OPTIONS(self):
+        self._api_only(super().do_OPTIONS)
+
+    def _api_only(self, handle):
+        if self._is_api():
+            handle()
+            return
+        # The request body is left unread, so the connection cannot carry another request
+        self.close_connection = True
+        self.send_response(405)
+        self.send_header('Allow', 'GET, HEAD')
+        self.send_header('Content-Length', '0')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def _send_static(self, head=False):
+        path = urlparse(self.path).path
+        if path in _REDIRECTS:
+            destination, permanent = _REDIRECTS[path]
+            self.send_response(308 if permanent else 307)
+            self.send_header('Location', destination)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        root = self.server.static_dir
+        file_path = _resolve_static(root, path) if root else None
+        status = 200
+        if file_path is None:
+            status = 404
+            file_path = _resolve_static(root, '/404.html') if root else None
+            if file_path is None:
+                self.send_error(404)
+                return
+
+        stat = os.stat(file_path)
+        if status == 200 and self.headers.get('If-Modified-Since'):
+            try:
+                if int(stat.st_mtime) <= parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp():
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+            except (TypeError, ValueError):
+                pass
+
+        content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type in ('application/javascript', 'application/json'):
+            content_type += '; charset=utf-8'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(stat.st_size))
+        self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+        for pattern, headers in _HEADER_RULES:
+            if pattern.fullmatch(path):
+                for key, value in headers.items():
+                    self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            with open(file_path, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile)
+
+# ============================================================
+# Server
+# ============================================================
+
+class Server(HTTPServer):
+    """HTTPServer with a fixed worker pool, a bounded accept queue and graceful drain."""
+
+    def __init__(self, address, workers=None, queue_size=None, static_dir=None):
+        super().__init__(address, _ServerHandler)
+        self.static_dir = os.path.realpath(static_dir) if static_dir and os.path.isdir(static_dir) else None
+        self.draining = False
+        self._pending = queue.Queue(maxsize=queue_size or SERVER_QUEUE)
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f'server-worker-{i}', daemon=True)
+                         for i in range(workers or SERVER_WORKERS)]
+        for t in self._workers:
+            t.start()
+
+    # ----- Worker pool -----
+    def process_request(self, request, client_address):
+        with self._inflight_cond:
+            self._inflight += 1
+        try:
+            self._pending.put_nowait((request, client_address))
+        except queue.Full:
+            self._done()
+            try:
+                request.sendall(_BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        with self._connections_lock:
+            saturated = len(self._connections) >= len(self._workers)
+        if saturated:
+            # Every worker holds a connection: free one that is only waiting for its next request
+            self._close_idle(limit=1)
+
+    def _work(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self._done()
+
+    def _done(self):
+        with self._inflight_cond:
+            self._inflight -= 1
+            self._inflight_cond.notify_all()
+
+    def waiting(self):
+        """True if accepted connections are waiting for a worker."""
+        return not self._pending.empty()
+
+    # ----- Connections -----
+    def track(self, handler, open_):
+        with self._connections_lock:
+            (self._connections.add if open_ else self._connections.discard)(handler)
+
+    def drain(self):
+        """Stop accepting and close idle keep-alive connections (call from a thread other than serve_forever's)."""
+        if self.draining:
+            return
+        self.draining = True
+        self.shutdown()
+        self._close_idle()
+
+    def _close_idle(self, limit=None):
+        """End keep-alive connections waiting for their next request (their handler sees EOF and returns)."""
+        with self._connections_lock:
+            idle = [h for h in self._connections if h.idle][:limit]
+        for h in idle:
+            try:
+                h.connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+    def wait_drained(self, timeout):
+        """Wait for queued and in-flight connections to finish, then stop the workers. True if all finished."""
+        with self._inflight_cond:
+            drained = self._inflight_cond.wait_for(lambda: self._inflight == 0, timeout)
+        for _ in self._workers:
+            self._pending.put(None)
+        return drained
+
+def serve(host=None, port=None, workers=None, queue_size=None, static_dir=None):
+    """Run the server until SIGTERM / SIGINT, then drain. Returns the exit status."""
+    host = SERVER_HOST if host is None else host
+    port = SERVER_PORT if port is None else port
+    server = Server((host, port), workers, queue_size, static_dir or SERVER_STATIC_DIR)
+
+    def _on_signal(signum, frame):
+        print(f"🛑 {signal.Signals(signum).name}: draining (up to {SERVER_DRAIN_TIMEOUT:g}s)")
+        # shutdown() waits for serve_forever(), which runs in this (main) thread
+        threading.Thread(target=server.drain, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
+    if server.static_dir is None:
+        print(f"⚠️ No static build at {static_dir or SERVER_STATIC_DIR} (run `npm run build`); serving /api only")
+    api.prewarm()
+    print(f"🚀 Serving on http://{host}:{server.server_address[1]} "
+          f"({len(server._workers)} workers, queue {server._pending.maxsize}, keep-alive {SERVER_KEEPALIVE_TIMEOUT:g}s)")
+    try:
+        server.serve_forever()
+        started = time.monotonic()
+        drained = server.wait_drained(SERVER_DRAIN_TIMEOUT)
+        print(f"{'✅ Drained' if drained else '⚠️ Drain timed out'} after {time.monotonic() - started:.1f}s")
+    finally:
+        api.flush_visits()
+        server.server_close()
+    return 0
@@ -1,23 +1,35 @@
 """
 Vercel Python Serverless Function
 Handles all API endpoints for Sofimar SERV website
-Creates database tables automatically on first run
+Applies versioned schema migrations on first use (see _MIGRATIONS)
 """
 
+import time
+
+_IMPORT_STARTED = time.perf_counter()  # cold-start profile (see "Cold start" below)
+
+import atexit
+import collections
+import itertools
 import json
 import os
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import urllib.request
 import urllib.parse
 import base64
+import functools
 import uuid
 from pathlib import Path
 
 # OpenAI API Key - can be set via environment variable OPENAI_API_KEY
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+# Chat completion backend for /chatbot-ai: 'openai' (needs OPENAI_API_KEY),
+# 'stub' (canned local answer, for development and tests) or 'module:function'
+CHATBOT_BACKEND = os.environ.get('CHATBOT_BACKEND', 'openai')
 
 # JWT & auth
 JWT_SECRET = os.environ.get('JWT_SECRET') or 'dev-secret-change-in-production'
@@ -25,21 +37,35 @@ JWT_ALG = 'HS256'
 JWT_EXP_SECONDS = 24 * 60 * 60  # 24h
 ADMIN_USERNAME = 'admin'
 
-def _create_jwt(sub):
+def _create_jwt(sub, epoch=None):
     import jwt
     from datetime import datetime, timedelta
     now = datetime.utcnow()
-    payload = {'sub': sub, 'iat': now, 'exp': now + timedelta(seconds=JWT_EXP_SECONDS)}
+    payload = {'sub': sub, 'iat': now, 'exp': now + timedelta(seconds=JWT_EXP_SECONDS),
+               'ep': get_auth_epoch() if epoch is None else epoch}
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
 
 def _verify_jwt(token):
-    import jwt
-    from datetime import datetime
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        return payload if payload.get('sub') == ADMIN_USERNAME else None
-    except Exception:
-        return None
+    """Claims of a valid admin token issued in the current auth epoch, or None (see _token_cache)."""
+    import hashlib
+    key = (_AUTH_RESOURCES, hashlib.sha256(token.encode('utf-8')).digest())
+    epoch = get_auth_epoch()
+    payload = _token_cache.get(key)
+    if payload is None:
+        import jwt
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        except Exception:
+            return None
+        if payload.get('sub') != ADMIN_USERNAME:
+            return None
+        _token_cache.put(key, payload, ttl=payload.get('exp', 0) - time.time())
+    token_epoch = payload.get('ep', 0)  # no 'ep': issued before epochs existed
+    if token_epoch > epoch:
+        # Issued after a password change this instance has not seen yet: re-read the epoch
+        epoch = get_auth_epoch(fresh=True)
+    # Tokens from before the last password change are revoked
+    return payload if token_epoch >= epoch else None
 
 def _get_client_ip(headers):
     """Extract client IP from request headers (x-forwarded-for, x-real-ip, cf-connecting-ip)."""
@@ -55,6 +81,22 @@ def _get_client_ip(headers):
                 return s
     return None
 
+# X-Forwarded-For is only believed behind a proxy that sets it (Vercel does);
+# on the standalone server a client could put anything in it.
+TRUST_PROXY = os.environ.get('TRUST_PROXY', '1' if os.environ.get('VERCEL') else '0') != '0'
+
+def _request_client(req):
+    """Client address for rate limits: the peer, or with TRUST_PROXY the address the proxy reported."""
+    if TRUST_PROXY and hasattr(req.headers, 'get'):
+        forwarded = req.headers.get('X-Forwarded-For') or req.headers.get('x-forwarded-for')
+        if forwarded:
+            # The proxy appends the peer it saw; earlier entries come from the client
+            return str(forwarded).split(',')[-1].strip()
+        real_ip = req.headers.get('X-Real-Ip') or req.headers.get('x-real-ip')
+        if real_ip:
+            return str(real_ip).strip()
+    return req.client or 'unknown'
+
 def _get_bearer_token(headers):
     if headers is None:
         return None
@@ -67,142 +109,15 @@ def _get_bearer_token(headers):
 
 def _hash_password(raw):
     from werkzeug.security import generate_password_hash
-    return generate_password_hash(raw, method='scrypt')
+    return _run_password_job(generate_password_hash, raw, 'scrypt')
 
 def _check_password(raw, hashed):
     from werkzeug.security import check_password_hash
-    return check_password_hash(hashed, raw)
+    return _run_password_job(check_password_hash, hashed, raw)
 
 def _looks_like_hash(s):
     return isinstance(s, str) and ('scrypt:' in s or 'pbkdf2:' in s or ('$' in s and len(s) > 20))
 
-def _ensure_chatbot_responses_table(db):
-    """Create chatbot_responses table (keyword, response, timestamp) if not exists."""
-    cur = get_cursor(db)
-    try:
-        if db['type'] == 'neon':
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS chatbot_responses (
-                    keyword TEXT PRIMARY KEY,
-                    response TEXT NOT NULL,
-                    timestamp TEXT NOT NULL
-                )
-            """)
-        else:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS chatbot_responses (
-                    keyword TEXT PRIMARY KEY,
-                    response TEXT NOT NULL,
-                    timestamp TEXT NOT NULL
-                )
-            """)
-        db['conn'].commit()
-    except Exception:
-        pass
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-
-def _ensure_site_visits_table(db):
-    """Create site_visits table (id, ip_address, visit_date, visit_count) if not exists."""
-    cur = get_cursor(db)
-    try:
-        if db['type'] == 'neon':
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS site_visits (
-                    id SERIAL PRIMARY KEY,
-                    ip_address TEXT NOT NULL,
-                    visit_date DATE NOT NULL DEFAULT CURRENT_DATE,
-                    visit_count INTEGER NOT NULL DEFAULT 1,
-                    UNIQUE(ip_address, visit_date)
-                )
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_site_visits_date ON site_visits(visit_date)")
-        else:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS site_visits (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ip_address TEXT NOT NULL,
-                    visit_date TEXT NOT NULL,
-                    visit_count INTEGER NOT NULL DEFAULT 1,
-                    UNIQUE(ip_address, visit_date)
-                )
-            """)
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_site_visits_date ON site_visits(visit_date)")
-        db['conn'].commit()
-    except Exception:
-        pass
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-
-def _ensure_reviews_table(db):
-    """Create reviews table (id, author, rating, comment, date, approved) if not exists."""
-    cur = get_cursor(db)
-    try:
-        if db['type'] == 'neon':
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS reviews (
-                    id TEXT PRIMARY KEY,
-                    author TEXT NOT NULL,
-                    rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
-                    comment TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    approved BOOLEAN NOT NULL DEFAULT false
-                )
-            """)
-        else:
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS reviews (
-                    id TEXT PRIMARY KEY,
-                    author TEXT NOT NULL,
-                    rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
-                    comment TEXT NOT NULL,
-                    date TEXT NOT NULL,
-                    approved INTEGER NOT NULL DEFAULT 0
-                )
-            """)
-        db['conn'].commit()
-    except Exception:
-        pass
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-
-def cleanup_old_messages(db, cur, days=5):
-    """Delete chatbot messages older than specified days"""
-    try:
-        cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
-        sql = "DELETE FROM chatbot_messages WHERE timestamp < %s" if db['type'] == 'neon' else "DELETE FROM chatbot_messages WHERE timestamp < ?"
-        cur.execute(sql, (cutoff_date,))
-        deleted_count = cur.rowcount if db['type'] == 'neon' else cur.rowcount
-        db['conn'].commit()
-        if deleted_count > 0:
-            print(f"Cleaned up {deleted_count} old chatbot messages (older than {days} days)")
-    except Exception as e:
-        print(f"Error cleaning up old messages: {str(e)}")
-        # Don't raise - cleanup failure shouldn't break the request
-
-def cleanup_old_contact_messages(db, cur, days=90):
-    """Delete contact messages older than specified days (default 90)"""
-    try:
-        cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
-        sql = "DELETE FROM messages WHERE timestamp < %s" if db['type'] == 'neon' else "DELETE FROM messages WHERE timestamp < ?"
-        cur.execute(sql, (cutoff_date,))
-        deleted_count = cur.rowcount if db['type'] == 'neon' else cur.rowcount
-        db['conn'].commit()
-        if deleted_count > 0:
-            print(f"Cleaned up {deleted_count} old contact messages (older than {days} days)")
-    except Exception as e:
-        print(f"Error cleaning up old contact messages: {str(e)}")
-        # Don't raise - cleanup failure shouldn't break the request
-
 # Database configuration
 # Try multiple environment variable names (Neon integration might use different names)
 NEON_DB_URL = (
@@ -216,59 +131,264 @@ NEON_DB_URL = (
 USE_NEON = bool(NEON_DB_URL)
 DB_FILE = '/tmp/site.db' if os.environ.get('VERCEL') else 'site.db'
 
-# Singleton Neon connection reuse (per Vercel worker) to avoid new connection per request
-_neon_conn = None
-_neon_cursor_factory = None
+# Connection pool settings (per process / Vercel worker)
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))                 # max open Neon connections
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))      # seconds to wait for a free slot
+DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', '300'))   # close connections idle longer than this
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))  # only ping connections idle longer than this
+SQLITE_IDLE_PER_THREAD = 2
+
+class _PooledConnection:
+    """Connection lent out by a pool; .close() hands it back instead of closing it."""
+    __slots__ = ('_conn', '_release')
 
-class _NeonConnWrapper:
-    """Wrapper so .close() is no-op; we reuse the connection."""
-    __slots__ = ('_conn',)
-    def __init__(self, conn):
+    def __init__(self, conn, release):
         self._conn = conn
+        self._release = release
+
     def close(self):
-        pass
-    def cursor(self, cursor_factory=None):
-        return self._conn.cursor(cursor_factory=cursor_factory)
+        release, self._release = self._release, None
+        if release is not None:
+            release(self._conn)
+
+    def cursor(self, *args, **kwargs):
+        return self._conn.cursor(*args, **kwargs)
+
     def commit(self):
         return self._conn.commit()
+
     def __getattr__(self, name):
         return getattr(self._conn, name)
 
-def get_db_connection():
-    """Get database connection - Neon PostgreSQL (reused) or SQLite fallback"""
-    global _neon_conn, _neon_cursor_factory
+    def __del__(self):
+        # Safety net for handlers that raise before closing: return the slot to the pool
+        try:
+            self.close()
+        except Exception:
+            pass
 
-    if USE_NEON and NEON_DB_URL:
+class _PoolExhausted(RuntimeError):
+    """No pooled connection freed up within the pool timeout; answered with 503 (see _error_response)."""
+
+class _ConnectionPool:
+    """
+    Bounded, thread-safe connection pool.
+    Idle connections are reused LIFO; a liveness ping runs only when a connection
+    has been idle longer than ping_after, and connections idle longer than
+    max_idle are closed instead of reused.
+    """
+
+    def __init__(self, connect, ping, reset, max_size, timeout, max_idle, ping_after):
+        self._connect = connect
+        self._ping = ping
+        self._reset = reset
+        self._idle = []  # [(conn, last_used)], most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0, 'ping_failures': 0,
+                      'waits': 0, 'timeouts': 0, 'in_use': 0}
+
+    def acquire(self):
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise _PoolExhausted(f"Database pool exhausted ({self.max_size} connections busy for {self.timeout}s)")
         try:
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
-            if _neon_cursor_factory is None:
-                _neon_cursor_factory = RealDictCursor
+            conn = self._take_idle()
+            if conn is None:
+                conn = self._connect()
+                self._count('created')
+        except Exception:
+            self._slots.release()
+            raise
+        self._count('in_use')
+        return _PooledConnection(conn, self.release)
 
-            if _neon_conn is not None:
+    def _take_idle(self):
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                stale = self._evict_locked(now)
+                entry = self._idle.pop() if self._idle else None
+            for conn in stale:
+                self._discard(conn)
+            if entry is None:
+                return None
+            conn, last_used = entry
+            if now - last_used >= self.ping_after:
                 try:
-                    cur = _neon_conn.cursor()
-                    cur.execute("SELECT 1")
-                    cur.close()
+                    self._ping(conn)
                 except Exception:
-                    try:
-                        _neon_conn.close()
-                    except Exception:
-                        pass
-                    _neon_conn = None
-
-            if _neon_conn is None:
-                _neon_conn = psycopg2.connect(NEON_DB_URL, connect_timeout=10)
-            wrapped = _NeonConnWrapper(_neon_conn)
-            return {'conn': wrapped, 'type': 'neon', 'cursor_factory': _neon_cursor_factory, 'is_neon': True}
-        except Exception as e:
-            import traceback
-            _neon_conn = None
-            print(f"❌ Neon connection error: {str(e)}\n{traceback.format_exc()}")
+                    self._count('ping_failures')
+                    self._discard(conn)
+                    continue
+            self._count('reused')
+            return conn
+
+    def _evict_locked(self, now):
+        stale = []
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            stale.append(self._idle.pop(0)[0])
+            self.stats['evicted'] += 1
+        return stale
+
+    def release(self, conn):
+        try:
+            self._reset(conn)
+        except Exception:
+            self._discard(conn)
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._count('in_use', -1)
+            self._slots.release()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle), max_size=self.max_size)
+
+_NeonConnection = None
+
+def _neon_connect():
+    global _NeonConnection
+    import psycopg2
+    import psycopg2.extensions
+    if _NeonConnection is None:
+        class _NeonConnection(psycopg2.extensions.connection):
+            """psycopg2 connection that remembers which statements it has PREPAREd."""
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared_statements = collections.OrderedDict()  # name -> None, least recently used first
+    return psycopg2.connect(NEON_DB_URL, connect_timeout=10, connection_factory=_NeonConnection)
+
+def _neon_ping(conn):
+    if conn.closed:
+        raise ConnectionError('connection closed')
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT 1")
+    finally:
+        cur.close()
+    conn.rollback()
+
+def _neon_reset(conn):
+    """Leave a returned connection outside any transaction; raises if it is unusable."""
+    if conn.closed:
+        raise ConnectionError('connection closed')
+    import psycopg2.extensions
+    if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+
+_neon_pool = None
+_neon_pool_lock = threading.Lock()
+_neon_cursor_factory = None
 
+def _get_neon_pool():
+    global _neon_pool
+    if _neon_pool is None:
+        with _neon_pool_lock:
+            if _neon_pool is None:
+                _neon_pool = _ConnectionPool(_neon_connect, _neon_ping, _neon_reset, DB_POOL_MAX,
+                                             DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE, DB_POOL_PING_AFTER)
+    return _neon_pool
+
+# SQLite: each thread keeps a small stack of reusable connections (sqlite3 objects
+# must stay on the thread that created them).
+_sqlite_local = threading.local()
+_sqlite_stats = {'created': 0, 'reused': 0, 'evicted': 0}
+_sqlite_stats_lock = threading.Lock()
+
+def _sqlite_acquire():
+    idle = getattr(_sqlite_local, 'idle', None)
+    if idle is None:
+        idle = _sqlite_local.idle = []
+    now = time.monotonic()
+    while idle:
+        conn, last_used = idle.pop()
+        if now - last_used > DB_POOL_MAX_IDLE:
+            conn.close()
+            with _sqlite_stats_lock:
+                _sqlite_stats['evicted'] += 1
+            continue
+        with _sqlite_stats_lock:
+            _sqlite_stats['reused'] += 1
+        return _PooledConnection(conn, functools.partial(_sqlite_release, owner=threading.get_ident()))
     conn = sqlite3.connect(DB_FILE)
     conn.row_factory = sqlite3.Row
-    return {'conn': conn, 'type': 'sqlite', 'cursor_factory': None, 'is_neon': False}
+    with _sqlite_stats_lock:
+        _sqlite_stats['created'] += 1
+    return _PooledConnection(conn, functools.partial(_sqlite_release, owner=threading.get_ident()))
+
+def _sqlite_release(conn, owner):
+    # Uncommitted work is discarded, as it was when the connection was closed
+    if owner != threading.get_ident():
+        return  # released from another thread (e.g. by GC); let the connection be collected
+    idle = getattr(_sqlite_local, 'idle', None)
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except Exception:
+        conn.close()
+        return
+    if idle is None or len(idle) >= SQLITE_IDLE_PER_THREAD:
+        conn.close()
+        return
+    idle.append((conn, time.monotonic()))
+
+def get_pool_stats():
+    """Connection pool counters for the current process (exposed on /health)."""
+    stats = {'sqlite': dict(_sqlite_stats)}
+    if _neon_pool is not None:
+        stats['neon'] = _neon_pool.snapshot()
+    return stats
+
+def get_db_connection():
+    """
+    Get database connection - Neon PostgreSQL or SQLite fallback, both pooled.
+    Returns {'conn', 'type', 'cursor_factory', 'is_neon'}; conn.close() returns it to the pool.
+    """
+    global _neon_cursor_factory
+
+    if USE_NEON:
+        # No SQLite fallback once Neon is configured: a request must not switch databases
+        # halfway through. Errors (including _PoolExhausted) propagate to _error_response.
+        if _neon_cursor_factory is None:
+            from psycopg2.extras import RealDictCursor
+            _neon_cursor_factory = RealDictCursor
+        started = time.perf_counter()
+        conn = _get_neon_pool().acquire()
+        _record_phase('db_connect', started)
+        db = {'conn': conn, 'type': 'neon', 'cursor_factory': _neon_cursor_factory, 'is_neon': True}
+        if not _SCHEMA_READY:
+            try:
+                _ensure_schema(db)
+            except Exception:
+                conn.close()
+                raise
+        return db
+
+    started = time.perf_counter()
+    db = {'conn': _sqlite_acquire(), 'type': 'sqlite', 'cursor_factory': None, 'is_neon': False}
+    _record_phase('db_connect', started)
+    if not _SCHEMA_READY:
+        _ensure_schema(db)
+    return db
 
 def get_cursor(db):
     """Get cursor from database connection, handling both Neon PostgreSQL and SQLite"""
@@ -277,1387 +397,3257 @@ def get_cursor(db):
     else:
         return db['conn'].cursor()
 
-def commit_image_to_github(image_path, relative_path, image_bytes):
+# ============================================================
+# Query layer
+# ============================================================
+# Handlers write one logical statement with '?' placeholders in SQL that both
+# dialects accept (ON CONFLICT ... DO UPDATE, CAST, true/false). It is rendered
+# per dialect once and cached; on Neon it is PREPAREd once per connection and
+# run with EXECUTE. Rows always come back as plain dicts.
+
+# Server-side prepared statements do not survive PgBouncer transaction pooling,
+# so 'auto' disables them for Neon's pooled (-pooler) endpoints.
+DB_PREPARE = os.environ.get('DB_PREPARE', 'auto').lower()
+_PG_PREPARE = (DB_PREPARE in ('1', 'true', 'on') or
+               (DB_PREPARE == 'auto' and '-pooler' not in NEON_DB_URL and 'pgbouncer' not in NEON_DB_URL))
+# Variable-arity SQL (IN lists, keyset conditions, batched deletes) yields a new statement per
+# shape, so both caches are LRUs: evicted prepared statements are DEALLOCATEd on their connection.
+DB_PREPARE_MAX = max(1, int(os.environ.get('DB_PREPARE_MAX', '200')))  # prepared statements per connection
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', '1000'))  # rendered statements per process
+
+class _Statement:
+    """A logical statement and its cached per-dialect renderings."""
+    __slots__ = ('sqlite', 'neon', 'name', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, sql):
+        import hashlib
+        self.sqlite = sql
+        parts = _split_placeholders(sql)
+        n = len(parts) - 1
+        self.neon = '%s'.join(p.replace('%', '%%') for p in parts)
+        self.name = 'sofimar_' + hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]
+        self.prepare_sql = f"PREPARE {self.name} AS " + ''.join(
+            p + (f'${i + 1}' if i < n else '') for i, p in enumerate(parts))
+        self.execute_sql = f"EXECUTE {self.name}" + (' (' + ', '.join(['%s'] * n) + ')' if n else '')
+
+_STATEMENTS = collections.OrderedDict()  # sql -> _Statement, least recently used first
+_statements_lock = threading.Lock()
+
+def _split_placeholders(sql):
+    """Split SQL on '?' placeholders that are outside quoted literals/identifiers."""
+    parts, buf, quote = [], [], None
+    for ch in sql:
+        if quote:
+            buf.append(ch)
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+            buf.append(ch)
+        elif ch == '?':
+            parts.append(''.join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+    parts.append(''.join(buf))
+    return parts
+
+def _statement(sql):
+    with _statements_lock:
+        st = _STATEMENTS.get(sql)
+        if st is not None:
+            _STATEMENTS.move_to_end(sql)
+            return st
+    st = _Statement(sql)
+    with _statements_lock:
+        _STATEMENTS[sql] = st
+        while len(_STATEMENTS) > DB_STATEMENT_CACHE:
+            _STATEMENTS.popitem(last=False)
+    return st
+
+def _execute(db, cur, sql, params):
+    if 'first_query' in _cold_start_phases:
+        _execute_statement(db, cur, sql, params)
+        return
+    started = time.perf_counter()
+    _execute_statement(db, cur, sql, params)
+    _record_phase('first_query', started)
+
+def _execute_statement(db, cur, sql, params):
+    st = _statement(sql)
+    if db['type'] != 'neon':
+        cur.execute(st.sqlite, params)
+        return
+    if not _PG_PREPARE:
+        cur.execute(st.neon, params)
+        return
+    # A pooled connection is used by one thread at a time, so its LRU needs no lock
+    prepared = db['conn'].prepared_statements
+    if st.name in prepared:
+        prepared.move_to_end(st.name)
+    else:
+        while len(prepared) >= DB_PREPARE_MAX:
+            cur.execute(f"DEALLOCATE {prepared.popitem(last=False)[0]}")
+        cur.execute(st.prepare_sql)
+        prepared[st.name] = None
+    cur.execute(st.execute_sql, params)
+
+def _rows_as_dicts(cur, rows):
+    names = [d[0] for d in cur.description]
+    return [dict(zip(names, row)) for row in rows]
+
+def db_query(db, sql, params=()):
+    """Run a SELECT (or ... RETURNING) and return all rows as dicts."""
+    cur = db['conn'].cursor()
+    try:
+        _execute(db, cur, sql, params)
+        return _rows_as_dicts(cur, cur.fetchall())
+    finally:
+        cur.close()
+
+def db_query_one(db, sql, params=()):
+    """Run a query and return the first row as a dict, or None."""
+    cur = db['conn'].cursor()
+    try:
+        _execute(db, cur, sql, params)
+        row = cur.fetchone()
+        return _rows_as_dicts(cur, [row])[0] if row is not None else None
+    finally:
+        cur.close()
+
+def db_execute(db, sql, params=(), commit=False):
+    """Run a write statement; returns the affected row count."""
+    cur = db['conn'].cursor()
+    try:
+        _execute(db, cur, sql, params)
+        count = cur.rowcount
+    finally:
+        cur.close()
+    if commit:
+        db['conn'].commit()
+    return count
+
+# ----- Streaming -----
+DB_STREAM_BATCH = int(os.environ.get('DB_STREAM_BATCH', '200'))
+
+def db_iter(db, sql, params=(), batch_size=None, close=False):
     """
-    Commit image to GitHub repository using git commands (local only)
+    Run a query now and return an iterator over its rows (dicts), fetched
+    batch_size at a time - through a server-side (named) cursor on Neon - so
+    memory stays flat however many rows match. With close=True the iterator
+    owns the connection and returns it to the pool when it is exhausted or closed.
     """
+    batch_size = batch_size or DB_STREAM_BATCH
     try:
-        import subprocess
-        project_root = Path(__file__).parent.parent
-        
-        # Check if we're in a git repository
-        result = subprocess.run(
-            ['git', 'rev-parse', '--is-inside-work-tree'],
-            cwd=project_root,
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print("⚠️ Not in a git repository, skipping commit")
-            return False
-        
-        # Add file to git (use absolute path)
-        result = subprocess.run(
-            ['git', 'add', str(image_path)],
-            cwd=project_root,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"✅ Added {relative_path} to git")
-        if result.stdout:
-            print(f"Git add output: {result.stdout}")
-        if result.stderr:
-            print(f"Git add stderr: {result.stderr}")
-        
-        # Commit with author info
-        commit_message = f"Add image: {relative_path}"
-        result = subprocess.run(
-            ['git', 'commit', '-m', commit_message],
-            cwd=project_root,
-            capture_output=True,
-            text=True
-        )
-        if result.returncode == 0:
-            print(f"✅ Committed {relative_path}")
-            if result.stdout:
-                print(f"Git commit output: {result.stdout}")
+        if db['type'] == 'neon':
+            # DECLARE ... CURSOR cannot wrap EXECUTE, so named cursors skip PREPARE
+            cur = db['conn'].cursor(name=f'sofimar_stream_{uuid.uuid4().hex[:12]}')
+            cur.itersize = batch_size
+            cur.execute(_statement(sql).neon, params)
         else:
-            # Check if there are changes to commit
-            if 'nothing to commit' in result.stdout or 'nothing to commit' in result.stderr:
-                print(f"⚠️ Nothing to commit for {relative_path} (file may already be committed)")
-            else:
-                print(f"⚠️ Git commit failed: {result.stderr}")
-                raise subprocess.CalledProcessError(result.returncode, 'git commit', result.stdout + result.stderr)
-        
-        # Push to GitHub
-        result = subprocess.run(
-            ['git', 'push', 'origin', 'main'],
-            cwd=project_root,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print(f"✅ Pushed {relative_path} to GitHub")
-        if result.stdout:
-            print(f"Git push output: {result.stdout}")
-        
-        return True
-        
-    except subprocess.CalledProcessError as e:
-        print(f"⚠️ Git command failed: {str(e)}")
-        return False
-    except Exception as e:
-        print(f"⚠️ Error committing to GitHub: {str(e)}")
-        return False
+            cur = db['conn'].cursor()
+            _execute(db, cur, sql, params)
+    except Exception:
+        if close:
+            db['conn'].close()
+        raise
+    return _iter_rows(db, cur, batch_size, close)
+
+def _iter_rows(db, cur, batch_size, close):
+    try:
+        names = None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            if names is None:
+                names = [d[0] for d in cur.description]
+            for row in rows:
+                yield dict(zip(names, row))
+    finally:
+        cur.close()
+        if close:
+            db['conn'].close()
+
+# ----- Keyset pagination -----
+# List endpoints return rows newest first, ordered by (order column, id). A page
+# is (limit, after) where after is the (value, id) of the last row already seen;
+# clients only ever see it as an opaque cursor string.
+API_LIST_COMPAT = os.environ.get('API_LIST_COMPAT', '1') != '0'  # no ?limit/?cursor -> full bare array
+API_PAGE_DEFAULT = int(os.environ.get('API_PAGE_DEFAULT', '50'))
+API_PAGE_MAX = int(os.environ.get('API_PAGE_MAX', '200'))
+
+def _encode_cursor(value, last_id):
+    raw = json.dumps([value, last_id], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
 
-def upload_image_to_github_via_api(relative_path, image_bytes):
+# Cursor (value, id) types of a list ordered by a TEXT column with TEXT ids (see _route's paginate)
+_TEXT_CURSOR = (str, str)
+
+def _decode_cursor(token, types=_TEXT_CURSOR):
+    """(value, id) from a cursor token; raises ValueError unless both are scalars of the given types."""
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    for item, expected in zip((value, last_id), types):
+        # A float column may round-trip as an int; bool is an int but never a key
+        if isinstance(item, bool) or not isinstance(item, (int, float) if expected is float else expected):
+            raise ValueError('Invalid cursor')
+    return value, last_id
+
+def _parse_page(query, cursor_types=_TEXT_CURSOR):
+    """(limit, after) from ?limit=&cursor=, or None for an unpaginated list. Raises ValueError."""
+    raw_limit = query.get('limit')
+    cursor = query.get('cursor')
+    if not raw_limit and not cursor and API_LIST_COMPAT:
+        return None
+    try:
+        limit = int(raw_limit) if raw_limit else API_PAGE_DEFAULT
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    if limit < 1:
+        raise ValueError('Invalid limit')
+    return min(limit, API_PAGE_MAX), (_decode_cursor(cursor, cursor_types) if cursor else None)
+
+def _keyset_sql(sql, order_col, page, where=(), params=()):
     """
-    Upload image to GitHub using GitHub API (for Vercel/serverless)
-    Requires GITHUB_TOKEN environment variable
+    Add the WHERE clause (the where conditions, ANDed, plus the keyset filter),
+    newest-first order and LIMIT for page to sql, which must have no WHERE of
+    its own. params are the values for where.
     """
-    try:
-        github_token = os.environ.get('GITHUB_TOKEN')
-        github_repo = os.environ.get('GITHUB_REPO', 'GeorgeV-creator/Sofimar-SERV')
-        
-        if not github_token:
-            error_msg = "GITHUB_TOKEN not set in Vercel environment variables. Please set it in Vercel Dashboard → Settings → Environment Variables"
-            print(f"❌ {error_msg}")
-            raise ValueError(error_msg)
-        
-        import base64 as b64
-        import urllib.request
-        import urllib.parse
-        import urllib.error
-        
-        # Encode image to base64 for GitHub API
-        print(f"📤 Encoding image for GitHub API upload...")
-        image_b64 = b64.b64encode(image_bytes).decode('utf-8')
-        print(f"📤 Encoded image size: {len(image_b64)} characters")
-        
-        # GitHub API endpoint
-        url = f"https://api.github.com/repos/{github_repo}/contents/{relative_path}"
-        print(f"📤 Uploading to GitHub: {url}")
-        
-        # Create request data
-        data = {
-            "message": f"Add image: {relative_path}",
-            "content": image_b64,
-            "branch": "main"
-        }
-        
-        # Make request
-        req = urllib.request.Request(url, method='PUT')
-        req.add_header('Authorization', f'token {github_token}')
-        req.add_header('Content-Type', 'application/json')
-        req.add_header('Accept', 'application/vnd.github.v3+json')
-        req.add_header('User-Agent', 'Sofimar-SERV-Image-Uploader')
-        
-        try:
-            with urllib.request.urlopen(req, data=json.dumps(data).encode('utf-8'), timeout=30) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                uploaded_path = result.get('content', {}).get('path', relative_path)
-                print(f"✅ Image uploaded successfully to GitHub: {uploaded_path}")
-                print(f"✅ GitHub API response: {result.get('commit', {}).get('message', 'Uploaded')}")
-                return True
-        except urllib.error.HTTPError as http_error:
-            error_body = http_error.read().decode('utf-8') if http_error.fp else 'No error body'
-            print(f"❌ GitHub API HTTP Error {http_error.code}: {error_body}")
-            if http_error.code == 401:
-                raise ValueError("GitHub API authentication failed. Check if GITHUB_TOKEN is valid.")
-            elif http_error.code == 403:
-                raise ValueError("GitHub API forbidden. Check if token has 'repo' permissions.")
-            elif http_error.code == 404:
-                raise ValueError(f"GitHub repository not found: {github_repo}")
-            else:
-                raise ValueError(f"GitHub API error {http_error.code}: {error_body}")
-            
-    except ValueError as ve:
-        # Re-raise ValueError as-is (these are our custom errors)
-        raise
-    except Exception as e:
-        import traceback
-        error_msg = f"Error uploading to GitHub via API: {str(e)}"
-        print(f"❌ {error_msg}")
-        print(f"Traceback: {traceback.format_exc()}")
-        raise Exception(error_msg) from e
+    conditions, params = list(where), list(params)
+    if page and page[1]:
+        conditions.append(f"({order_col}, id) < (?, ?)")
+        params.extend(page[1])
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {order_col} DESC, id DESC"
+    if page:
+        # One extra row tells us whether there is a next page
+        sql += " LIMIT ?"
+        params.append(page[0] + 1)
+    return sql, params
 
-def save_image_to_folder(image_data, filename=None):
+def db_query_page(db, sql, order_col, page, where=(), params=()):
     """
-    Save image to images folder or upload directly to GitHub (in Vercel).
-    image_data can be:
-    - base64 string (data:image/...;base64,...)
-    - binary data
-    Returns the relative path to the image or None if saving failed
-    
-    In Vercel, uploads directly to GitHub via API (no filesystem write).
-    Locally, saves to folder and commits via git.
+    Run a list query newest first, restricted to one keyset page.
+    sql must select id and order_col and filter only through where (a list of
+    conditions, see _keyset_sql). Returns (rows, next_cursor); next_cursor is
+    None on the last page or when page is None (full list).
     """
+    sql, params = _keyset_sql(sql, order_col, page, where, params)
+    rows = db_query(db, sql, params)
+    if page and len(rows) > page[0]:
+        del rows[page[0]:]
+        return rows, _encode_cursor(rows[-1][order_col], rows[-1]['id'])
+    return rows, None
+
+# ----- Promoted JSON fields -----
+# messages, certificates and partners started as a bare `data` JSON blob.
+# Their common fields now live in typed columns (migration 11) so lists can
+# project and filter them through indexes; `data` keeps only the remaining
+# keys, so new form fields still need no migration. epoch_ms mirrors the
+# ISO timestamp as an integer for date-range filters.
+_PROMOTED_FIELDS = {
+    'messages': ('name', 'phone', 'email', 'message'),
+    'certificates': ('title', 'description', 'image'),
+    'partners': ('title', 'image'),
+}
+# Keys that already had their own column before migration 11
+_ROW_FIELDS = {
+    'messages': ('timestamp', 'id'),
+    'certificates': ('type', 'timestamp', 'id'),
+    'partners': ('timestamp', 'id'),
+}
+
+def _epoch_ms(value):
+    """Milliseconds since the epoch for an ISO timestamp or date (None if unparseable)."""
     try:
-        is_vercel = os.environ.get('VERCEL')
-        
-        # Decode image data first
-        if isinstance(image_data, str):
-            if image_data.startswith('data:image/'):
-                # Extract base64 data from data URI
-                if ',' not in image_data:
-                    raise ValueError("Invalid base64 data URI format - missing comma")
-                header, encoded = image_data.split(',', 1)
-                print(f"📝 Decoding base64 image, header: {header[:50]}...")
-                image_bytes = base64.b64decode(encoded)
-                print(f"📝 Decoded image size: {len(image_bytes)} bytes")
-                
-                # Extract extension from header
-                if not filename:
-                    format_match = image_data.split(';')[0].split('/')[-1]
-                    ext = format_match if format_match in ['jpg', 'jpeg', 'png', 'gif', 'webp'] else 'jpg'
-                    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{ext}"
-            else:
-                # Assume it's already base64 without data URI
-                print(f"📝 Decoding base64 string (no data URI)")
-                image_bytes = base64.b64decode(image_data)
-                print(f"📝 Decoded image size: {len(image_bytes)} bytes")
-                if not filename:
-                    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-        else:
-            # Assume it's already binary
-            image_bytes = image_data
-            print(f"📝 Using binary data, size: {len(image_bytes)} bytes")
-            if not filename:
-                filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-        
-        relative_path = f"images/{filename}"
-        
-        if is_vercel:
-            # Vercel environment - upload directly to GitHub via API
-            print("🔄 Vercel environment detected - uploading directly to GitHub via API...")
-            try:
-                upload_image_to_github_via_api(relative_path, image_bytes)
-                print(f"✅ Image uploaded to GitHub: {relative_path}")
-                return relative_path
-            except ValueError as ve:
-                # Custom error messages (token missing, auth failed, etc.)
-                error_msg = str(ve)
-                print(f"❌ {error_msg}")
-                raise Exception(error_msg) from ve
-            except Exception as upload_error:
-                import traceback
-                error_msg = f"Error uploading to GitHub via API: {str(upload_error)}"
-                print(f"❌ {error_msg}")
-                print(f"Traceback: {traceback.format_exc()}")
-                raise Exception(error_msg) from upload_error
-        else:
-            # Local development - save to folder and commit via git
-            project_root = Path(__file__).parent.parent
-            images_folder = project_root / 'images'
-            image_path = images_folder / filename
-            
-            print(f"📁 Project root: {project_root}")
-            print(f"📁 Images folder path: {images_folder}")
-            
-            # Create images folder if it doesn't exist
-            try:
-                images_folder.mkdir(exist_ok=True, mode=0o755)
-                print(f"✅ Images folder created/verified: {images_folder}")
-            except Exception as mkdir_error:
-                print(f"❌ Error creating images folder: {str(mkdir_error)}")
-                raise
-            
-            # Check if folder is writable
-            if not os.access(images_folder, os.W_OK):
-                print(f"❌ Images folder is not writable: {images_folder}")
-                raise PermissionError(f"Images folder is not writable: {images_folder}")
-            
-            print(f"📝 Saving image to: {image_path}")
-            
-            # Write to file
-            try:
-                with open(image_path, 'wb') as f:
-                    f.write(image_bytes)
-                print(f"✅ Image file written successfully: {image_path}")
-            except Exception as write_error:
-                print(f"❌ Error writing image file: {str(write_error)}")
-                raise
-            
-            # Verify file was created
-            if not image_path.exists():
-                raise FileNotFoundError(f"Image file was not created: {image_path}")
-            
-            file_size = image_path.stat().st_size
-            print(f"✅ Image file verified: {image_path} ({file_size} bytes)")
-            print(f"✅ Image saved successfully to: {relative_path}")
-            
-            # Try to commit to GitHub
-            print("🔄 Attempting to commit image to GitHub using git...")
-            try:
-                success = commit_image_to_github(image_path, relative_path, image_bytes)
-                if not success:
-                    print(f"⚠️ Git commit failed, but image saved locally at: {image_path}")
-            except Exception as commit_error:
-                import traceback
-                print(f"⚠️ Could not commit image to GitHub: {str(commit_error)}")
-                print(f"Traceback: {traceback.format_exc()}")
-                print(f"⚠️ Image saved locally at: {image_path}")
-                print(f"⚠️ You may need to commit manually: git add {relative_path} && git commit -m 'Add image' && git push")
-            
-            return relative_path
-        
-    except Exception as e:
-        import traceback
-        error_msg = f"Error saving image: {str(e)}"
-        print(f"❌ {error_msg}")
-        print(f"Traceback: {traceback.format_exc()}")
+        return int(datetime.fromisoformat(str(value).strip()).timestamp() * 1000)
+    except (TypeError, ValueError, OverflowError):
         return None
 
-def _api_headers(cache_max_age=None):
-    h = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-        'Content-Type': 'application/json'
-    }
-    if cache_max_age is not None:
-        h['Cache-Control'] = f'public, max-age={cache_max_age}, s-maxage={cache_max_age}'
-    return h
+def _split_record(table, data):
+    """(promoted column values, extras JSON) for a record dict about to be written."""
+    fields = _PROMOTED_FIELDS[table]
+    # Only strings are promoted; anything else stays in the blob untouched
+    values = tuple(data.get(f) if isinstance(data.get(f), str) else None for f in fields)
+    skip = _ROW_FIELDS[table]
+    extras = {k: v for k, v in data.items()
+              if k not in skip and not (k in fields and isinstance(v, str))}
+    return values, json.dumps(extras, ensure_ascii=False)
 
-def handle_api_request(path, method, query, body_data, request_headers=None):
-    """Handle API request and return response"""
-    headers = _api_headers()
+def _record_from_row(table, row):
+    """Rebuild the API record from promoted columns, the extras blob and the row keys."""
+    out = {f: row[f] for f in _PROMOTED_FIELDS[table] if row.get(f) is not None}
+    extras = row.get('data')
+    if extras and extras != '{}':
+        blob = json.loads(extras) if isinstance(extras, str) else extras
+        if isinstance(blob, dict):
+            out.update(blob)
+    for key in _ROW_FIELDS[table]:
+        if key in row:
+            out[key] = row[key]
+    return out
+
+# ============================================================
+# Image blob store
+# ============================================================
+# Uploaded images are stored once, keyed by the SHA-256 of their bytes, and the
+# certificate/partner JSON only keeps the URL (/api/images/<hash>), so list
+# endpoints no longer carry megabytes of base64. IMAGE_STORE selects where the
+# bytes live: 'db' (images table, default) or 'fs' (files in IMAGE_STORE_DIR,
+# for hosts with a persistent disk - not Vercel).
+IMAGE_STORE = os.environ.get('IMAGE_STORE', 'db').lower()
+IMAGE_STORE_DIR = os.environ.get('IMAGE_STORE_DIR') or str(Path(__file__).parent.parent / 'image-store')
+IMAGE_URL_PREFIX = '/api/images/'
+
+def _sniff_image_type(image_bytes):
+    """Content type from the file signature; None for formats we do not serve."""
+    head = bytes(image_bytes[:12])
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def _is_image_hash(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+def put_image(db, image_bytes):
+    """Store image bytes (idempotent) and return their URL. Does not commit."""
+    import hashlib
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    if IMAGE_STORE == 'fs':
+        path = Path(IMAGE_STORE_DIR) / digest
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'.{digest}.{uuid.uuid4().hex[:8]}')
+            tmp.write_bytes(image_bytes)
+            os.replace(tmp, path)
+    else:
+        db_execute(db, """
+            INSERT INTO images (hash, content_type, data, size, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (hash) DO NOTHING
+        """, (digest, _sniff_image_type(image_bytes) or 'application/octet-stream', image_bytes, len(image_bytes), datetime.now().isoformat()))
+    return IMAGE_URL_PREFIX + digest
+
+def get_image(db, digest):
+    """Return (bytes, content_type) for a stored image, or None."""
+    if IMAGE_STORE == 'fs':
+        try:
+            image_bytes = (Path(IMAGE_STORE_DIR) / digest).read_bytes()
+        except FileNotFoundError:
+            return None
+        return image_bytes, _sniff_image_type(image_bytes)
+    row = db_query_one(db, "SELECT content_type, data FROM images WHERE hash = ?", (digest,))
+    if not row:
+        return None
+    return bytes(row['data']), row['content_type']
+
+def _externalize_image(db, data):
+    """Move an embedded data:image URI in data['image'] to the blob store. True if moved."""
+    image_data = data.get('image')
+    if not isinstance(image_data, str) or not image_data.startswith('data:image/'):
+        return False
     try:
-        if method == 'OPTIONS':
-            return 200, headers, ''
-        
-        # In Vercel, path can be /api/test, /api/index.py?path=/messages (rewrite), etc.
-        path = (path or '').strip()
-        if path.startswith('/api/'):
-            path = path[5:]
-        elif path.startswith('api/'):
-            path = path[4:]
-        elif path == '/api' or path == '/api/':
-            path = ''
-        if path.startswith('/'):
-            path = path[1:]
-        # Vercel rewrite /api/* -> /api/index.py?path=/$1: use real path from query
-        if path == 'index.py' and query.get('path'):
-            path = query.pop('path') or ''
-            if isinstance(path, list):
-                path = path[0] if path else ''
-            path = (path or '').strip().lstrip('/').rstrip('/') or path
-        path = (path or '').rstrip('/') or path
-        
-        # ----- POST /login (no auth) -----
-        if method == 'POST' and path == 'login':
-            try:
-                login_body = body_data if isinstance(body_data, dict) else (json.loads(body_data) if isinstance(body_data, str) and body_data.strip() else {})
-            except json.JSONDecodeError:
-                return 400, headers, json.dumps({'error': 'Invalid JSON'}, ensure_ascii=False)
-            username = (login_body.get('username') or '').strip()
-            password = login_body.get('password') or ''
-            if username != ADMIN_USERNAME or not password:
-                return 401, headers, json.dumps({'error': 'Invalid credentials'}, ensure_ascii=False)
-            db = get_db_connection()
-            cur = get_cursor(db)
-            is_neon = db['type'] == 'neon'
-            cur.execute("SELECT password FROM admin_password WHERE id = 1 LIMIT 1")
-            row = cur.fetchone()
-            stored = (dict(row)['password'] if row else None) if is_neon else (row['password'] if row else None)
-            db['conn'].close()
-            ok = False
-            if not stored:
-                h = _hash_password('admin123')
-                db2 = get_db_connection()
-                cur2 = get_cursor(db2)
-                ts = datetime.now().isoformat()
-                if db2['type'] == 'neon':
-                    cur2.execute("INSERT INTO admin_password (id, password, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET password = EXCLUDED.password, last_updated = EXCLUDED.last_updated", (h, ts))
-                else:
-                    cur2.execute("INSERT OR REPLACE INTO admin_password (id, password, last_updated) VALUES (1, ?, ?)", (h, ts))
-                db2['conn'].commit()
-                db2['conn'].close()
-                ok = _check_password(password, h)
-            elif _looks_like_hash(stored):
-                ok = _check_password(password, stored)
-            else:
-                ok = (password == stored)
-                if ok:
-                    h = _hash_password(password)
-                    db2 = get_db_connection()
-                    cur2 = get_cursor(db2)
-                    ts = datetime.now().isoformat()
-                    if db2['type'] == 'neon':
-                        cur2.execute("INSERT INTO admin_password (id, password, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET password = EXCLUDED.password, last_updated = EXCLUDED.last_updated", (h, ts))
-                    else:
-                        cur2.execute("INSERT OR REPLACE INTO admin_password (id, password, last_updated) VALUES (1, ?, ?)", (h, ts))
-                    db2['conn'].commit()
-                    db2['conn'].close()
-            if not ok:
-                return 401, headers, json.dumps({'error': 'Invalid credentials'}, ensure_ascii=False)
-            token = _create_jwt(ADMIN_USERNAME)
-            if hasattr(token, 'decode'):
-                token = token.decode('utf-8')
-            return 200, headers, json.dumps({'token': token}, ensure_ascii=False)
-        
-        # ----- Auth for protected routes -----
-        def _require_auth():
-            t = _get_bearer_token(request_headers)
-            if not t or not _verify_jwt(t):
-                return False
-            return True
-        
-        # GET endpoints
-        if method == 'GET':
-            # Handle root /api/ or empty path
-            if path == '' or path == '/':
-                return 200, headers, json.dumps({
-                    'status': 'ok',
-                    'message': 'API is working. Use /api/test, /api/messages, etc.',
-                    'use_neon': USE_NEON,
-                    'db_type': 'neon' if USE_NEON else 'sqlite'
-                }, ensure_ascii=False)
-            
-            if path == 'track-visit':
-                try:
-                    client_ip = _get_client_ip(request_headers) or 'unknown'
-                    visit_date = datetime.now().strftime('%Y-%m-%d')
-                    db = get_db_connection()
-                    _ensure_site_visits_table(db)
-                    cur = get_cursor(db)
-                    if db['type'] == 'neon':
-                        cur.execute("""
-                            INSERT INTO site_visits (ip_address, visit_date, visit_count)
-                            VALUES (%s, %s, 1)
-                            ON CONFLICT (ip_address, visit_date)
-                            DO UPDATE SET visit_count = site_visits.visit_count + 1
-                        """, (client_ip, visit_date))
-                    else:
-                        cur.execute("""
-                            INSERT INTO site_visits (ip_address, visit_date, visit_count)
-                            VALUES (?, ?, 1)
-                            ON CONFLICT (ip_address, visit_date)
-                            DO UPDATE SET visit_count = visit_count + 1
-                        """, (client_ip, visit_date))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'ok': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in GET /track-visit: {str(e)}\n{traceback.format_exc()}")
-                    return 200, headers, json.dumps({'ok': False}, ensure_ascii=False)
-            
-            if path == 'test' or path == 'health':
-                # Test database connection
-                db_status = {'connected': False, 'error': None, 'type': None}
-                try:
-                    db = get_db_connection()
-                    db_status['type'] = db['type']  # Set type before testing
-                    print(f"Testing connection to: {db['type']}")
-                    # Try a simple query
-                    cur = get_cursor(db)
-                    cur.execute("SELECT 1 as test")
-                    cur.fetchone()
-                    db['conn'].close()
-                    db_status['connected'] = True
-                except Exception as e:
-                    error_msg = str(e)
-                    db_status['error'] = error_msg
-                    print(f"Database connection error: {error_msg}")
-                
-                return 200, headers, json.dumps({
-                    'status': 'ok',
-                    'use_neon': USE_NEON,
-                    'db_type': 'neon' if USE_NEON else 'sqlite',
-                    'has_neon_db_url': bool(NEON_DB_URL),
-                    'database': db_status
-                }, ensure_ascii=False)
-            
-            elif path == 'validate':
-                t = _get_bearer_token(request_headers)
-                if not t or not _verify_jwt(t):
-                    return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-                return 200, headers, json.dumps({'ok': True}, ensure_ascii=False)
-            
-            elif path == 'admin/visitor-stats':
-                t = _get_bearer_token(request_headers)
-                if not t or not _verify_jwt(t):
-                    return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-                try:
-                    db = get_db_connection()
-                    _ensure_site_visits_table(db)
-                    cur = get_cursor(db)
-                    is_neon = db['type'] == 'neon'
-                    cutoff = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-                    if is_neon:
-                        cur.execute("""
-                            SELECT visit_date as date,
-                                   COUNT(DISTINCT ip_address) as unique_visitors,
-                                   COALESCE(SUM(visit_count), 0)::int as total_accesses
-                            FROM site_visits
-                            WHERE visit_date >= %s
-                            GROUP BY visit_date
-                            ORDER BY visit_date DESC
-                        """, (cutoff,))
-                    else:
-                        cur.execute("""
-                            SELECT visit_date as date,
-                                   COUNT(DISTINCT ip_address) as unique_visitors,
-                                   COALESCE(SUM(visit_count), 0) as total_accesses
-                            FROM site_visits
-                            WHERE visit_date >= ?
-                            GROUP BY visit_date
-                            ORDER BY visit_date DESC
-                        """, (cutoff,))
-                    rows = cur.fetchall()
-                    stats = []
-                    for row in rows:
-                        r = dict(row) if is_neon else {k: row[k] for k in row.keys()}
-                        stats.append({
-                            'date': str(r.get('date', ''))[:10],
-                            'unique_visitors': int(r.get('unique_visitors', 0)),
-                            'total_accesses': int(r.get('total_accesses', 0))
-                        })
-                    db['conn'].close()
-                    return 200, headers, json.dumps(stats, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in GET /admin/visitor-stats: {str(e)}\n{traceback.format_exc()}")
-                    return 500, headers, json.dumps({'error': str(e)}, ensure_ascii=False)
-            
-            elif path == 'stats':
-                t = _get_bearer_token(request_headers)
-                if not t or not _verify_jwt(t):
-                    return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-                db = get_db_connection()
-                _ensure_reviews_table(db)
-                _ensure_chatbot_responses_table(db)
-                cur = get_cursor(db)
-                is_neon = db['type'] == 'neon'
-                counts = {}
-                for name, sql, key in [
-                    ('messages', "SELECT COUNT(*) AS n FROM messages", 'n'),
-                    ('certificates', "SELECT COUNT(*) AS n FROM certificates", 'n'),
-                    ('partners', "SELECT COUNT(*) AS n FROM partners", 'n'),
-                    ('reviews', "SELECT COUNT(*) AS n FROM reviews", 'n'),
-                    ('chatbot_messages', "SELECT COUNT(*) AS n FROM chatbot_messages", 'n'),
-                    ('chatbot_responses', "SELECT COUNT(*) AS n FROM chatbot_responses", 'n'),
-                ]:
-                    cur.execute(sql)
-                    r = cur.fetchone()
-                    counts[name] = int((dict(r) if is_neon else r)[key])
-                cur.execute("SELECT videos FROM tiktok_videos WHERE id = 1 LIMIT 1")
-                r = cur.fetchone()
-                v = (dict(r) if is_neon else r)['videos'] if r else '[]'
-                counts['tiktok'] = len(json.loads(v) if isinstance(v, str) else v)
-                cur.execute("SELECT data FROM locations WHERE id = 1 LIMIT 1")
-                r = cur.fetchone()
-                d = (dict(r) if is_neon else r)['data'] if r else '[]'
-                counts['locations'] = len(json.loads(d) if isinstance(d, str) else d)
-                db['conn'].close()
-                return 200, headers, json.dumps(counts, ensure_ascii=False)
-            
-            elif path == 'messages':
-                db = get_db_connection()
-                cur = get_cursor(db)
-                cleanup_old_contact_messages(db, cur, days=90)
-                cur.execute("SELECT id, data, timestamp FROM messages ORDER BY timestamp DESC")
-                rows = cur.fetchall()
-                is_neon = db['type'] == 'neon'
-                messages = []
-                for row in rows:
-                    r = dict(row) if is_neon else {k: row[k] for k in row.keys()}
-                    blob = json.loads(r['data']) if isinstance(r['data'], str) else r['data']
-                    out = dict(blob) if isinstance(blob, dict) else {}
-                    out['id'] = r['id']
-                    out['timestamp'] = r.get('timestamp') or out.get('timestamp') or ''
-                    messages.append(out)
-                db['conn'].close()
-                return 200, headers, json.dumps(messages, ensure_ascii=False)
-            
-            elif path == 'certificates':
-                db = get_db_connection()
-                cur = get_cursor(db)
-                cur.execute("SELECT id, data, type FROM certificates ORDER BY timestamp DESC")
-                rows = cur.fetchall()
-                certificates = []
-                for row in rows:
-                    row_dict = dict(row) if db['type'] == 'neon' else row
-                    cert_data = json.loads(row_dict['data'])
-                    cert_data['type'] = row_dict.get('type', 'certificat')
-                    certificates.append(cert_data)
-                db['conn'].close()
-                return 200, _api_headers(300), json.dumps(certificates, ensure_ascii=False)
-            
-            elif path == 'partners':
-                db = get_db_connection()
-                cur = get_cursor(db)
-                cur.execute("SELECT data FROM partners ORDER BY timestamp DESC")
-                rows = cur.fetchall()
-                partners = [json.loads(dict(row)['data'] if db['type'] == 'neon' else row['data']) for row in rows]
-                db['conn'].close()
-                return 200, _api_headers(300), json.dumps(partners, ensure_ascii=False)
-            
-            elif path == 'tiktok-videos':
-                db = get_db_connection()
-                cur = get_cursor(db)
-                cur.execute("SELECT videos FROM tiktok_videos WHERE id = 1")
-                row = cur.fetchone()
-                if row:
-                    row_dict = dict(row) if db['type'] == 'neon' else row
-                    videos = json.loads(row_dict['videos']) if isinstance(row_dict['videos'], str) else row_dict['videos']
-                    db['conn'].close()
-                    return 200, _api_headers(300), json.dumps(videos if isinstance(videos, list) else [], ensure_ascii=False)
-                db['conn'].close()
-                default_videos = ['7567003645250702614', '7564125179761167638', '7556587113244937475']
-                return 200, _api_headers(300), json.dumps(default_videos, ensure_ascii=False)
-            
-            elif path == 'locations':
-                db = get_db_connection()
-                cur = get_cursor(db)
-                cur.execute("SELECT data FROM locations WHERE id = 1")
-                row = cur.fetchone()
-                if row:
-                    row_dict = dict(row) if db['type'] == 'neon' else row
-                    locations = json.loads(row_dict['data']) if isinstance(row_dict['data'], str) else row_dict['data']
-                    db['conn'].close()
-                    return 200, _api_headers(300), json.dumps(locations if isinstance(locations, list) else [], ensure_ascii=False)
-                db['conn'].close()
-                return 200, _api_headers(300), json.dumps([], ensure_ascii=False)
-            
-            elif path == 'reviews':
-                db = get_db_connection()
-                _ensure_reviews_table(db)
-                cur = get_cursor(db)
-                cur.execute("SELECT id, author, rating, comment, date FROM reviews ORDER BY date DESC")
-                rows = cur.fetchall()
-                reviews = [dict(row) if db['type'] == 'neon' else {k: row[k] for k in row.keys()} for row in rows]
-                db['conn'].close()
-                return 200, _api_headers(300), json.dumps(reviews, ensure_ascii=False)
-
-            elif path == 'admin/reviews':
-                if not _require_auth():
-                    return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-                db = get_db_connection()
-                _ensure_reviews_table(db)
-                cur = get_cursor(db)
-                cur.execute("SELECT id, author, rating, comment, date, approved FROM reviews ORDER BY date DESC")
-                rows = cur.fetchall()
-                is_neon = db['type'] == 'neon'
-                out = []
-                for row in rows:
-                    r = dict(row) if is_neon else {k: row[k] for k in row.keys()}
-                    if not is_neon and 'approved' in r:
-                        r['approved'] = bool(r['approved'])
-                    out.append(r)
-                db['conn'].close()
-                return 200, headers, json.dumps(out, ensure_ascii=False)
-            
-            elif path == 'chatbot-responses':
-                db = get_db_connection()
-                _ensure_chatbot_responses_table(db)
-                cur = get_cursor(db)
-                cur.execute("SELECT keyword, response FROM chatbot_responses ORDER BY keyword")
-                rows = cur.fetchall()
-                responses = {}
-                for row in rows:
-                    row_dict = dict(row) if db['type'] == 'neon' else row
-                    responses[row_dict['keyword']] = row_dict['response']
+        image_bytes, _ = _decode_image_data(image_data)
+    except ValueError as e:
+        print(f"⚠️ Could not decode embedded image, keeping it inline: {str(e)}")
+        return False
+    if not _sniff_image_type(image_bytes):
+        # Unknown/unsafe formats (e.g. SVG) stay inline as before
+        return False
+    data['image'] = put_image(db, image_bytes)
+    return True
+
+def _move_embedded_images(db, cur):
+    """One-shot: move base64 images embedded in certificates/partners JSON to the blob store."""
+    moved = 0
+    for table in ('certificates', 'partners'):
+        # Rows are loaded one at a time; each can hold megabytes of base64
+        for ref in db_query(db, f"SELECT id FROM {table} WHERE data LIKE ?", ('%data:image/%',)):
+            row = db_query_one(db, f"SELECT data FROM {table} WHERE id = ?", (ref['id'],))
+            data = json.loads(row['data'])
+            if _externalize_image(db, data):
+                db_execute(db, f"UPDATE {table} SET data = ? WHERE id = ?",
+                           (json.dumps(data, ensure_ascii=False), ref['id']))
+                moved += 1
+    if moved:
+        print(f"✅ Moved {moved} embedded image(s) to the blob store")
+
+# ============================================================
+# Resource versions
+# ============================================================
+# Every cacheable resource (a table behind a public GET) has a version counter
+# in resource_versions. Writes bump it in the same transaction as the change,
+# so it is shared by all instances; GETs turn it into an ETag.
+
+def get_resource_versions(db, resources):
+    """{resource: version} for the given resources (0 if never written), in one query."""
+    rows = db_query(db, f"SELECT resource, version FROM resource_versions WHERE resource IN ({', '.join('?' * len(resources))})",
+                    tuple(resources))
+    versions = dict.fromkeys(resources, 0)
+    versions.update((r['resource'], int(r['version'])) for r in rows)
+    return versions
+
+def bump_resource_version(db, resource):
+    """Invalidate ETags for a resource. Does not commit: call before the write's commit."""
+    db_execute(db, """
+        INSERT INTO resource_versions (resource, version, updated_at) VALUES (?, 1, ?)
+        ON CONFLICT (resource) DO UPDATE SET version = resource_versions.version + 1, updated_at = EXCLUDED.updated_at
+    """, (resource, datetime.now().isoformat()))
+    # Cached responses are dropped once the request is done (and committed),
+    # see _flush_invalidations; dropping them now could let a concurrent GET
+    # re-cache the pre-write data.
+    pending = getattr(_written, 'resources', None)
+    if pending is None:
+        pending = _written.resources = set()
+    pending.add(resource)
+
+_written = threading.local()
+
+# ============================================================
+# In-process caches
+# ============================================================
+
+class _TTLCache:
+    """Thread-safe LRU map with per-entry expiry, bounded by entry count and total size."""
+
+    def __init__(self, max_entries, ttl, max_bytes=None):
+        from collections import OrderedDict
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> [expires_at, value, size]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """Fresh value for key, or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def get_stale(self, key):
+        """Value for key even if expired (for revalidation), or None."""
+        with self._lock:
+            entry = self._data.get(key)
+            return entry[1] if entry is not None else None
+
+    def touch(self, key):
+        """Restart the TTL of an entry that was revalidated."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                entry[0] = time.monotonic() + self.ttl
+                self._data.move_to_end(key)
+
+    def put(self, key, value, size=0, ttl=None):
+        """Store value; ttl overrides the cache's TTL for this entry."""
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = [time.monotonic() + (self.ttl if ttl is None else ttl), value, size]
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or
+                                  (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.stats['evictions'] += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[2]
+            self.stats['invalidations'] += 1
+            return entry[1]
+
+    def invalidate(self, match=None):
+        """Drop entries whose key satisfies match(key) (all entries if match is None)."""
+        with self._lock:
+            for key in [k for k in self._data if match is None or match(k)]:
+                self._bytes -= self._data.pop(key)[2]
+                self.stats['invalidations'] += 1
+
+    def count(self, stat, n=1):
+        """Add n to a caller-defined counter in stats."""
+        with self._lock:
+            self.stats[stat] = self.stats.get(stat, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._data), bytes=self._bytes)
+
+# Pre-serialized 200 responses of etag routes, keyed by (resources, label, variant).
+# Within the TTL a hit costs no database access; after it the entry is
+# revalidated against resource_versions, so writes made by other instances
+# show up within RESPONSE_CACHE_TTL seconds. 0 disables the cache.
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(16 * 1024 * 1024)))
+_response_cache = _TTLCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_BYTES)
+_response_cache.stats['revalidated'] = 0
+
+class _CachedResponse:
+    __slots__ = ('version', 'status', 'headers', 'body', 'variants')
+
+    def __init__(self, version, status, headers, body):
+        self.version = version
+        self.status = status
+        self.headers = headers
+        self.body = body
+        # Content-coding -> compressed body, computed once when the entry is stored
+        self.variants = {}
+        if len(body) >= COMPRESS_MIN_BYTES:
+            for encoding in _available_encodings():
+                self.variants[encoding] = _compress(body, encoding)
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(v) for v in self.variants.values()) + 512
+
+    def response(self, request_headers):
+        """(status, headers, body) in the best encoding the client accepts."""
+        headers = dict(self.headers)
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = _accepted_encoding(request_headers) if self.variants else None
+        if encoding is None:
+            return self.status, headers, self.body
+        headers['Content-Encoding'] = encoding
+        return self.status, headers, self.variants[encoding]
+
+# ----- Chatbot keyword matcher -----
+# Keyword fallback of /chatbot-ai: an Aho-Corasick automaton over the
+# chatbot_responses keywords, so a message is matched in one pass whatever the
+# number of keywords. Keywords and messages are folded (lowercase, no
+# diacritics) so "soareci" matches "șoareci". The automaton is cached with the
+# resource version it was built from and rebuilt only when that changes.
+
+def _fold_text(text):
+    """Lowercase text and strip diacritics (ă â î ș ş ț ţ -> a a i s s t t)."""
+    import unicodedata
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+class _KeywordMatcher:
+    """
+    Aho-Corasick automaton over folded keywords. match() returns the longest
+    keyword found anywhere in the text; ties go to the earliest occurrence,
+    then to the first keyword in alphabetical order.
+    """
+    __slots__ = ('version', 'responses', 'keywords', '_goto', '_fail', '_out')
+
+    def __init__(self, responses, version=None):
+        from collections import deque
+        self.version = version
+        self.responses = responses
+        self.keywords = []
+        goto, out = [{}], [-1]  # per state: transitions, index of longest keyword ending here
+        folded_seen = set()
+        for keyword in sorted(responses):
+            folded = _fold_text(keyword).strip()
+            if keyword == 'default' or not folded or folded in folded_seen:
+                continue
+            folded_seen.add(folded)
+            state = 0
+            for ch in folded:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append(-1)
+                state = nxt
+            out[state] = len(self.keywords)
+            self.keywords.append((keyword, len(folded)))
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                if out[nxt] < 0:
+                    out[nxt] = out[fail[nxt]]
+                queue.append(nxt)
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def match(self, text):
+        """Best matching keyword in text, or None."""
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        best, best_key = None, None
+        state = 0
+        for pos, ch in enumerate(_fold_text(text)):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            found = out[state]
+            if found >= 0:
+                keyword, length = keywords[found]
+                key = (-length, pos - length, found)
+                if best_key is None or key < best_key:
+                    best, best_key = keyword, key
+        return best
+
+    def respond(self, text, default=None):
+        """Response for the best keyword in text, else the 'default' row, else default."""
+        keyword = self.match(text)
+        if keyword is not None:
+            return self.responses[keyword]
+        return self.responses.get('default', default)
+
+_matcher_cache = _TTLCache(1, RESPONSE_CACHE_TTL)
+_matcher_cache.stats['builds'] = 0
+_MATCHER_KEY = (frozenset(('chatbot_responses',)),)
+
+def get_chatbot_matcher():
+    """Keyword matcher for the current chatbot_responses (rebuilt only after writes)."""
+    matcher = _matcher_cache.get(_MATCHER_KEY)
+    if matcher is not None:
+        return matcher
+    db = get_db_connection()
+    try:
+        version = get_resource_versions(db, ('chatbot_responses',))['chatbot_responses']
+        matcher = _matcher_cache.get_stale(_MATCHER_KEY)
+        if matcher is None or matcher.version != version:
+            matcher = _KeywordMatcher(_load_chatbot_responses(db), version)
+            _matcher_cache.count('builds')
+    finally:
+        db['conn'].close()
+    _matcher_cache.put(_MATCHER_KEY, matcher)
+    return matcher
+
+# ----- Chatbot conversations -----
+# The widget gets a conversation_id from its first /chatbot-ai call and sends
+# it back with every message; the OpenAI context is the last
+# CHATBOT_HISTORY_TURNS messages of that conversation only. Recent
+# conversations are kept in memory, so a follow-up needs no DB read; an
+# instance that has not seen the conversation reads it by
+# (conversation_id, timestamp). Turns served meanwhile by another instance
+# show up once the entry expires (CHATBOT_HISTORY_TTL seconds idle).
+CHATBOT_HISTORY_TURNS = 10
+CHATBOT_HISTORY_TTL = float(os.environ.get('CHATBOT_HISTORY_TTL', '900'))
+CHATBOT_HISTORY_MAX_CONVERSATIONS = int(os.environ.get('CHATBOT_HISTORY_MAX_CONVERSATIONS', '1000'))
+CHATBOT_MAX_MESSAGE_CHARS = 2000
+_conversation_cache = _TTLCache(CHATBOT_HISTORY_MAX_CONVERSATIONS, CHATBOT_HISTORY_TTL)
+
+# /chatbot-ai is public and each message may cost an OpenAI completion plus
+# rows in chatbot_messages and search_documents: a client (see
+# _request_client) gets CHATBOT_RATE_LIMIT messages per CHATBOT_RATE_WINDOW
+# seconds, then 429 (the widget falls back to its local keyword answers).
+# 0 disables the limit. Per instance, like the login throttle.
+CHATBOT_RATE_LIMIT = int(os.environ.get('CHATBOT_RATE_LIMIT', '20'))
+CHATBOT_RATE_WINDOW = float(os.environ.get('CHATBOT_RATE_WINDOW', '60'))
+CHATBOT_RATE_MAX_CLIENTS = 10000
+
+class _RateLimit:
+    """At most limit calls per window seconds per key (the window starts at the key's first call)."""
+
+    def __init__(self, limit, window, max_keys):
+        self.limit = limit
+        self.window = window
+        self._entries = _TTLCache(max_keys, window)  # key -> [calls, window_ends_at]
+        self._lock = threading.Lock()
+        self.stats = {'allowed': 0, 'refused': 0}
+
+    def hit(self, key):
+        """Count a call by key: 0 if it may proceed, else the seconds until it may."""
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [0, now + self.window]
+                self._entries.put(key, entry)
+            if entry[0] >= self.limit:
+                self.stats['refused'] += 1
+                return entry[1] - now
+            entry[0] += 1
+            self.stats['allowed'] += 1
+            return 0
+
+_chatbot_rate_limit = _RateLimit(CHATBOT_RATE_LIMIT, CHATBOT_RATE_WINDOW, CHATBOT_RATE_MAX_CLIENTS)
+
+def _new_conversation_id():
+    import secrets
+    return secrets.token_urlsafe(16)
+
+def _is_conversation_id(value):
+    return (isinstance(value, str) and 8 <= len(value) <= 64
+            and all(c.isalnum() or c in '-_' for c in value))
+
+def get_conversation_history(conversation_id):
+    """Last CHATBOT_HISTORY_TURNS (type, message) pairs of a conversation, oldest first."""
+    history = _conversation_cache.get(conversation_id)
+    if history is None:
+        db = get_db_connection()
+        rows = db_query(db, """
+            SELECT data FROM chatbot_messages WHERE conversation_id = ?
+            ORDER BY timestamp DESC LIMIT ?
+        """, (conversation_id, CHATBOT_HISTORY_TURNS))
+        db['conn'].close()
+        history = []
+        for row in reversed(rows):
+            msg_data = json.loads(row['data']) if isinstance(row['data'], str) else row['data']
+            history.append((msg_data.get('type', 'user'), msg_data.get('message', '')))
+        history = tuple(history)
+        _conversation_cache.put(conversation_id, history)
+    return history
+
+def record_chatbot_messages(db, conversation_id, messages):
+    """Store [(type, message, timestamp)] under a conversation and extend its cached history. Commits."""
+    for message_type, message_text, timestamp in messages:
+        message_data = {'type': message_type, 'message': message_text, 'timestamp': timestamp}
+        row = db_query(db, "INSERT INTO chatbot_messages (data, timestamp, conversation_id) VALUES (?, ?, ?) RETURNING id",
+                       (json.dumps(message_data, ensure_ascii=False), timestamp, conversation_id))[0]
+        if isinstance(message_text, str) and message_text:
+            index_search_document(db, 'chatbot_messages', row['id'], timestamp, message_text)
+    db['conn'].commit()
+    if conversation_id:
+        history = _conversation_cache.get_stale(conversation_id)
+        if history is not None:
+            history = history + tuple((t, m) for t, m, _ in messages)
+            _conversation_cache.put(conversation_id, history[-CHATBOT_HISTORY_TURNS:])
+
+# ----- Chatbot completion backend -----
+# A backend is a callable taking the chat messages ([{role, content}]) and
+# returning the answer text; if it has a .stream(messages) attribute, that is
+# used for streamed (SSE) replies. get_chatbot_backend() returns None when no
+# backend is configured, so /chatbot-ai uses the keyword matcher only.
+
+def _openai_complete(messages):
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    response = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.7
+    )
+    return response.choices[0].message.content.strip()
+
+def _openai_stream(messages):
+    from openai import OpenAI
+    client = OpenAI(api_key=OPENAI_API_KEY)
+    response = client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.7,
+        stream=True
+    )
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def _stub_complete(messages):
+    return ''.join(_stub_stream(messages))
+
+def _stub_stream(messages):
+    delay = float(os.environ.get('CHATBOT_STUB_DELAY', '0'))
+    words = f"[stub] {messages[-1]['content']}".split(' ')
+    for i, word in enumerate(words):
+        if delay:
+            time.sleep(delay / len(words))
+        yield word if i == 0 else ' ' + word
+
+async def _openai_acomplete(messages):
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    response = await client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.7
+    )
+    return response.choices[0].message.content.strip()
+
+async def _openai_astream(messages):
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+    response = await client.chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=messages,
+        max_tokens=300,
+        temperature=0.7,
+        stream=True
+    )
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def _stub_acomplete(messages):
+    return ''.join([piece async for piece in _stub_astream(messages)])
+
+async def _stub_astream(messages):
+    import asyncio
+    delay = float(os.environ.get('CHATBOT_STUB_DELAY', '0'))
+    words = f"[stub] {messages[-1]['content']}".split(' ')
+    for i, word in enumerate(words):
+        if delay:
+            await asyncio.sleep(delay / len(words))
+        yield word if i == 0 else ' ' + word
+
+# Backends may also offer .stream(messages), yielding the answer in pieces, and
+# .acomplete(messages) / .astream(messages), their coroutine / async-iterator
+# versions used by the ASGI app (api/_asgi.py) instead of a worker thread
+_openai_complete.stream = _openai_stream
+_openai_complete.acomplete = _openai_acomplete
+_openai_complete.astream = _openai_astream
+_stub_complete.stream = _stub_stream
+_stub_complete.acomplete = _stub_acomplete
+_stub_complete.astream = _stub_astream
+
+_chatbot_backend = None
+
+def get_chatbot_backend():
+    global _chatbot_backend
+    if _chatbot_backend is None:
+        if CHATBOT_BACKEND == 'openai':
+            if not OPENAI_API_KEY:
+                return None
+            _chatbot_backend = _openai_complete
+        elif CHATBOT_BACKEND == 'stub':
+            _chatbot_backend = _stub_complete
+        else:
+            import importlib
+            module_name, _, attr = CHATBOT_BACKEND.partition(':')
+            _chatbot_backend = getattr(importlib.import_module(module_name), attr or 'complete')
+    return _chatbot_backend
+
+def set_chatbot_backend(backend):
+    """Replace the completion backend (None re-reads CHATBOT_BACKEND)."""
+    global _chatbot_backend
+    _chatbot_backend = backend
+
+# ----- Chatbot answer cache -----
+# Backend answers to opening questions (no conversation history yet), keyed on
+# the normalized question (folded, stop words dropped), so "Cât costă o
+# deratizare?" and "cat costa deratizare" share one answer. Entries carry the
+# chatbot_responses version they were produced under and are dropped when it
+# changes. With CHATBOT_ANSWER_CACHE_PERSIST=1 (default) answers are also kept
+# in the chatbot_answers table, so a cold instance starts warm.
+CHATBOT_ANSWER_CACHE_TTL = float(os.environ.get('CHATBOT_ANSWER_CACHE_TTL', str(24 * 3600)))
+CHATBOT_ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('CHATBOT_ANSWER_CACHE_MAX_ENTRIES', '500'))
+CHATBOT_ANSWER_CACHE_PERSIST = os.environ.get('CHATBOT_ANSWER_CACHE_PERSIST', '1') != '0'
+_answer_cache = _TTLCache(CHATBOT_ANSWER_CACHE_MAX_ENTRIES, CHATBOT_ANSWER_CACHE_TTL)
+_answer_stats = {'hits': 0, 'misses': 0, 'stored': 0, 'backend_calls': 0, 'backend_ms': 0, 'saved_ms': 0}
+_answer_stats_lock = threading.Lock()
+
+def _count_answers(**deltas):
+    with _answer_stats_lock:
+        for key, n in deltas.items():
+            _answer_stats[key] += n
+
+_QUESTION_STOP_WORDS = frozenset("""
+    a al ale am ar as ati au avem aveti buna ca care cat ce cei cel cele cu cum da de
+    din dumneavoastra e ea ei el este eu fi ii il imi in la le lor lui ma mai mi
+    mie mult ne noi o pe pentru poate pot puteti rog sa salut se si spuneti sunt
+    ta te tu un una unei unui unde va voi vreau ziua
+""".split())
+
+def _normalize_question(text):
+    """Cache key for a question: folded words without stop words ('' if none remain)."""
+    import re
+    return ' '.join(w for w in re.findall(r'[a-z0-9]+', _fold_text(text)) if w not in _QUESTION_STOP_WORDS)
+
+def get_cached_answer(question, responses_version):
+    """(answer, latency_ms) cached for a normalized question under responses_version, or None."""
+    key = (_MATCHER_KEY[0], question)
+    entry = _answer_cache.get(key)
+    if entry is None and CHATBOT_ANSWER_CACHE_PERSIST:
+        try:
+            db = get_db_connection()
+            row = db_query_one(db, """
+                SELECT answer, responses_version, latency_ms FROM chatbot_answers
+                WHERE question = ? AND created_at >= ?
+            """, (question, (datetime.now() - timedelta(seconds=CHATBOT_ANSWER_CACHE_TTL)).isoformat()))
+            db['conn'].close()
+        except Exception as e:
+            print(f"Error reading chatbot answer cache: {str(e)}")
+            row = None
+        if row:
+            entry = (row['answer'], int(row['responses_version']), int(row['latency_ms']))
+            _answer_cache.put(key, entry)
+    if entry is None or entry[1] != responses_version:
+        _count_answers(misses=1)
+        return None
+    _count_answers(hits=1, saved_ms=entry[2])
+    return entry[0], entry[2]
+
+def store_cached_answer(question, answer, responses_version, latency_ms):
+    _answer_cache.put((_MATCHER_KEY[0], question), (answer, responses_version, latency_ms))
+    _count_answers(stored=1)
+    if not CHATBOT_ANSWER_CACHE_PERSIST:
+        return
+    try:
+        db = get_db_connection()
+        db_execute(db, """
+            INSERT INTO chatbot_answers (question, answer, responses_version, latency_ms, created_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (question) DO UPDATE SET answer = EXCLUDED.answer, responses_version = EXCLUDED.responses_version,
+                latency_ms = EXCLUDED.latency_ms, created_at = EXCLUDED.created_at
+        """, (question, answer, responses_version, latency_ms, datetime.now().isoformat()), commit=True)
+        db['conn'].close()
+    except Exception as e:
+        # The in-memory entry is enough; persistence is best effort
+        print(f"Error saving chatbot answer cache: {str(e)}")
+
+def get_answer_cache_stats():
+    with _answer_stats_lock:
+        stats = dict(_answer_stats)
+    lookups = stats['hits'] + stats['misses']
+    return dict(stats, hit_ratio=round(stats['hits'] / lookups, 3) if lookups else None,
+                entries=_answer_cache.snapshot()['entries'])
+
+# ----- Verified admin tokens -----
+# admin.js sends its bearer token with every dashboard call. A token is
+# decoded and HMAC-verified once, then its claims are cached under the
+# token's SHA-256 until its exp (AUTH_TOKEN_CACHE_MAX_ENTRIES, LRU). Tokens
+# carry the auth epoch they were issued in ('ep'): the resource version of
+# admin_password, bumped by a password change, which revokes every earlier
+# token. The epoch is read at most once per AUTH_EPOCH_TTL seconds, so a
+# change made on another instance is enforced here within that window; a
+# token newer than the cached epoch makes it read again at once.
+AUTH_TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_TOKEN_CACHE_MAX_ENTRIES', '256'))
+AUTH_EPOCH_TTL = float(os.environ.get('AUTH_EPOCH_TTL', '30'))
+
+_AUTH_RESOURCES = frozenset(('admin_password',))
+_AUTH_EPOCH_KEY = (_AUTH_RESOURCES,)
+_token_cache = _TTLCache(AUTH_TOKEN_CACHE_MAX_ENTRIES, JWT_EXP_SECONDS)
+_auth_epoch_cache = _TTLCache(1, AUTH_EPOCH_TTL)
+
+def get_auth_epoch(db=None, fresh=False):
+    """Current auth epoch (admin_password resource version), cached for AUTH_EPOCH_TTL seconds unless fresh."""
+    epoch = None if fresh else _auth_epoch_cache.get(_AUTH_EPOCH_KEY)
+    if epoch is not None:
+        return epoch
+    own = db is None
+    if own:
+        db = get_db_connection()
+    try:
+        epoch = get_resource_versions(db, _AUTH_RESOURCES)['admin_password']
+    finally:
+        if own:
+            db['conn'].close()
+    _auth_epoch_cache.put(_AUTH_EPOCH_KEY, epoch)
+    return epoch
+
+# The stored admin password (hash) with the epoch it was read in. Password
+# checks always read the current epoch (not the AUTH_EPOCH_TTL-cached one),
+# so a password changed on another instance stops working at once; the
+# password row itself is read again only after a change.
+_admin_password_cache = _TTLCache(1, JWT_EXP_SECONDS)
+
+def get_admin_password(db, epoch=None):
+    """Stored admin password or hash (None if unset) in epoch, by default the current one read fresh."""
+    if epoch is None:
+        epoch = get_auth_epoch(db, fresh=True)
+    cached = _admin_password_cache.get(_AUTH_EPOCH_KEY)
+    if cached is not None and cached[0] == epoch:
+        return cached[1]
+    row = db_query_one(db, "SELECT password FROM admin_password WHERE id = 1 LIMIT 1")
+    stored = row['password'] if row else None
+    if stored:
+        _admin_password_cache.put(_AUTH_EPOCH_KEY, (epoch, stored))
+    return stored
+
+def set_admin_password(db, stored, epoch):
+    """Write the admin password (hash) and commit; epoch is the auth epoch it belongs to."""
+    db_execute(db, _UPSERT_ADMIN_PASSWORD, (stored, datetime.now().isoformat()))
+    db['conn'].commit()
+    _flush_invalidations()  # a bumped epoch drops the tokens and password cached before it
+    _auth_epoch_cache.put(_AUTH_EPOCH_KEY, epoch)
+    _admin_password_cache.put(_AUTH_EPOCH_KEY, (epoch, stored))
+
+# Caches keyed by (frozenset(resources), ...), emptied by _flush_invalidations
+_RESOURCE_CACHES = (_response_cache, _matcher_cache, _answer_cache, _token_cache, _auth_epoch_cache,
+                    _admin_password_cache)
+
+def _flush_invalidations():
+    """Drop cached entries of resources written during this request."""
+    pending = getattr(_written, 'resources', None)
+    if pending:
+        _written.resources = None
+        for cache in _RESOURCE_CACHES:
+            cache.invalidate(lambda key: not key[0].isdisjoint(pending))
+
+def get_cache_stats():
+    return {'responses': _response_cache.snapshot(), 'chatbot_matcher': _matcher_cache.snapshot(),
+            'chatbot_answers': get_answer_cache_stats(), 'auth_tokens': _token_cache.snapshot(),
+            'login_throttle': _login_throttle.snapshot(), 'chatbot_rate_limit': dict(_chatbot_rate_limit.stats)}
+
+# ============================================================
+# Password hashing and login throttling
+# ============================================================
+# scrypt is deliberately expensive (CPU and 16 MB per hash), so hashes are
+# computed by at most PASSWORD_HASH_WORKERS threads, with PASSWORD_HASH_QUEUE
+# more jobs allowed to wait; past that (or after PASSWORD_HASH_TIMEOUT
+# seconds) the request gets a 503 instead of piling up behind the others.
+#
+# Failed logins are counted per client (see _request_client) and across all
+# clients. After LOGIN_FREE_ATTEMPTS failures from one client further
+# attempts are refused with 429 for LOGIN_BACKOFF_BASE seconds, doubling
+# with every further failure up to LOGIN_BACKOFF_MAX. Past
+# LOGIN_GLOBAL_FREE_ATTEMPTS failures in total the same backoff applies to
+# every client that has failed at least once in the window, so a flood
+# cannot lock out an admin who has not mistyped. Counters reset after a
+# success (per client) or LOGIN_FAILURE_WINDOW seconds without failures.
+# They are per instance: a bound on each instance's work, not an exact
+# global limit.
+
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', '4'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+LOGIN_FREE_ATTEMPTS = int(os.environ.get('LOGIN_FREE_ATTEMPTS', '5'))
+LOGIN_GLOBAL_FREE_ATTEMPTS = int(os.environ.get('LOGIN_GLOBAL_FREE_ATTEMPTS', '50'))
+LOGIN_BACKOFF_BASE = float(os.environ.get('LOGIN_BACKOFF_BASE', '1'))
+LOGIN_BACKOFF_MAX = float(os.environ.get('LOGIN_BACKOFF_MAX', '900'))
+LOGIN_FAILURE_WINDOW = float(os.environ.get('LOGIN_FAILURE_WINDOW', '900'))
+LOGIN_THROTTLE_MAX_IPS = 10000
+
+class _PasswordHashBusy(Exception):
+    """Every password-hashing slot is taken; the caller should answer 503."""
+
+_password_executor = None
+_password_executor_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+def _run_password_job(fn, *args):
+    """fn(*args) on the password-hashing pool; raises _PasswordHashBusy when it is saturated."""
+    global _password_executor
+    if _password_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        with _password_executor_lock:
+            if _password_executor is None:
+                _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                                        thread_name_prefix='password-hash')
+    if not _password_slots.acquire(blocking=False):
+        raise _PasswordHashBusy()
+    try:
+        future = _password_executor.submit(fn, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+    # The slot is held until the hash is done, even if this request stops waiting
+    future.add_done_callback(lambda f: _password_slots.release())
+    from concurrent.futures import TimeoutError as FutureTimeout
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        raise _PasswordHashBusy() from None
+
+class _LoginThrottle:
+    """Failed-attempt counters with exponential backoff, per client and for all clients."""
+
+    def __init__(self):
+        # key -> [failures, blocked_until]; the global counter has its own store so IPs cannot evict it
+        self._clients = _TTLCache(LOGIN_THROTTLE_MAX_IPS, LOGIN_FAILURE_WINDOW)
+        self._all = _TTLCache(1, LOGIN_FAILURE_WINDOW)
+        self._lock = threading.Lock()
+        self.stats = {'failures': 0, 'refused': 0}
+
+    @staticmethod
+    def _retry_after(entries, key):
+        entry = entries.get_stale(key)
+        wait = entry[1] - time.time() if entry is not None else 0
+        return wait if wait > 0 else 0
+
+    def check(self, client):
+        """Seconds client has to wait (0 if none); the global backoff only holds back clients that failed."""
+        wait = self._retry_after(self._clients, client)
+        if self._clients.get(client) is not None:
+            wait = max(wait, self._retry_after(self._all, '*'))
+        if wait:
+            with self._lock:
+                self.stats['refused'] += 1
+        return wait
+
+    def failed(self, client):
+        with self._lock:
+            self.stats['failures'] += 1
+            for entries, key, free in ((self._clients, client, LOGIN_FREE_ATTEMPTS),
+                                       (self._all, '*', LOGIN_GLOBAL_FREE_ATTEMPTS)):
+                entry = entries.get(key) or [0, 0.0]
+                entry[0] += 1
+                if entry[0] > free:
+                    entry[1] = time.time() + min(LOGIN_BACKOFF_BASE * 2 ** (entry[0] - free - 1), LOGIN_BACKOFF_MAX)
+                # Re-putting restarts the window: counters reset after LOGIN_FAILURE_WINDOW quiet seconds
+                entries.put(key, entry, ttl=max(LOGIN_FAILURE_WINDOW, entry[1] - time.time()))
+
+    def succeeded(self, client):
+        self._clients.pop(client)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, clients=self._clients.snapshot()['entries'])
+
+_login_throttle = _LoginThrottle()
+
+def _throttled_response(wait, error='Too many failed attempts, try again later'):
+    import math
+    return _json_response(429, {'error': error, 'retry_after': math.ceil(wait)},
+                          dict(_api_headers(), **{'Retry-After': str(math.ceil(wait))}))
+
+def _hash_busy_response():
+    return _json_response(503, {'error': 'Server busy, try again'}, dict(_api_headers(), **{'Retry-After': '1'}))
+
+# ============================================================
+# Visit tracking (write-behind)
+# ============================================================
+# Page views are counted in memory per (ip, date) and written as one multi-row
+# upsert when VISIT_BUFFER_MAX visits are pending or the oldest is
+# VISIT_BUFFER_MAX_AGE seconds old. The flush runs after the response has been
+# sent (handler), from a timer on long-running servers, and at exit, so
+# /track-visit never waits on the database. Loss bound: a crash or a recycled
+# instance loses at most the pending visits - fewer than VISIT_BUFFER_MAX, or
+# what arrived within VISIT_BUFFER_MAX_AGE, per instance. Failed flushes are
+# retried; past VISIT_BUFFER_HARD_MAX pending keys new visits are dropped
+# (counted in stats) rather than growing memory while the database is down.
+VISIT_BUFFER_MAX = int(os.environ.get('VISIT_BUFFER_MAX', '50'))
+VISIT_BUFFER_MAX_AGE = float(os.environ.get('VISIT_BUFFER_MAX_AGE', '10'))
+VISIT_BUFFER_HARD_MAX = 10000
+_VISIT_UPSERT_BATCH = 100
+
+_visit_buffer = {}  # (ip, date) -> pending count
+_visit_pending = 0
+_visit_oldest = None  # monotonic time of the oldest pending visit
+_visit_timer = None
+_visit_lock = threading.Lock()
+_visit_flush_lock = threading.Lock()
+_visit_stats = {'buffered': 0, 'flushed': 0, 'flushes': 0, 'failed_flushes': 0, 'dropped': 0}
+
+def record_visit(headers):
+    """Count one page view for the client IP today (buffered, no DB access)."""
+    global _visit_pending, _visit_oldest, _visit_timer
+    key = (_get_client_ip(headers) or 'unknown', datetime.now().strftime('%Y-%m-%d'))
+    with _visit_lock:
+        if key not in _visit_buffer and len(_visit_buffer) >= VISIT_BUFFER_HARD_MAX:
+            _visit_stats['dropped'] += 1
+            return
+        _visit_buffer[key] = _visit_buffer.get(key, 0) + 1
+        _visit_pending += 1
+        _visit_stats['buffered'] += 1
+        if _visit_oldest is None:
+            _visit_oldest = time.monotonic()
+            if VISIT_BUFFER_MAX_AGE > 0:
+                _visit_timer = threading.Timer(VISIT_BUFFER_MAX_AGE, flush_visits)
+                _visit_timer.daemon = True
+                _visit_timer.start()
+
+def visits_flush_due():
+    with _visit_lock:
+        return bool(_visit_buffer) and (_visit_pending >= VISIT_BUFFER_MAX or
+                                        time.monotonic() - _visit_oldest >= VISIT_BUFFER_MAX_AGE)
+
+def flush_visits(due_only=False):
+    """Write pending visits (only if a threshold is reached with due_only). Returns visits written."""
+    global _visit_buffer, _visit_pending, _visit_oldest, _visit_timer
+    if due_only and not visits_flush_due():
+        return 0
+    with _visit_flush_lock:
+        with _visit_lock:
+            pending, pending_count, oldest = _visit_buffer, _visit_pending, _visit_oldest
+            _visit_buffer, _visit_pending, _visit_oldest = {}, 0, None
+            if _visit_timer is not None:
+                _visit_timer.cancel()
+                _visit_timer = None
+        if not pending:
+            return 0
+        rows = list(pending.items())
+        try:
+            db = get_db_connection()
+            try:
+                new_keys = set()
+                for i in range(0, len(rows), _VISIT_UPSERT_BATCH):
+                    batch = rows[i:i + _VISIT_UPSERT_BATCH]
+                    upserted = db_query(db, f"""
+                        INSERT INTO site_visits (ip_address, visit_date, visit_count)
+                        VALUES {', '.join(['(?, ?, ?)'] * len(batch))}
+                        ON CONFLICT (ip_address, visit_date)
+                        DO UPDATE SET visit_count = site_visits.visit_count + EXCLUDED.visit_count
+                        RETURNING ip_address, visit_date, visit_count
+                    """, tuple(v for (ip, day), count in batch for v in (ip, day, count)))
+                    # A row whose count equals what we added did not exist before: a new visitor
+                    for r in upserted:
+                        key = (r['ip_address'], str(r['visit_date'])[:10])
+                        if int(r['visit_count']) == pending.get(key):
+                            new_keys.add(key)
+                _update_visit_rollups(db, pending, new_keys)
+                db['conn'].commit()
+            finally:
                 db['conn'].close()
-                return 200, headers, json.dumps(responses, ensure_ascii=False)
-            
-            elif path == 'site-texts':
+        except Exception as e:
+            print(f"Error flushing {pending_count} buffered visits: {str(e)}")
+            _visit_stats['failed_flushes'] += 1
+            # Put them back (merged with anything buffered meanwhile) for the next flush
+            with _visit_lock:
+                for key, count in pending.items():
+                    _visit_buffer[key] = _visit_buffer.get(key, 0) + count
+                _visit_pending += pending_count
+                _visit_oldest = min(oldest, _visit_oldest) if _visit_oldest is not None else oldest
+            return 0
+        _visit_stats['flushes'] += 1
+        _visit_stats['flushed'] += pending_count
+        return pending_count
+
+# ----- Daily rollups -----
+# visit_rollups keeps one row per day: exact unique visitors and accesses,
+# plus a HyperLogLog sketch of that day's IPs. Sketches merge by taking the
+# register-wise max, so unique visitors over any range (week, month, year) are
+# estimated from the daily rows alone (~1.6% standard error) instead of
+# COUNT(DISTINCT) over the raw site_visits rows.
+_HLL_P = 12
+_HLL_M = 1 << _HLL_P
+_HLL_POW = [2.0 ** -r for r in range(65)]
+
+def hll_add(sketch, value):
+    """Add a value to a bytearray sketch."""
+    import hashlib
+    h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+    rest = h & ((1 << (64 - _HLL_P)) - 1)
+    rank = 64 - _HLL_P - rest.bit_length() + 1
+    index = h >> (64 - _HLL_P)
+    if rank > sketch[index]:
+        sketch[index] = rank
+
+_HLL_HIGH_BITS = int.from_bytes(b'\x80' * _HLL_M, 'big')
+
+def hll_union(sketches):
+    """Register-wise max of sketches. Registers (ranks <= 53) fit in 7 bits, so
+    a whole sketch is compared at once as one big int: per byte lane,
+    ((x | 0x80) - y) keeps its high bit exactly where x >= y, without borrows."""
+    acc = 0
+    for sketch in sketches:
+        y = int.from_bytes(sketch, 'big')
+        keep = ((((acc | _HLL_HIGH_BITS) - y) & _HLL_HIGH_BITS) >> 7) * 0xFF
+        acc = (acc & keep) | (y & ~keep)
+    return acc.to_bytes(_HLL_M, 'big')
+
+def hll_count(sketch):
+    """Estimated number of distinct values in a sketch."""
+    import math
+    estimate = (0.7213 / (1 + 1.079 / _HLL_M)) * _HLL_M * _HLL_M / sum(map(_HLL_POW.__getitem__, sketch))
+    zeros = sketch.count(0)
+    if estimate <= 2.5 * _HLL_M and zeros:
+        estimate = _HLL_M * math.log(_HLL_M / zeros)  # linear counting for small ranges
+    return int(round(estimate))
+
+def _update_visit_rollups(db, visits, new_keys):
+    """Fold flushed visits {(ip, day): count} into visit_rollups. Does not commit."""
+    by_day = {}
+    for (ip, day), count in visits.items():
+        by_day.setdefault(day, []).append((ip, count))
+    for day, entries in by_day.items():
+        db_execute(db, """
+            INSERT INTO visit_rollups (visit_date, unique_visitors, total_accesses, hll) VALUES (?, 0, 0, ?)
+            ON CONFLICT (visit_date) DO NOTHING
+        """, (day, bytes(_HLL_M)))
+        # Row lock on Neon so concurrent flushes from other instances don't lose sketch updates
+        row = db_query_one(db, "SELECT hll FROM visit_rollups WHERE visit_date = ?" +
+                           (" FOR UPDATE" if db['type'] == 'neon' else ''), (day,))
+        sketch = bytearray(bytes(row['hll']))
+        for ip, _ in entries:
+            hll_add(sketch, ip)
+        db_execute(db, """
+            UPDATE visit_rollups SET unique_visitors = unique_visitors + ?, total_accesses = total_accesses + ?, hll = ?
+            WHERE visit_date = ?
+        """, (sum(1 for ip, _ in entries if (ip, day) in new_keys), sum(c for _, c in entries), bytes(sketch), day))
+
+def get_visit_buffer_stats():
+    with _visit_lock:
+        return dict(_visit_stats, pending=_visit_pending, pending_keys=len(_visit_buffer))
+
+atexit.register(flush_visits)
+
+# ============================================================
+# Retention
+# ============================================================
+# Old rows are removed by per-table policies rather than on every request.
+# maybe_run_retention() (called after a response is sent) runs them at most
+# once per RETENTION_INTERVAL seconds per process, and skips them if any
+# instance recorded a run within the interval (retention_runs). Deletes go in
+# batches of RETENTION_BATCH rows, each in its own short transaction, and at
+# most RETENTION_MAX_BATCHES per policy and run; the rest waits for the next
+# run. `python api/index.py retention` and POST /api/admin/retention force a run.
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', '3600'))
+RETENTION_BATCH = int(os.environ.get('RETENTION_BATCH', '500'))
+RETENTION_MAX_BATCHES = int(os.environ.get('RETENTION_MAX_BATCHES', '20'))
+
+class _RetentionPolicy:
+    """Delete rows of table whose column is older than days (0 keeps them forever)."""
+    __slots__ = ('name', 'table', 'column', 'key', 'days')
+
+    def __init__(self, table, column, key, days):
+        self.name = table
+        self.table = table
+        self.column = column
+        self.key = key
+        self.days = days
+
+    def cutoff(self, now):
+        cutoff = now - timedelta(days=self.days)
+        # site_visits.visit_date is a DATE; the other columns are ISO timestamps in TEXT
+        return cutoff.strftime('%Y-%m-%d') if self.column == 'visit_date' else cutoff.isoformat()
+
+RETENTION_POLICIES = [
+    _RetentionPolicy('messages', 'timestamp', 'id', float(os.environ.get('RETENTION_MESSAGES_DAYS', '90'))),
+    _RetentionPolicy('chatbot_messages', 'timestamp', 'id', float(os.environ.get('RETENTION_CHATBOT_MESSAGES_DAYS', '5'))),
+    # Daily totals stay in visit_rollups; raw rows are kept unless configured
+    _RetentionPolicy('site_visits', 'visit_date', 'id', float(os.environ.get('RETENTION_SITE_VISITS_DAYS', '0'))),
+    _RetentionPolicy('chatbot_answers', 'created_at', 'question', CHATBOT_ANSWER_CACHE_TTL / 86400),
+]
+
+def _delete_in_batches(db, table, key, where, params):
+    """DELETE rows matching where, RETENTION_BATCH at a time (at most RETENTION_MAX_BATCHES). Returns the count."""
+    deleted = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        count = db_execute(db, f"""
+            DELETE FROM {table} WHERE {key} IN (
+                SELECT {key} FROM {table} WHERE {where} LIMIT ?
+            )
+        """, (*params, RETENTION_BATCH), commit=True)
+        deleted += max(count, 0)
+        if count < RETENTION_BATCH:
+            break
+    return deleted
+
+_retention_lock = threading.Lock()
+_retention_checked_at = None  # monotonic time of this process's last run/check
+
+def run_retention(policies=None, force=False):
+    """
+    Apply retention policies (all by default). Without force, policies that
+    any instance ran within RETENTION_INTERVAL are skipped. Returns
+    {policy: deleted rows, or None if skipped}.
+    """
+    results = {}
+    db = get_db_connection()
+    try:
+        last_runs = {r['policy']: r['last_run_at'] for r in db_query(db, "SELECT policy, last_run_at FROM retention_runs")}
+        db['conn'].commit()
+        now = datetime.now()
+        for policy in policies or RETENTION_POLICIES:
+            if policy.days <= 0:
+                continue
+            last = last_runs.get(policy.name)
+            if not force and last and (now - datetime.fromisoformat(last)).total_seconds() < RETENTION_INTERVAL:
+                results[policy.name] = None
+                continue
+            started = time.perf_counter()
+            cutoff = policy.cutoff(now)
+            deleted = _delete_in_batches(db, policy.table, policy.key, f"{policy.column} < ?", (cutoff,))
+            if policy.table in SEARCH_SOURCES:
+                # Their search documents carry the same timestamp
+                _delete_in_batches(db, 'search_documents', 'id', "source = ? AND timestamp < ?", (policy.table, cutoff))
+            db_execute(db, """
+                INSERT INTO retention_runs (policy, last_run_at, deleted, duration_ms) VALUES (?, ?, ?, ?)
+                ON CONFLICT (policy) DO UPDATE SET last_run_at = EXCLUDED.last_run_at, deleted = EXCLUDED.deleted,
+                    duration_ms = EXCLUDED.duration_ms
+            """, (policy.name, now.isoformat(), deleted, int((time.perf_counter() - started) * 1000)), commit=True)
+            if deleted:
+                print(f"Retention: deleted {deleted} row(s) from {policy.table} older than {cutoff}")
+            results[policy.name] = deleted
+    finally:
+        db['conn'].close()
+    return results
+
+def maybe_run_retention():
+    """Run due retention policies, at most once per RETENTION_INTERVAL per process. Never raises."""
+    global _retention_checked_at
+    if RETENTION_INTERVAL <= 0:
+        return
+    if _retention_checked_at is not None and time.monotonic() - _retention_checked_at < RETENTION_INTERVAL:
+        return
+    if not _retention_lock.acquire(blocking=False):
+        return
+    try:
+        _retention_checked_at = time.monotonic()
+        run_retention()
+    except Exception as e:
+        # Don't raise - cleanup failure shouldn't break the request
+        print(f"Error running retention: {str(e)}")
+    finally:
+        _retention_lock.release()
+
+def get_retention_status(db):
+    runs = {r['policy']: r for r in db_query(db, "SELECT policy, last_run_at, deleted, duration_ms FROM retention_runs")}
+    return [{
+        'policy': p.name,
+        'days': p.days,
+        'last_run_at': runs.get(p.name, {}).get('last_run_at'),
+        'deleted': runs.get(p.name, {}).get('deleted'),
+        'duration_ms': runs.get(p.name, {}).get('duration_ms'),
+    } for p in RETENTION_POLICIES]
+
+# ============================================================
+# Admin search
+# ============================================================
+# Contact messages and chatbot messages get one row each in search_documents
+# (source table, ref_id, timestamp, indexed text). The full-text index depends
+# on the dialect (migration 12): on SQLite an external-content FTS5 table
+# (search_fts, unicode61 with diacritics removed) kept in sync by triggers,
+# on Neon a tsvector column (romanian config over the folded text) with a GIN
+# index. Write paths index rows in the same transaction as the insert;
+# deletes and retention remove their documents. Queries match every term as
+# a prefix, rank with bm25 / ts_rank and page by (score, id).
+SEARCH_SOURCES = ('messages', 'chatbot_messages')
+SEARCH_MAX_TERMS = 8
+SEARCH_SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS', '160'))
+
+def _search_text(*parts):
+    return '\n'.join(p for p in parts if p)
+
+def index_search_document(db, source, ref_id, timestamp, text):
+    """Add or replace the search document of a row. Does not commit."""
+    if db['type'] == 'neon':
+        db_execute(db, """
+            INSERT INTO search_documents (source, ref_id, timestamp, body, tsv)
+            VALUES (?, ?, ?, ?, to_tsvector('romanian', ?))
+            ON CONFLICT (source, ref_id) DO UPDATE SET timestamp = EXCLUDED.timestamp, body = EXCLUDED.body, tsv = EXCLUDED.tsv
+        """, (source, str(ref_id), timestamp, text, _fold_text(text)))
+    else:
+        # search_fts follows through the search_documents triggers
+        db_execute(db, """
+            INSERT INTO search_documents (source, ref_id, timestamp, body) VALUES (?, ?, ?, ?)
+            ON CONFLICT (source, ref_id) DO UPDATE SET timestamp = EXCLUDED.timestamp, body = EXCLUDED.body
+        """, (source, str(ref_id), timestamp, text))
+
+def unindex_search_documents(db, source, ref_id=None):
+    """Remove the documents of one row (or of the whole source). Does not commit."""
+    if ref_id is None:
+        db_execute(db, "DELETE FROM search_documents WHERE source = ?", (source,))
+    else:
+        db_execute(db, "DELETE FROM search_documents WHERE source = ? AND ref_id = ?", (source, str(ref_id)))
+
+def _search_terms(q):
+    """Folded word terms of a query (at most SEARCH_MAX_TERMS)."""
+    import re
+    return re.findall(r'\w+', _fold_text(q or ''))[:SEARCH_MAX_TERMS]
+
+def search_documents(db, terms, sources, limit, after=None):
+    """
+    Best-ranked documents matching all terms (as prefixes) in the given
+    sources. Returns (rows, next_cursor); rows have id, source, ref_id,
+    timestamp, body and score (higher is better).
+    """
+    where_sources = f"d.source IN ({', '.join('?' * len(sources))})"
+    if db['type'] == 'neon':
+        inner = f"""
+            SELECT d.id, d.source, d.ref_id, d.timestamp, d.body, ts_rank(d.tsv, q)::float8 AS score
+            FROM search_documents d, to_tsquery('romanian', ?) q
+            WHERE d.tsv @@ q AND {where_sources}
+        """
+        params = [' & '.join(f'{t}:*' for t in terms), *sources]
+    else:
+        # bm25() is lower-is-better; negate it so both dialects page the same way
+        inner = f"""
+            SELECT d.id, d.source, d.ref_id, d.timestamp, d.body, -bm25(search_fts) AS score
+            FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid
+            WHERE search_fts MATCH ? AND {where_sources}
+        """
+        params = [' '.join(f'"{t}"*' for t in terms), *sources]
+    sql = f"SELECT * FROM ({inner}) hits"
+    if after:
+        sql += " WHERE (score, id) < (?, ?)"
+        params.extend(after)
+    sql += " ORDER BY score DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = db_query(db, sql, params)
+    if len(rows) > limit:
+        del rows[limit:]
+        return rows, _encode_cursor(rows[-1]['score'], rows[-1]['id'])
+    return rows, None
+
+def _search_snippet(text, terms, width=None):
+    """HTML-escaped excerpt of text around the first match, matching words in <mark>."""
+    import html
+    import re
+    width = width or SEARCH_SNIPPET_CHARS
+    # Fold character by character so offsets line up with the original text
+    folded = ''.join((_fold_text(c) or c)[0] for c in text)
+    matches = list(re.finditer(r'\b(?:' + '|'.join(map(re.escape, terms)) + r')\w*', folded))
+    start = 0
+    if matches and matches[0].start() > width // 4:
+        start = matches[0].start() - width // 4
+        space = text.find(' ', start, matches[0].start())
+        start = space + 1 if space >= 0 else start
+    end = min(len(text), start + width)
+    out, pos = [], start
+    for m in matches:
+        if m.start() < start:
+            continue
+        if m.end() > end:
+            break
+        out.append(html.escape(text[pos:m.start()]))
+        out.append(f'<mark>{html.escape(text[m.start():m.end()])}</mark>')
+        pos = m.end()
+    out.append(html.escape(text[pos:end]))
+    return ('…' if start else '') + ''.join(out) + ('…' if end < len(text) else '')
+
+def _search_records(db, hits):
+    """{(source, ref_id): record} for the rows behind a page of hits."""
+    records = {}
+    message_ids = [h['ref_id'] for h in hits if h['source'] == 'messages']
+    if message_ids:
+        for r in db_query(db, f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE id IN ({', '.join('?' * len(message_ids))})",
+                          message_ids):
+            records['messages', r['id']] = _message_from_row(r)
+    chatbot_ids = [int(h['ref_id']) for h in hits if h['source'] == 'chatbot_messages']
+    if chatbot_ids:
+        for r in db_query(db, f"SELECT id, data, timestamp, conversation_id FROM chatbot_messages WHERE id IN ({', '.join('?' * len(chatbot_ids))})",
+                          chatbot_ids):
+            record = json.loads(r['data'])
+            record.update(id=r['id'], timestamp=r['timestamp'], conversation_id=r['conversation_id'])
+            records['chatbot_messages', str(r['id'])] = record
+    return records
+
+def _backfill_search_documents(db):
+    """Index the existing messages and chatbot_messages rows (keyset batches by id)."""
+    last_id = ''
+    while True:
+        rows = db_query(db, "SELECT id, name, phone, email, message, timestamp FROM messages WHERE id > ? ORDER BY id LIMIT 500", (last_id,))
+        if not rows:
+            break
+        for r in rows:
+            index_search_document(db, 'messages', r['id'], r['timestamp'], _search_text(r['name'], r['phone'], r['email'], r['message']))
+        last_id = rows[-1]['id']
+    last_id = 0
+    while True:
+        rows = db_query(db, "SELECT id, data, timestamp FROM chatbot_messages WHERE id > ? ORDER BY id LIMIT 500", (last_id,))
+        if not rows:
+            break
+        for r in rows:
+            try:
+                message = json.loads(r['data']).get('message')
+            except (TypeError, ValueError, AttributeError):
+                message = None
+            if isinstance(message, str) and message:
+                index_search_document(db, 'chatbot_messages', r['id'], r['timestamp'], message)
+        last_id = rows[-1]['id']
+
+# ============================================================
+# Schema migrations
+# ============================================================
+# Ordered, versioned migrations recorded in schema_version. Steps are written
+# in PostgreSQL (as in neon_schema.sql) and rewritten for SQLite by _ddl_for(),
+# or are callables taking (db, cur) for data/shape changes. get_db_connection()
+# applies pending migrations once per process; afterwards the hot path only
+# checks _SCHEMA_READY. Run `python api/index.py migrate` to apply them up front.
+
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '1') != '0'
+_MIGRATION_LOCK_ID = 7270301  # pg_advisory_xact_lock key serializing concurrent migrators
+_MIGRATION_RETRY_SECONDS = 60
+
+_SQLITE_DDL_REWRITES = (
+    ('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    ('BOOLEAN NOT NULL DEFAULT false', 'INTEGER NOT NULL DEFAULT 0'),
+    ('DATE NOT NULL DEFAULT CURRENT_DATE', 'TEXT NOT NULL'),
+    ('BYTEA', 'BLOB'),
+)
+
+_SCHEMA_READY = False
+_schema_lock = threading.Lock()
+_schema_failed_at = 0.0
+
+def _ddl_for(db_type, sql):
+    """Render a PostgreSQL DDL statement for the given dialect."""
+    if db_type == 'sqlite':
+        for pg, lite in _SQLITE_DDL_REWRITES:
+            sql = sql.replace(pg, lite)
+    return sql
+
+def _table_columns(db, cur, table):
+    """Column names of a table (empty set if it does not exist)."""
+    if db['type'] == 'neon':
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+        return {row['column_name'] for row in cur.fetchall()}
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row['name'] for row in cur.fetchall()}
+
+def _migrate_site_texts_column(db, cur):
+    """Older deployments stored site texts in site_texts.data; normalize to site_texts.texts."""
+    columns = _table_columns(db, cur, 'site_texts')
+    if 'data' in columns and 'texts' not in columns:
+        cur.execute("ALTER TABLE site_texts RENAME COLUMN data TO texts")
+
+def _add_chatbot_conversation_id(db, cur):
+    """Chatbot messages belong to a widget conversation (NULL for older rows)."""
+    if 'conversation_id' not in _table_columns(db, cur, 'chatbot_messages'):
+        cur.execute("ALTER TABLE chatbot_messages ADD COLUMN conversation_id TEXT")
+
+def _promote_json_fields(db, cur):
+    """Add the _PROMOTED_FIELDS columns plus epoch_ms and move existing blob values into them."""
+    for table, fields in _PROMOTED_FIELDS.items():
+        columns = _table_columns(db, cur, table)
+        for column in fields + ('epoch_ms',):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {'BIGINT' if column == 'epoch_ms' else 'TEXT'}")
+        update = f"UPDATE {table} SET {', '.join(f'{f} = ?' for f in fields)}, epoch_ms = ?, data = ? WHERE id = ?"
+        # Keyset batches by id: blobs can be large, never load the whole table
+        last_id, moved = '', 0
+        while True:
+            rows = db_query(db, f"SELECT id, data, timestamp FROM {table} WHERE id > ? ORDER BY id LIMIT 500", (last_id,))
+            if not rows:
+                break
+            for r in rows:
                 try:
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    
-                    # Determine which column exists
-                    column_name = None
-                    try:
-                        if db['type'] == 'neon':
-                            # Check which column exists
-                            cur.execute("""
-                                SELECT column_name 
-                                FROM information_schema.columns 
-                                WHERE table_name='site_texts' AND column_name IN ('texts', 'data')
-                            """)
-                            columns = [row[0] if isinstance(row, tuple) else row['column_name'] for row in cur.fetchall()]
-                            if 'texts' in columns:
-                                column_name = 'texts'
-                            elif 'data' in columns:
-                                column_name = 'data'
-                        else:
-                            # SQLite - try both
-                            try:
-                                cur.execute("SELECT texts FROM site_texts WHERE id = 1 LIMIT 1")
-                                column_name = 'texts'
-                            except:
-                                try:
-                                    cur.execute("SELECT data FROM site_texts WHERE id = 1 LIMIT 1")
-                                    column_name = 'data'
-                                except:
-                                    pass
-                    except:
-                        pass
-                    
-                    if column_name:
-                        cur.execute(f"SELECT {column_name} FROM site_texts WHERE id = 1")
-                        row = cur.fetchone()
-                        if row:
-                            row_dict = dict(row) if db['type'] == 'neon' else row
-                            texts_data = row_dict.get(column_name)
-                            if texts_data:
-                                texts = json.loads(texts_data) if isinstance(texts_data, str) else texts_data
-                                db['conn'].close()
-                                return 200, headers, json.dumps(texts if isinstance(texts, dict) else {}, ensure_ascii=False)
-                    
-                    db['conn'].close()
-                    return 200, headers, json.dumps({}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in GET /site-texts: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    # Return empty object instead of 500 error
-                    return 200, headers, json.dumps({}, ensure_ascii=False)
-            
+                    data = json.loads(r['data'])
+                except (TypeError, ValueError):
+                    data = None
+                if not isinstance(data, dict):
+                    continue
+                values, extras = _split_record(table, data)
+                db_execute(db, update, (*values, _epoch_ms(r['timestamp']), extras, r['id']))
+                moved += 1
+            last_id = rows[-1]['id']
+        if moved:
+            print(f"✅ Promoted JSON fields of {moved} {table} row(s) to columns")
+
+def _create_search_index(db, cur):
+    """search_documents plus its dialect-specific full-text index, filled from the existing rows."""
+    cur.execute(_ddl_for(db['type'], """
+        CREATE TABLE IF NOT EXISTS search_documents (
+            id SERIAL PRIMARY KEY, source TEXT NOT NULL, ref_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL, body TEXT NOT NULL, UNIQUE (source, ref_id)
+        )"""))
+    if db['type'] == 'neon':
+        if 'tsv' not in _table_columns(db, cur, 'search_documents'):
+            cur.execute("ALTER TABLE search_documents ADD COLUMN tsv tsvector")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_search_documents_tsv ON search_documents USING GIN (tsv)")
+    else:
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                body, content='search_documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )""")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+                INSERT INTO search_fts (rowid, body) VALUES (new.id, new.body);
+            END""")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+                INSERT INTO search_fts (search_fts, rowid, body) VALUES ('delete', old.id, old.body);
+            END""")
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+                INSERT INTO search_fts (search_fts, rowid, body) VALUES ('delete', old.id, old.body);
+                INSERT INTO search_fts (rowid, body) VALUES (new.id, new.body);
+            END""")
+    _backfill_search_documents(db)
+
+def _backfill_visit_rollups(db, cur):
+    """Build visit_rollups from the existing site_visits rows, one day at a time."""
+    day, sketch, uniques, accesses = None, None, 0, 0
+    rows = db_iter(db, "SELECT ip_address, visit_date, visit_count FROM site_visits ORDER BY visit_date")
+    for r in itertools.chain(rows, [None]):
+        row_day = str(r['visit_date'])[:10] if r else None
+        if row_day != day and day is not None:
+            db_execute(db, """
+                INSERT INTO visit_rollups (visit_date, unique_visitors, total_accesses, hll) VALUES (?, ?, ?, ?)
+                ON CONFLICT (visit_date) DO UPDATE SET unique_visitors = EXCLUDED.unique_visitors,
+                    total_accesses = EXCLUDED.total_accesses, hll = EXCLUDED.hll
+            """, (day, uniques, accesses, bytes(sketch)))
+        if r is None:
+            break
+        if row_day != day:
+            day, sketch, uniques, accesses = row_day, bytearray(_HLL_M), 0, 0
+        hll_add(sketch, r['ip_address'])
+        uniques += 1
+        accesses += int(r['visit_count'])
+
+_MIGRATIONS = [
+    (1, 'baseline schema (neon_schema.sql)', [
+        "CREATE TABLE IF NOT EXISTS messages (id TEXT PRIMARY KEY, data TEXT NOT NULL, timestamp TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS chatbot_messages (id SERIAL PRIMARY KEY, data TEXT NOT NULL, timestamp TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS visits (date TEXT PRIMARY KEY, count INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS certificates (id TEXT PRIMARY KEY, data TEXT NOT NULL, type TEXT NOT NULL DEFAULT 'certificat', timestamp TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS partners (id TEXT PRIMARY KEY, data TEXT NOT NULL, timestamp TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS site_texts (id INTEGER PRIMARY KEY CHECK (id = 1), texts TEXT NOT NULL, last_updated TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS admin_password (id INTEGER PRIMARY KEY CHECK (id = 1), password TEXT NOT NULL, last_updated TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS tiktok_videos (id INTEGER PRIMARY KEY CHECK (id = 1), videos TEXT NOT NULL, last_updated TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT NOT NULL, last_updated TEXT NOT NULL)",
+        """CREATE TABLE IF NOT EXISTS reviews (
+            id TEXT PRIMARY KEY,
+            author TEXT NOT NULL,
+            rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
+            comment TEXT NOT NULL,
+            date TEXT NOT NULL,
+            approved BOOLEAN NOT NULL DEFAULT false
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_approved ON reviews(approved)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_date ON reviews(date)",
+        "CREATE TABLE IF NOT EXISTS chatbot_responses (keyword TEXT PRIMARY KEY, response TEXT NOT NULL, timestamp TEXT NOT NULL)",
+        """CREATE TABLE IF NOT EXISTS site_visits (
+            id SERIAL PRIMARY KEY,
+            ip_address TEXT NOT NULL,
+            visit_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            visit_count INTEGER NOT NULL DEFAULT 1,
+            UNIQUE(ip_address, visit_date)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_site_visits_date ON site_visits(visit_date)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_chatbot_messages_timestamp ON chatbot_messages(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_certificates_id ON certificates(id)",
+        "CREATE INDEX IF NOT EXISTS idx_certificates_timestamp ON certificates(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_timestamp ON partners(timestamp)",
+    ]),
+    (2, 'site_texts.data renamed to site_texts.texts', [_migrate_site_texts_column]),
+    (3, 'content-addressed image blobs', [
+        "CREATE TABLE IF NOT EXISTS images (hash TEXT PRIMARY KEY, content_type TEXT NOT NULL, data BYTEA NOT NULL, size INTEGER NOT NULL, created_at TEXT NOT NULL)",
+    ]),
+    (4, 'move embedded certificate/partner images to the blob store', [_move_embedded_images]),
+    (5, 'keyset pagination indexes (order column, id)', [
+        "CREATE INDEX IF NOT EXISTS idx_messages_timestamp_id ON messages(timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_certificates_timestamp_id ON certificates(timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_partners_timestamp_id ON partners(timestamp, id)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_date_id ON reviews(date, id)",
+        "DROP INDEX IF EXISTS idx_messages_timestamp",
+        "DROP INDEX IF EXISTS idx_certificates_timestamp",
+        "DROP INDEX IF EXISTS idx_partners_timestamp",
+        "DROP INDEX IF EXISTS idx_reviews_date",
+    ]),
+    (6, 'resource versions for ETags', [
+        "CREATE TABLE IF NOT EXISTS resource_versions (resource TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at TEXT NOT NULL)",
+    ]),
+    (7, 'chatbot_messages.conversation_id', [
+        _add_chatbot_conversation_id,
+        "CREATE INDEX IF NOT EXISTS idx_chatbot_messages_conversation ON chatbot_messages(conversation_id, timestamp)",
+    ]),
+    (8, 'chatbot answer cache', [
+        "CREATE TABLE IF NOT EXISTS chatbot_answers (question TEXT PRIMARY KEY, answer TEXT NOT NULL, responses_version INTEGER NOT NULL, latency_ms INTEGER NOT NULL, created_at TEXT NOT NULL)",
+    ]),
+    (9, 'daily visitor rollups', [
+        "CREATE TABLE IF NOT EXISTS visit_rollups (visit_date TEXT PRIMARY KEY, unique_visitors INTEGER NOT NULL, total_accesses INTEGER NOT NULL, hll BYTEA NOT NULL)",
+        _backfill_visit_rollups,
+    ]),
+    (10, 'retention runs', [
+        "CREATE TABLE IF NOT EXISTS retention_runs (policy TEXT PRIMARY KEY, last_run_at TEXT NOT NULL, deleted INTEGER NOT NULL, duration_ms INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_chatbot_answers_created_at ON chatbot_answers(created_at)",
+    ]),
+    (11, 'typed columns for messages/certificates/partners fields', [
+        _promote_json_fields,
+        "CREATE INDEX IF NOT EXISTS idx_messages_name ON messages(name)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_phone ON messages(phone)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_email ON messages(email)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_epoch_ms ON messages(epoch_ms)",
+        "CREATE INDEX IF NOT EXISTS idx_certificates_type_timestamp_id ON certificates(type, timestamp, id)",
+    ]),
+    (12, 'admin full-text search', [
+        _create_search_index,
+        "CREATE INDEX IF NOT EXISTS idx_search_documents_source_timestamp ON search_documents(source, timestamp)",
+    ]),
+]
+
+def _schema_version(db, cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)")
+    cur.execute("SELECT MAX(version) AS v FROM schema_version")
+    row = cur.fetchone()
+    return int(row['v'] or 0) if row else 0
+
+def apply_migrations(db):
+    """Apply pending migrations, each in its own transaction. Returns the versions applied."""
+    is_neon = db['type'] == 'neon'
+    conn = db['conn']
+    cur = get_cursor(db)
+    applied = []
+    try:
+        _schema_version(db, cur)
+        conn.commit()
+        for version, name, steps in _MIGRATIONS:
+            if is_neon:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_ID,))
             else:
-                return 404, headers, json.dumps({'error': 'Not found'}, ensure_ascii=False)
-        
-        # POST endpoints
-        elif method == 'POST':
-            if not body_data:
-                return 400, headers, json.dumps({'error': 'No body data'}, ensure_ascii=False)
-            
+                cur.execute("BEGIN IMMEDIATE")
+            if _schema_version(db, cur) >= version:
+                conn.rollback()
+                continue
             try:
-                data = body_data if isinstance(body_data, dict) else json.loads(body_data) if isinstance(body_data, str) else {}
-            except json.JSONDecodeError as e:
-                return 400, headers, json.dumps({'error': f'Invalid JSON: {str(e)}'}, ensure_ascii=False)
-            
-            if path != 'messages' and path != 'reviews' and not _require_auth():
-                return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-            
-            if path == 'messages':
-                try:
-                    data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
-                    data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
-                    
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    sql = "INSERT INTO messages (id, data, timestamp) VALUES (%s, %s, %s)" if db['type'] == 'neon' else "INSERT INTO messages (id, data, timestamp) VALUES (?, ?, ?)"
-                    cur.execute(sql, (data['id'], json.dumps(data, ensure_ascii=False), data['timestamp']))
-                    db['conn'].commit()
-                    cleanup_old_contact_messages(db, cur, days=90)
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'id': data['id']}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /messages: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-
-            elif path == 'reviews':
-                try:
-                    author = (data.get('author') or data.get('name') or '').strip()
-                    comment = (data.get('comment') or '').strip()
-                    rating = data.get('rating')
-                    if not author or not comment or rating is None:
-                        return 400, headers, json.dumps({'error': 'Lipsește author, rating sau comment'}, ensure_ascii=False)
-                    r = int(rating)
-                    if r < 1 or r > 5:
-                        return 400, headers, json.dumps({'error': 'Rating între 1 și 5'}, ensure_ascii=False)
-                    rid = datetime.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:8]
-                    dt = datetime.now().strftime('%Y-%m-%d')
-                    db = get_db_connection()
-                    _ensure_reviews_table(db)
-                    cur = get_cursor(db)
-                    if db['type'] == 'neon':
-                        cur.execute(
-                            "INSERT INTO reviews (id, author, rating, comment, date, approved) VALUES (%s, %s, %s, %s, %s, true)",
-                            (rid, author, r, comment, dt)
-                        )
-                    else:
-                        cur.execute(
-                            "INSERT INTO reviews (id, author, rating, comment, date, approved) VALUES (?, ?, ?, ?, ?, 1)",
-                            (rid, author, r, comment, dt)
-                        )
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'id': rid}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /reviews: {str(e)}")
-                    print(traceback.format_exc())
-                    return 500, headers, json.dumps({'error': str(e)}, ensure_ascii=False)
-
-            elif path == 'admin/reviews':
-                if not _require_auth():
-                    return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-                try:
-                    author = (data.get('author') or data.get('name') or '').strip()
-                    comment = (data.get('comment') or '').strip()
-                    rating = data.get('rating')
-                    if 'approved' in data:
-                        approved = bool(data.get('approved'))
-                    else:
-                        approved = True
-                    if not author or not comment or rating is None:
-                        return 400, headers, json.dumps({'error': 'Lipsește author, rating sau comment'}, ensure_ascii=False)
-                    r = int(rating)
-                    if r < 1 or r > 5:
-                        return 400, headers, json.dumps({'error': 'Rating între 1 și 5'}, ensure_ascii=False)
-                    rid = datetime.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:8]
-                    dt = datetime.now().strftime('%Y-%m-%d')
-                    db = get_db_connection()
-                    _ensure_reviews_table(db)
-                    cur = get_cursor(db)
-                    if db['type'] == 'neon':
-                        cur.execute(
-                            "INSERT INTO reviews (id, author, rating, comment, date, approved) VALUES (%s, %s, %s, %s, %s, %s)",
-                            (rid, author, r, comment, dt, approved)
-                        )
-                    else:
-                        cur.execute(
-                            "INSERT INTO reviews (id, author, rating, comment, date, approved) VALUES (?, ?, ?, ?, ?, ?)",
-                            (rid, author, r, comment, dt, 1 if approved else 0)
-                        )
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'id': rid, 'date': dt}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /admin/reviews: {str(e)}")
-                    print(traceback.format_exc())
-                    return 500, headers, json.dumps({'error': str(e)}, ensure_ascii=False)
-            
-            elif path == 'certificates':
-                try:
-                    data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
-                    data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
-                    cert_type = data.get('type', 'certificat')
-                    
-                    print(f"📝 POST /certificates: Saving certificate id={data['id']}, type={cert_type}, title={data.get('title', 'N/A')}")
-                    
-                    # Store image as base64 in database (original behavior)
-                    image_data = data.get('image', '')
-                    if image_data:
-                        # Keep image as base64 in database
-                        print(f"✅ Certificate image will be stored as base64 in database (length: {len(image_data)} chars)")
+                for step in steps:
+                    if callable(step):
+                        step(db, cur)
                     else:
-                        print(f"⚠️ No image provided for certificate")
-                    
-                    db = get_db_connection()
-                    print(f"📊 Database connection: type={db['type']}, is_neon={db.get('is_neon', False)}")
-                    
-                    cur = get_cursor(db)
-                    data_json = json.dumps(data, ensure_ascii=False)
-                    
-                    if db['type'] == 'neon':
-                        sql = "INSERT INTO certificates (id, data, type, timestamp) VALUES (%s, %s, %s, %s) ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, type = EXCLUDED.type, timestamp = EXCLUDED.timestamp"
-                        print(f"📊 Executing PostgreSQL INSERT with ON CONFLICT...")
-                        cur.execute(sql, (data['id'], data_json, cert_type, data['timestamp']))
-                    else:
-                        sql = "INSERT OR REPLACE INTO certificates (id, data, type, timestamp) VALUES (?, ?, ?, ?)"
-                        print(f"📊 Executing SQLite INSERT OR REPLACE...")
-                        cur.execute(sql, (data['id'], data_json, cert_type, data['timestamp']))
-                    
-                    db['conn'].commit()
-                    print(f"✅ Certificate saved successfully")
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'id': data['id']}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    error_msg = str(e)
-                    traceback_str = traceback.format_exc()
-                    print(f"❌ Error in POST /certificates: {error_msg}")
-                    print(f"Traceback: {traceback_str}")
-                    # Return error response instead of raising to show user
-                    return 500, headers, json.dumps({'error': error_msg, 'success': False}, ensure_ascii=False)
-            
-            elif path == 'tiktok-videos':
-                try:
-                    videos = data.get('videos', [])
-                    if not isinstance(videos, list):
-                        return 400, headers, json.dumps({'error': 'Invalid videos'}, ensure_ascii=False)
-                    
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    last_updated = datetime.now().isoformat()
-                    sql = "INSERT INTO tiktok_videos (id, videos, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET videos = %s, last_updated = %s" if db['type'] == 'neon' else "INSERT OR REPLACE INTO tiktok_videos (id, videos, last_updated) VALUES (1, ?, ?)"
-                    videos_json = json.dumps(videos, ensure_ascii=False)
-                    if db['type'] == 'neon':
-                        cur.execute(sql, (videos_json, last_updated, videos_json, last_updated))
-                    else:
-                        cur.execute(sql, (videos_json, last_updated))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /tiktok-videos: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'locations':
-                try:
-                    # Extract locations array from data (admin.js sends { locations: [...] })
-                    locations = data.get('locations') if isinstance(data, dict) and 'locations' in data else data
-                    if not isinstance(locations, list):
-                        locations = []
-                    
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    last_updated = datetime.now().isoformat()
-                    sql = "INSERT INTO locations (id, data, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, last_updated = EXCLUDED.last_updated" if db['type'] == 'neon' else "INSERT OR REPLACE INTO locations (id, data, last_updated) VALUES (1, ?, ?)"
-                    locations_json = json.dumps(locations, ensure_ascii=False)
-                    if db['type'] == 'neon':
-                        cur.execute(sql, (locations_json, last_updated))
-                    else:
-                        cur.execute(sql, (locations_json, last_updated))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /locations: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'partners':
-                try:
-                    data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
-                    data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
-                    
-                    # Store image as base64 in database (original behavior)
-                    image_data = data.get('image', '')
-                    if image_data:
-                        # Keep image as base64 in database
-                        print(f"✅ Partner image will be stored as base64 in database (length: {len(image_data)} chars)")
-                    else:
-                        print(f"⚠️ No image provided for partner")
-                    
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    sql = "INSERT INTO partners (id, data, timestamp) VALUES (%s, %s, %s)" if db['type'] == 'neon' else "INSERT INTO partners (id, data, timestamp) VALUES (?, ?, ?)"
-                    cur.execute(sql, (data['id'], json.dumps(data, ensure_ascii=False), data['timestamp']))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'id': data['id']}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in POST /partners: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'site-texts':
-                try:
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    
-                    # Determine which column name to use (texts or data)
-                    column_name = None
-                    table_exists = False
-                    
-                    # First, check if table exists and which columns it has
-                    if db['type'] == 'neon':
-                        try:
-                            # Check if table exists
-                            cur.execute("""
-                                SELECT EXISTS (
-                                    SELECT FROM information_schema.tables 
-                                    WHERE table_name = 'site_texts'
-                                )
-                            """)
-                            table_exists = cur.fetchone()[0] if isinstance(cur.fetchone(), tuple) else cur.fetchone()['exists']
-                            
-                            if table_exists:
-                                # Check which columns exist
-                                cur.execute("""
-                                    SELECT column_name 
-                                    FROM information_schema.columns 
-                                    WHERE table_name='site_texts' AND column_name IN ('texts', 'data')
-                                """)
-                                columns = cur.fetchall()
-                                column_list = [col[0] if isinstance(col, tuple) else (col['column_name'] if isinstance(col, dict) else col) for col in columns]
-                                
-                                if 'texts' in column_list:
-                                    column_name = 'texts'
-                                elif 'data' in column_list:
-                                    column_name = 'data'
-                            
-                            if not table_exists or not column_name:
-                                # Create table with texts column
-                                cur.execute("""
-                                    CREATE TABLE IF NOT EXISTS site_texts (
-                                        id INTEGER PRIMARY KEY,
-                                        texts TEXT NOT NULL,
-                                        last_updated TEXT NOT NULL,
-                                        CONSTRAINT site_texts_single_row CHECK (id = 1)
-                                    )
-                                """)
-                                db['conn'].commit()
-                                column_name = 'texts'
-                        except Exception as check_error:
-                            print(f"Error checking/creating table: {str(check_error)}")
-                            import traceback
-                            print(traceback.format_exc())
-                            # Try simpler create without CHECK constraint
-                            try:
-                                cur.execute("""
-                                    CREATE TABLE IF NOT EXISTS site_texts (
-                                        id INTEGER PRIMARY KEY,
-                                        texts TEXT NOT NULL,
-                                        last_updated TEXT NOT NULL
-                                    )
-                                """)
-                                db['conn'].commit()
-                                column_name = 'texts'
-                            except Exception as create_error:
-                                print(f"Error creating table (simple): {str(create_error)}")
-                                raise
-                    else:
-                        # SQLite
-                        try:
-                            # Try to query with texts column
-                            cur.execute("SELECT texts FROM site_texts WHERE id = 1 LIMIT 1")
-                            column_name = 'texts'
-                            table_exists = True
-                        except:
-                            try:
-                                # Try with data column
-                                cur.execute("SELECT data FROM site_texts WHERE id = 1 LIMIT 1")
-                                column_name = 'data'
-                                table_exists = True
-                            except:
-                                # Table doesn't exist, create it
-                                cur.execute("""
-                                    CREATE TABLE IF NOT EXISTS site_texts (
-                                        id INTEGER PRIMARY KEY,
-                                        texts TEXT NOT NULL,
-                                        last_updated TEXT NOT NULL,
-                                        CHECK (id = 1)
-                                    )
-                                """)
-                                db['conn'].commit()
-                                column_name = 'texts'
-                    
-                    if not column_name:
-                        raise Exception("Could not determine or create column for site_texts")
-                    
-                    last_updated = datetime.now().isoformat()
-                    texts_json = json.dumps(data, ensure_ascii=False)
-                    
-                    # Use the determined column name
-                    if db['type'] == 'neon':
-                        sql = f"INSERT INTO site_texts (id, {column_name}, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET {column_name} = EXCLUDED.{column_name}, last_updated = EXCLUDED.last_updated"
-                        cur.execute(sql, (texts_json, last_updated))
-                    else:
-                        sql = f"INSERT OR REPLACE INTO site_texts (id, {column_name}, last_updated) VALUES (1, ?, ?)"
-                        cur.execute(sql, (texts_json, last_updated))
-                    
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    error_msg = str(e)
-                    traceback_str = traceback.format_exc()
-                    print(f"❌ Error in POST /site-texts: {error_msg}")
-                    print(f"Traceback: {traceback_str}")
-                    # Try to close connection if still open
-                    try:
-                        if 'db' in locals() and db and 'conn' in db:
-                            db['conn'].close()
-                    except:
-                        pass
-                    return 500, headers, json.dumps({'error': f'Failed to save site texts: {error_msg}', 'success': False}, ensure_ascii=False)
-            
-            elif path == 'admin-password':
-                current = data.get('currentPassword') or data.get('current')
-                new_pass = data.get('newPassword') or data.get('password')
-                if not new_pass or len(new_pass) < 6:
-                    return 400, headers, json.dumps({'error': 'Missing or weak new password (min 6 chars)'}, ensure_ascii=False)
-                db = get_db_connection()
-                cur = get_cursor(db)
-                is_neon = db['type'] == 'neon'
-                cur.execute("SELECT password FROM admin_password WHERE id = 1 LIMIT 1")
-                row = cur.fetchone()
-                stored = (dict(row)['password'] if row else None) if is_neon else (row['password'] if row else None)
-                if not stored:
-                    db['conn'].close()
-                    return 400, headers, json.dumps({'error': 'No password set'}, ensure_ascii=False)
-                if _looks_like_hash(stored):
-                    if not current or not _check_password(current, stored):
-                        db['conn'].close()
-                        return 401, headers, json.dumps({'error': 'Current password incorrect'}, ensure_ascii=False)
-                else:
-                    if not current or current != stored:
-                        db['conn'].close()
-                        return 401, headers, json.dumps({'error': 'Current password incorrect'}, ensure_ascii=False)
-                hashed = _hash_password(new_pass)
-                last_updated = datetime.now().isoformat()
-                if is_neon:
-                    cur.execute("INSERT INTO admin_password (id, password, last_updated) VALUES (1, %s, %s) ON CONFLICT (id) DO UPDATE SET password = EXCLUDED.password, last_updated = EXCLUDED.last_updated", (hashed, last_updated))
-                else:
-                    cur.execute("INSERT OR REPLACE INTO admin_password (id, password, last_updated) VALUES (1, ?, ?)", (hashed, last_updated))
-                db['conn'].commit()
+                        cur.execute(_ddl_for(db['type'], step))
+                cur.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, %s)" if is_neon
+                    else "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.now().isoformat())
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+            print(f"✅ Applied migration {version}: {name}")
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+    return applied
+
+def _ensure_schema(db):
+    """Apply pending migrations once per process; a no-op flag check afterwards."""
+    global _SCHEMA_READY, _schema_failed_at
+    if _SCHEMA_READY:
+        return
+    with _schema_lock:
+        if _SCHEMA_READY:
+            return
+        if not DB_AUTO_MIGRATE:
+            _SCHEMA_READY = True
+            return
+        if time.monotonic() - _schema_failed_at < _MIGRATION_RETRY_SECONDS and _schema_failed_at:
+            return
+        try:
+            started = time.perf_counter()
+            apply_migrations(db)
+            _record_phase('schema', started)
+            _SCHEMA_READY = True
+        except Exception as e:
+            import traceback
+            _schema_failed_at = time.monotonic()
+            print(f"❌ Schema migration failed: {str(e)}\n{traceback.format_exc()}")
+
+def _decode_image_data(image_data):
+    """
+    Decode image data to raw bytes.
+    image_data can be a data URI (data:image/...;base64,...), a bare base64
+    string or binary data. Returns (image_bytes, ext); ext defaults to 'jpg'.
+    """
+    if not isinstance(image_data, str):
+        print(f"📝 Using binary data, size: {len(image_data)} bytes")
+        return image_data, 'jpg'
+    if image_data.startswith('data:image/'):
+        # Extract base64 data from data URI
+        if ',' not in image_data:
+            raise ValueError("Invalid base64 data URI format - missing comma")
+        header, encoded = image_data.split(',', 1)
+        print(f"📝 Decoding base64 image, header: {header[:50]}...")
+        image_bytes = base64.b64decode(encoded)
+        print(f"📝 Decoded image size: {len(image_bytes)} bytes")
+        # Extract extension from header
+        format_match = header.split(';')[0].split('/')[-1]
+        return image_bytes, format_match if format_match in ['jpg', 'jpeg', 'png', 'gif', 'webp'] else 'jpg'
+    # Assume it's already base64 without data URI
+    print(f"📝 Decoding base64 string (no data URI)")
+    image_bytes = base64.b64decode(image_data)
+    print(f"📝 Decoded image size: {len(image_bytes)} bytes")
+    return image_bytes, 'jpg'
+
+def _api_headers(cache_max_age=None, etag=None):
+    h = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'GET, POST, PUT, PATCH, DELETE, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Content-Type': 'application/json'
+    }
+    if cache_max_age is not None:
+        h['Cache-Control'] = f'public, max-age={cache_max_age}, s-maxage={cache_max_age}'
+    if etag is not None:
+        h['ETag'] = etag
+    return h
+
+# A deploy can change a response's shape without touching the data, so the
+# build is part of every ETag.
+_ETAG_BUILD = (os.environ.get('VERCEL_GIT_COMMIT_SHA') or '')[:12]
+
+def _resource_etag(resource, version, variant):
+    """Weak ETag for one representation (variant) of a resource version."""
+    import zlib
+    build = f"-{_ETAG_BUILD}" if _ETAG_BUILD else ''
+    return f'W/"{resource}-{version}-{zlib.crc32(variant.encode("utf-8")):08x}{build}"'
+
+def _etag_matches(request_headers, etag):
+    """True if the request's If-None-Match lists etag (weak comparison)."""
+    if not request_headers or not hasattr(request_headers, 'get'):
+        return False
+    value = request_headers.get('If-None-Match') or request_headers.get('if-none-match')
+    if not value:
+        return False
+    if value.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for tag in value.split(','):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith('W/') else tag) == opaque:
+            return True
+    return False
+
+def _json_response(status, payload, headers=None):
+    """Build a (status, headers, body) tuple with a JSON body."""
+    return status, headers if headers is not None else _api_headers(), json.dumps(payload, ensure_ascii=False)
+
+def _list_response(req, items, next_cursor):
+    """Bare array for unpaginated requests, {items, next_cursor} for paginated ones."""
+    if req.page is None:
+        return _json_response(200, items)
+    return _json_response(200, {'items': items, 'next_cursor': next_cursor})
+
+# ----- Response compression -----
+# Content-coding is negotiated from Accept-Encoding: brotli when the optional
+# brotli package is installed and the client accepts it, else gzip. Bodies
+# below COMPRESS_MIN_BYTES are sent as is; streamed bodies are compressed
+# chunk by chunk.
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '5'))
+_COMPRESSIBLE_TYPES = ('application/json', 'text/')
+_UNCOMPRESSED_TYPES = ('text/event-stream',)  # compressors buffer; events must go out as produced
+_brotli = None
+
+def _available_encodings():
+    """Supported content-codings, most preferred first."""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return ('br', 'gzip') if _brotli else ('gzip',)
+
+def _accepted_encoding(request_headers):
+    """Best supported content-coding allowed by the request's Accept-Encoding, or None."""
+    if not request_headers or not hasattr(request_headers, 'get'):
+        return None
+    value = request_headers.get('Accept-Encoding') or request_headers.get('accept-encoding')
+    if not value:
+        return None
+    weights = {}
+    for part in value.split(','):
+        name, _, param = part.partition(';')
+        weight = 1.0
+        param = param.strip().replace(' ', '')
+        if param.startswith('q='):
+            try:
+                weight = float(param[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in _available_encodings():
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return _brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    import gzip
+    return gzip.compress(data, COMPRESS_GZIP_LEVEL, mtime=0)
+
+def _compress_stream(chunks, encoding):
+    try:
+        if encoding == 'br':
+            compressor = _brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+            compress, finish = compressor.process, compressor.finish
+        else:
+            import zlib
+            compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+            compress, finish = compressor.compress, compressor.flush
+        for chunk in chunks:
+            out = compress(chunk)
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _encode_response(status, headers, body, request_headers):
+    """Compress a JSON/text response for the client if it is worth it; always sets Vary."""
+    content_type = headers.get('Content-Type', '')
+    if ('Content-Encoding' in headers or not content_type.startswith(_COMPRESSIBLE_TYPES)
+            or content_type.startswith(_UNCOMPRESSED_TYPES)):
+        return status, headers, body
+    headers['Vary'] = 'Accept-Encoding'
+    if status != 200:
+        return status, headers, body
+    if isinstance(body, (str, bytes)):
+        if len(body) < COMPRESS_MIN_BYTES:
+            return status, headers, body
+        encoding = _accepted_encoding(request_headers)
+        if encoding is None:
+            return status, headers, body
+        body = _compress(body.encode('utf-8') if isinstance(body, str) else body, encoding)
+    else:
+        encoding = _accepted_encoding(request_headers)
+        if encoding is None:
+            return status, headers, body
+        body = _compress_stream(body, encoding)
+    headers['Content-Encoding'] = encoding
+    return status, headers, body
+
+def _json_array_stream(items, transform=None, chunk_size=64 * 1024):
+    """Serialize an iterable as a JSON array, yielding UTF-8 chunks of roughly chunk_size bytes."""
+    buf, size, sep = ['['], 1, ''
+    try:
+        for item in items:
+            text = json.dumps(transform(item) if transform else item, ensure_ascii=False)
+            buf.append(sep)
+            buf.append(text)
+            sep = ','
+            size += len(text) + 1
+            if size >= chunk_size:
+                yield ''.join(buf).encode('utf-8')
+                buf, size = [], 0
+    finally:
+        # Release the cursor/connection behind items even if the client went away
+        if hasattr(items, 'close'):
+            items.close()
+    buf.append(']')
+    yield ''.join(buf).encode('utf-8')
+
+def _streamed_list(req, db, sql, order_col, transform, where=(), params=()):
+    """
+    List response that takes ownership of db: the full list (no ?limit/?cursor)
+    is streamed row by row from the cursor, a page is buffered as usual.
+    """
+    if req.page is None:
+        sql, params = _keyset_sql(sql, order_col, None, where, params)
+        return 200, _api_headers(), _json_array_stream(db_iter(db, sql, params, close=True), transform)
+    try:
+        rows, next_cursor = db_query_page(db, sql, order_col, req.page, where, params)
+    finally:
+        db['conn'].close()
+    return _list_response(req, [transform(r) for r in rows], next_cursor)
+
+def _is_authorized(request_headers):
+    """True if the request carries a valid admin bearer token."""
+    t = _get_bearer_token(request_headers)
+    return bool(t and _verify_jwt(t))
+
+# ============================================================
+# Routing
+# ============================================================
+# Routes are registered once at import with @_route(method, pattern, ...).
+# Static paths resolve with a single dict lookup; patterns with <name>
+# segments are bucketed by (method, segment count, first segment).
+
+class _Request:
+    """Parsed API request passed to route handlers."""
+    __slots__ = ('method', 'path', 'query', 'body', 'data', 'headers', 'params', 'page', 'client')
+
+    def __init__(self, method, path, query, body, headers, params, client=None):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.data = None
+        self.headers = headers
+        self.params = params
+        self.page = None
+        self.client = client  # peer address, see _request_client
+
+class _Route:
+    """Route table entry: handler plus declarative auth/caching metadata."""
+    __slots__ = ('method', 'pattern', 'handler', 'auth', 'cache_max_age', 'json_body', 'paginate',
+                 'etag', 'segments', 'literals', 'param_slots')
+
+    def __init__(self, method, pattern, handler, auth, cache_max_age, json_body, paginate, etag):
+        self.method = method
+        self.pattern = pattern
+        self.handler = handler
+        self.auth = auth
+        self.cache_max_age = cache_max_age
+        self.json_body = json_body
+        self.paginate = paginate
+        self.etag = etag
+        self.segments = tuple(pattern.split('/')) if pattern else ()
+        # Precomputed for parameterized patterns (segment 0 is part of the bucket key)
+        self.literals = tuple((i, s) for i, s in enumerate(self.segments) if i and not s.startswith('<'))
+        self.param_slots = tuple((i, s[1:-1]) for i, s in enumerate(self.segments) if s.startswith('<'))
+
+_ROUTES = {}
+_PARAM_ROUTES = {}
+_ROUTE_METHODS = frozenset(('GET', 'POST', 'PUT', 'DELETE'))
+
+def _route(method, pattern, auth=False, cache_max_age=None, json_body=None, paginate=False, etag=None):
+    """
+    Register a handler for (method, pattern).
+    auth: require a valid admin bearer token.
+    cache_max_age: add public Cache-Control to 200 responses.
+    json_body: parse the body as JSON into req.data ('required' rejects an empty body,
+    'optional' accepts it). Defaults to 'required' for POST and 'optional' for PUT.
+    paginate: parse ?limit=&cursor= into req.page (see db_query_page). True for lists
+    keyed by a TEXT column and TEXT ids, else the (value, id) types of the cursor.
+    etag: resource name whose version (see bump_resource_version) tags 200 responses;
+    a matching If-None-Match gets a 304 without running the handler.
+    """
+    if json_body is None:
+        json_body = {'POST': 'required', 'PUT': 'optional'}.get(method)
+
+    def register(fn):
+        r = _Route(method, pattern, fn, auth, cache_max_age, json_body, paginate, etag)
+        if '<' in pattern:
+            key = (method, len(r.segments), r.segments[0])
+            _PARAM_ROUTES.setdefault(key, []).append(r)
+        else:
+            _ROUTES[(method, pattern)] = r
+        return fn
+    return register
+
+def _match_route(method, path):
+    """Resolve (method, path) to (route, params); (None, None) if no route matches."""
+    r = _ROUTES.get((method, path))
+    if r is not None:
+        return r, {}
+    if '/' not in path:
+        return None, None
+    segments = path.split('/')
+    for r in _PARAM_ROUTES.get((method, len(segments), segments[0]), ()):
+        for i, lit in r.literals:
+            if segments[i] != lit:
+                break
+        else:
+            params = {}
+            for i, name in r.param_slots:
+                if not segments[i]:
+                    break
+                params[name] = urllib.parse.unquote(segments[i]) if '%' in segments[i] else segments[i]
+            else:
+                return r, params
+    return None, None
+
+def _normalize_api_path(path, query):
+    """
+    Reduce the incoming path to the route key, e.g. '/api/messages/' -> 'messages'.
+    In Vercel, path can be /api/test, /api/index.py?path=/messages (rewrite), etc.
+    """
+    if not path:
+        path = ''
+    elif path.startswith('/api/'):
+        path = path[5:]
+    else:
+        path = path.strip()
+        if path.startswith('/api/'):
+            path = path[5:]
+        elif path.startswith('api/'):
+            path = path[4:]
+        elif path == '/api':
+            path = ''
+    if path.endswith('/') or path.startswith('/'):
+        path = path.strip('/')
+    # Vercel rewrite /api/* -> /api/index.py?path=/$1: use real path from query
+    if path == 'index.py' and query.get('path'):
+        path = query.pop('path') or ''
+        if isinstance(path, list):
+            path = path[0] if path else ''
+        path = path.strip().strip('/')
+    return path
+
+def _parse_json_body(body_data):
+    """Return body as a dict-like value; raises json.JSONDecodeError on malformed JSON."""
+    if isinstance(body_data, (dict, list)):
+        return body_data
+    if isinstance(body_data, str) and body_data.strip():
+        return json.loads(body_data)
+    return {}
+
+def handle_api_request(path, method, query, body_data, request_headers=None, client=None):
+    """Handle API request and return response (client: the peer's address, if known)"""
+    try:
+        route, prepared = _prepare_request(path, method, query, body_data, request_headers, client)
+        if route is None:
+            return prepared
+        return _run_route(route, prepared)
+    except Exception as e:
+        return _error_response(e)
+
+def _prepare_request(path, method, query, body_data, request_headers, client=None):
+    """Route, authorize and parse a request: (route, _Request), or (None, response) if it is answered already."""
+    headers = _api_headers()
+    if method == 'OPTIONS':
+        return None, (200, headers, '')
+
+    path = _normalize_api_path(path, query)
+    route, params = _match_route(method, path)
+    if route is None:
+        if method not in _ROUTE_METHODS:
+            return None, (405, headers, json.dumps({'error': 'Method not allowed'}, ensure_ascii=False))
+        return None, (404, headers, json.dumps({'error': 'Not found'}, ensure_ascii=False))
+
+    if route.auth and not _is_authorized(request_headers):
+        return None, (401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False))
+
+    req = _Request(method, path, query, body_data, request_headers, params, client)
+    if route.json_body:
+        if route.json_body == 'required' and not body_data:
+            return None, (400, headers, json.dumps({'error': 'No body data'}, ensure_ascii=False))
+        try:
+            req.data = _parse_json_body(body_data)
+        except json.JSONDecodeError as e:
+            return None, (400, headers, json.dumps({'error': f'Invalid JSON: {str(e)}'}, ensure_ascii=False))
+    if route.paginate:
+        try:
+            req.page = _parse_page(query, _TEXT_CURSOR if route.paginate is True else route.paginate)
+        except ValueError as e:
+            return None, (400, headers, json.dumps({'error': str(e)}, ensure_ascii=False))
+    return route, req
+
+def _run_route(route, req):
+    """Call the route handler (through the response cache for etag routes) and encode its response."""
+    try:
+        if route.etag:
+            status, out_headers, body = _serve_cached(req, route.etag, (route.etag,),
+                                                      lambda versions: route.handler(req), route.cache_max_age)
+        else:
+            status, out_headers, body = route.handler(req)
+            _apply_cache_control(route.cache_max_age, status, out_headers)
+    finally:
+        _flush_invalidations()
+    return _encode_response(status, out_headers, body, req.headers)
+
+def _error_response(e):
+    if isinstance(e, _PoolExhausted):
+        print(f"⚠️ {e}")
+        return _json_response(503, {'error': 'Server busy, try again'}, dict(_api_headers(), **{'Retry-After': '1'}))
+    import traceback
+    error_info = {'error': str(e)}
+    if os.environ.get('VERCEL_ENV') != 'production':
+        error_info['traceback'] = traceback.format_exc()
+    return 500, _api_headers(), json.dumps(error_info, ensure_ascii=False)
+
+def _apply_cache_control(cache_max_age, status, headers):
+    if cache_max_age is not None and status == 200 and 'Cache-Control' not in headers:
+        headers['Cache-Control'] = f'public, max-age={cache_max_age}, s-maxage={cache_max_age}'
+
+def _serve_cached(req, label, resources, build, cache_max_age=None, variant=None):
+    """
+    Serve a response derived from resources: from the response cache when the
+    entry is fresh (or its versions still match resource_versions), else by
+    calling build(versions). A matching If-None-Match gets a 304 either way.
+    variant identifies the representation (defaults to path + query).
+    """
+    if variant is None:
+        variant = f"{req.path}?{sorted(req.query.items())}"
+    key = (frozenset(resources), label, variant)
+    entry = _response_cache.get(key) if RESPONSE_CACHE_TTL > 0 else None
+    if entry is not None:
+        versions = entry.version
+    else:
+        # Read versions before building: a concurrent write can only make the
+        # tag older than the body, never newer.
+        db = get_db_connection()
+        try:
+            versions = get_resource_versions(db, resources)
+        finally:
+            db['conn'].close()
+        stale = _response_cache.get_stale(key) if RESPONSE_CACHE_TTL > 0 else None
+        if stale is not None and stale.version == versions:
+            _response_cache.touch(key)
+            _response_cache.stats['revalidated'] += 1
+            entry = stale
+    etag = _resource_etag(label, '.'.join(str(versions[r]) for r in resources), variant)
+    if _etag_matches(req.headers, etag):
+        return 304, _api_headers(cache_max_age, etag), ''
+    if entry is not None:
+        return entry.response(req.headers)
+
+    status, headers, body = build(versions)
+    _apply_cache_control(cache_max_age, status, headers)
+    if status == 200:
+        headers['ETag'] = etag
+        if RESPONSE_CACHE_TTL > 0 and isinstance(body, (str, bytes)):
+            entry = _CachedResponse(versions, status, dict(headers), body.encode('utf-8') if isinstance(body, str) else body)
+            _response_cache.put(key, entry, entry.size)
+            return entry.response(req.headers)
+    return status, headers, body
+
+# ----- POST /login (no auth) -----
+_UPSERT_ADMIN_PASSWORD = "INSERT INTO admin_password (id, password, last_updated) VALUES (1, ?, ?) ON CONFLICT (id) DO UPDATE SET password = EXCLUDED.password, last_updated = EXCLUDED.last_updated"
+
+@_route('POST', 'login', json_body=False)
+def _post_login(req):
+    try:
+        login_body = _parse_json_body(req.body)
+    except json.JSONDecodeError:
+        return _json_response(400, {'error': 'Invalid JSON'})
+    username = (login_body.get('username') or '').strip()
+    password = login_body.get('password') or ''
+    client = _request_client(req)
+    wait = _login_throttle.check(client)
+    if wait:
+        return _throttled_response(wait)
+    if username != ADMIN_USERNAME or not password:
+        _login_throttle.failed(client)
+        return _json_response(401, {'error': 'Invalid credentials'})
+    import hmac
+    db = get_db_connection()
+    try:
+        epoch = get_auth_epoch(db, fresh=True)
+        stored = get_admin_password(db, epoch)
+        if not stored:
+            ok = hmac.compare_digest(password.encode('utf-8'), b'admin123')
+            set_admin_password(db, _hash_password('admin123'), epoch)
+        elif _looks_like_hash(stored):
+            ok = _check_password(password, stored)
+        else:
+            ok = hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+            if ok:
+                set_admin_password(db, _hash_password(password), epoch)
+    except _PasswordHashBusy:
+        return _hash_busy_response()
+    finally:
+        db['conn'].close()
+    if not ok:
+        _login_throttle.failed(client)
+        return _json_response(401, {'error': 'Invalid credentials'})
+    _login_throttle.succeeded(client)
+    token = _create_jwt(ADMIN_USERNAME, epoch)
+    if hasattr(token, 'decode'):
+        token = token.decode('utf-8')
+    return _json_response(200, {'token': token})
+
+# ----- GET endpoints -----
+@_route('GET', '')
+def _get_root(req):
+    return _json_response(200, {
+        'status': 'ok',
+        'message': 'API is working. Use /api/test, /api/messages, etc.',
+        'use_neon': USE_NEON,
+        'db_type': 'neon' if USE_NEON else 'sqlite'
+    })
+
+@_route('GET', 'track-visit')
+def _get_track_visit(req):
+    record_visit(req.headers)
+    return _json_response(200, {'ok': True})
+
+@_route('GET', 'test')
+@_route('GET', 'health')
+def _get_health(req):
+    # Test database connection
+    db_status = {'connected': False, 'error': None, 'type': None}
+    try:
+        db = get_db_connection()
+        db_status['type'] = db['type']  # Set type before testing
+        print(f"Testing connection to: {db['type']}")
+        # Try a simple query
+        db_query_one(db, "SELECT 1 as test")
+        db['conn'].close()
+        db_status['connected'] = True
+    except Exception as e:
+        error_msg = str(e)
+        db_status['error'] = error_msg
+        print(f"Database connection error: {error_msg}")
+
+    return _json_response(200, {
+        'status': 'ok',
+        'use_neon': USE_NEON,
+        'db_type': 'neon' if USE_NEON else 'sqlite',
+        'has_neon_db_url': bool(NEON_DB_URL),
+        'database': db_status,
+        'pool': get_pool_stats(),
+        'cache': get_cache_stats(),
+        'visits': get_visit_buffer_stats(),
+        'cold_start': get_cold_start_profile()
+    })
+
+@_route('GET', 'validate', auth=True)
+def _get_validate(req):
+    return _json_response(200, {'ok': True})
+
+_VISIT_GRANULARITIES = ('day', 'week', 'month', 'year')
+
+def _visit_period(day, granularity):
+    """First day (YYYY-MM-DD) of the period containing day."""
+    if granularity == 'week':
+        d = datetime.strptime(day, '%Y-%m-%d')
+        return (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+    if granularity == 'month':
+        return day[:8] + '01'
+    if granularity == 'year':
+        return day[:5] + '01-01'
+    return day
+
+@_route('GET', 'admin/visitor-stats', auth=True)
+def _get_visitor_stats(req):
+    # ?from=&to= (YYYY-MM-DD, default: the last 7 days) and ?granularity=day|week|month|year
+    try:
+        today = datetime.now()
+        try:
+            to_day = datetime.strptime(req.query.get('to') or today.strftime('%Y-%m-%d'), '%Y-%m-%d')
+            from_day = datetime.strptime(req.query.get('from'), '%Y-%m-%d') if req.query.get('from') else to_day - timedelta(days=7)
+        except (TypeError, ValueError):
+            return _json_response(400, {'error': 'from/to must be YYYY-MM-DD'})
+        granularity = req.query.get('granularity') or 'day'
+        if granularity not in _VISIT_GRANULARITIES or from_day > to_day:
+            return _json_response(400, {'error': f"granularity must be one of {', '.join(_VISIT_GRANULARITIES)} and from <= to"})
+
+        flush_visits()  # include this instance's pending visits
+        db = get_db_connection()
+        rows = db_query(db, f"""
+            SELECT visit_date, unique_visitors, total_accesses{', hll' if granularity != 'day' else ''}
+            FROM visit_rollups
+            WHERE visit_date >= ? AND visit_date <= ?
+            ORDER BY visit_date DESC
+        """, (from_day.strftime('%Y-%m-%d'), to_day.strftime('%Y-%m-%d')))
+        db['conn'].close()
+        if granularity == 'day':
+            stats = [{
+                'date': r['visit_date'],
+                'unique_visitors': int(r['unique_visitors']),
+                'total_accesses': int(r['total_accesses'])
+            } for r in rows]
+            return _json_response(200, stats)
+
+        periods = {}  # rows are newest first, so periods come out newest first too
+        for r in rows:
+            period = periods.setdefault(_visit_period(r['visit_date'], granularity), [[], 0])
+            period[0].append(bytes(r['hll']))
+            period[1] += int(r['total_accesses'])
+        stats = [{'date': start, 'unique_visitors': hll_count(hll_union(sketches)), 'total_accesses': accesses}
+                 for start, (sketches, accesses) in periods.items()]
+        return _json_response(200, stats)
+    except Exception as e:
+        import traceback
+        print(f"Error in GET /admin/visitor-stats: {str(e)}\n{traceback.format_exc()}")
+        return _json_response(500, {'error': str(e)})
+
+@_route('GET', 'admin/retention', auth=True)
+def _get_retention(req):
+    db = get_db_connection()
+    status = get_retention_status(db)
+    db['conn'].close()
+    return _json_response(200, status)
+
+@_route('POST', 'admin/retention', auth=True, json_body=False)
+def _post_retention(req):
+    # Run retention now (all policies, or ?policy=name)
+    name = req.query.get('policy')
+    policies = [p for p in RETENTION_POLICIES if not name or p.name == name]
+    if not policies:
+        return _json_response(400, {'error': f"Unknown policy: {name}"})
+    return _json_response(200, {'deleted': run_retention(policies, force=True)})
+
+@_route('GET', 'admin/search', auth=True, paginate=(float, int))
+def _get_admin_search(req):
+    # ?q=words [&source=messages|chatbot_messages] [&limit=&cursor=]; always paginated, best match first
+    terms = _search_terms(req.query.get('q'))
+    if not terms:
+        return _json_response(400, {'error': 'Missing q'})
+    source = req.query.get('source')
+    if source and source not in SEARCH_SOURCES:
+        return _json_response(400, {'error': f"source must be one of {', '.join(SEARCH_SOURCES)}"})
+    limit, after = req.page or (API_PAGE_DEFAULT, None)
+    db = get_db_connection()
+    try:
+        hits, next_cursor = search_documents(db, terms, (source,) if source else SEARCH_SOURCES, limit, after)
+        records = _search_records(db, hits)
+    finally:
+        db['conn'].close()
+    return _json_response(200, {'items': [{
+        'source': h['source'],
+        'id': h['ref_id'],
+        'timestamp': h['timestamp'],
+        'score': float(h['score']),
+        'snippet': _search_snippet(h['body'], terms),
+        'record': records.get((h['source'], h['ref_id'])),
+    } for h in hits], 'next_cursor': next_cursor})
+
+@_route('GET', 'stats', auth=True)
+def _get_stats(req):
+    db = get_db_connection()
+    counts = dict(db_query_one(db, """
+        SELECT (SELECT COUNT(*) FROM messages) AS messages,
+               (SELECT COUNT(*) FROM certificates) AS certificates,
+               (SELECT COUNT(*) FROM partners) AS partners,
+               (SELECT COUNT(*) FROM reviews) AS reviews,
+               (SELECT COUNT(*) FROM chatbot_messages) AS chatbot_messages,
+               (SELECT COUNT(*) FROM chatbot_responses) AS chatbot_responses,
+               (SELECT videos FROM tiktok_videos WHERE id = 1) AS tiktok,
+               (SELECT data FROM locations WHERE id = 1) AS locations
+    """))
+    db['conn'].close()
+    for key in ('tiktok', 'locations'):
+        v = counts[key] or '[]'
+        counts[key] = len(json.loads(v) if isinstance(v, str) else v)
+    return _json_response(200, {k: int(v) for k, v in counts.items()})
+
+_MESSAGE_COLUMNS = "id, name, phone, email, message, data, timestamp"
+
+def _message_filters(query):
+    """Conditions and params for ?name=&phone=&email= (exact) and ?from=&to= (YYYY-MM-DD). Raises ValueError."""
+    clauses, params = [], []
+    for field in ('name', 'phone', 'email'):
+        if query.get(field):
+            clauses.append(f"{field} = ?")
+            params.append(query[field])
+    if query.get('from'):
+        clauses.append("epoch_ms >= ?")
+        params.append(_epoch_ms(datetime.strptime(query['from'], '%Y-%m-%d')))
+    if query.get('to'):
+        clauses.append("epoch_ms < ?")
+        params.append(_epoch_ms(datetime.strptime(query['to'], '%Y-%m-%d') + timedelta(days=1)))
+    return clauses, params
+
+@_route('GET', 'messages', paginate=True)
+def _get_messages(req):
+    try:
+        where, params = _message_filters(req.query)
+    except ValueError:
+        return _json_response(400, {'error': 'from/to must be YYYY-MM-DD'})
+    db = get_db_connection()
+    return _streamed_list(req, db, f"SELECT {_MESSAGE_COLUMNS} FROM messages", 'timestamp', _message_from_row,
+                          where, params)
+
+def _message_from_row(r):
+    return _record_from_row('messages', r)
+
+def _certificate_from_row(row):
+    cert_data = _record_from_row('certificates', row)
+    cert_data['type'] = row.get('type') or 'certificat'
+    return cert_data
+
+def _load_certificates(db, page=None, cert_type=None):
+    where, params = (["type = ?"], (cert_type,)) if cert_type else ((), ())
+    rows, next_cursor = db_query_page(db, "SELECT id, title, description, image, data, type, timestamp FROM certificates",
+                                      'timestamp', page, where, params)
+    return [_certificate_from_row(r) for r in rows], next_cursor
+
+@_route('GET', 'certificates', cache_max_age=300, paginate=True, etag='certificates')
+def _get_certificates(req):
+    # ?type=certificat|autorizatie uses idx_certificates_type_timestamp_id
+    db = get_db_connection()
+    certificates, next_cursor = _load_certificates(db, req.page, req.query.get('type'))
+    db['conn'].close()
+    return _list_response(req, certificates, next_cursor)
+
+@_route('GET', 'certificates/<id>', cache_max_age=300, etag='certificates')
+def _get_certificate(req):
+    db = get_db_connection()
+    row = db_query_one(db, "SELECT id, title, description, image, data, type, timestamp FROM certificates WHERE id = ?",
+                       (req.params['id'],))
+    db['conn'].close()
+    if not row:
+        return _json_response(404, {'error': 'Not found'})
+    return _json_response(200, _certificate_from_row(row))
+
+def _load_partners(db, page=None):
+    rows, next_cursor = db_query_page(db, "SELECT id, title, image, data, timestamp FROM partners", 'timestamp', page)
+    return [_record_from_row('partners', r) for r in rows], next_cursor
+
+@_route('GET', 'partners', cache_max_age=300, paginate=True, etag='partners')
+def _get_partners(req):
+    db = get_db_connection()
+    partners, next_cursor = _load_partners(db, req.page)
+    db['conn'].close()
+    return _list_response(req, partners, next_cursor)
+
+def _load_tiktok_videos(db):
+    row = db_query_one(db, "SELECT videos FROM tiktok_videos WHERE id = 1")
+    if row:
+        videos = json.loads(row['videos']) if isinstance(row['videos'], str) else row['videos']
+        return videos if isinstance(videos, list) else []
+    return ['7567003645250702614', '7564125179761167638', '7556587113244937475']
+
+@_route('GET', 'tiktok-videos', cache_max_age=300, etag='tiktok_videos')
+def _get_tiktok_videos(req):
+    db = get_db_connection()
+    videos = _load_tiktok_videos(db)
+    db['conn'].close()
+    return _json_response(200, videos)
+
+def _load_locations(db):
+    row = db_query_one(db, "SELECT data FROM locations WHERE id = 1")
+    if row:
+        locations = json.loads(row['data']) if isinstance(row['data'], str) else row['data']
+        return locations if isinstance(locations, list) else []
+    return []
+
+@_route('GET', 'locations', cache_max_age=300, etag='locations')
+def _get_locations(req):
+    db = get_db_connection()
+    locations = _load_locations(db)
+    db['conn'].close()
+    return _json_response(200, locations)
+
+@_route('GET', 'images/<hash>')
+def _get_image(req):
+    digest = req.params['hash'].lower()
+    if not _is_image_hash(digest):
+        return _json_response(404, {'error': 'Not found'})
+    # The URL is derived from the content, so it can be cached forever
+    headers = _api_headers(etag=f'"{digest}"')
+    headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    if _etag_matches(req.headers, headers['ETag']):
+        return 304, headers, ''
+    db = get_db_connection()
+    found = get_image(db, digest)
+    db['conn'].close()
+    if not found:
+        return _json_response(404, {'error': 'Not found'})
+    image_bytes, content_type = found
+    headers['Content-Type'] = content_type
+    return 200, headers, image_bytes
+
+def _load_reviews(db, page=None):
+    return db_query_page(db, "SELECT id, author, rating, comment, date FROM reviews", 'date', page)
+
+@_route('GET', 'reviews', cache_max_age=300, paginate=True, etag='reviews')
+def _get_reviews(req):
+    db = get_db_connection()
+    reviews, next_cursor = _load_reviews(db, req.page)
+    db['conn'].close()
+    return _list_response(req, reviews, next_cursor)
+
+@_route('GET', 'admin/reviews', auth=True, paginate=True)
+def _get_admin_reviews(req):
+    db = get_db_connection()
+    return _streamed_list(req, db, "SELECT id, author, rating, comment, date, approved FROM reviews", 'date',
+                          _admin_review_from_row)
+
+def _admin_review_from_row(r):
+    r['approved'] = bool(r['approved'])
+    return r
+
+def _load_chatbot_responses(db):
+    rows = db_query(db, "SELECT keyword, response FROM chatbot_responses ORDER BY keyword")
+    return {r['keyword']: r['response'] for r in rows}
+
+@_route('GET', 'chatbot-responses', etag='chatbot_responses')
+def _get_chatbot_responses(req):
+    db = get_db_connection()
+    responses = _load_chatbot_responses(db)
+    db['conn'].close()
+    return _json_response(200, responses)
+
+def _load_site_texts(db):
+    row = db_query_one(db, "SELECT texts FROM site_texts WHERE id = 1")
+    texts_data = row['texts'] if row else None
+    if texts_data:
+        texts = json.loads(texts_data) if isinstance(texts_data, str) else texts_data
+        return texts if isinstance(texts, dict) else {}
+    return {}
+
+@_route('GET', 'site-texts', etag='site_texts')
+def _get_site_texts(req):
+    try:
+        db = get_db_connection()
+        texts = _load_site_texts(db)
+        db['conn'].close()
+        return _json_response(200, texts)
+    except Exception as e:
+        import traceback
+        print(f"Error in GET /site-texts: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        # Return empty object instead of 500 error
+        return _json_response(200, {})
+
+# ----- GET /bootstrap -----
+# Everything the public home page loads, in one invocation: one connection,
+# one resource_versions lookup and one cacheable response. Sections use the
+# same loaders as their own endpoints. ?include=a,b selects sections;
+# ?track=1 also counts the page view (replacing the /track-visit call).
+_BOOTSTRAP_SECTIONS = {
+    'site-texts': ('site_texts', _load_site_texts),
+    'locations': ('locations', _load_locations),
+    'tiktok-videos': ('tiktok_videos', _load_tiktok_videos),
+    'partners': ('partners', lambda db: _load_partners(db)[0]),
+    'chatbot-responses': ('chatbot_responses', _load_chatbot_responses),
+    'reviews': ('reviews', lambda db: _load_reviews(db)[0]),
+    'certificates': ('certificates', lambda db: _load_certificates(db)[0]),
+}
+_BOOTSTRAP_DEFAULT = ('site-texts', 'locations', 'tiktok-videos', 'partners', 'chatbot-responses', 'reviews')
+
+@_route('GET', 'bootstrap')
+def _get_bootstrap(req):
+    include = req.query.get('include')
+    if isinstance(include, list):
+        include = ','.join(include)
+    names = tuple(dict.fromkeys(n.strip() for n in include.split(',') if n.strip())) if include else _BOOTSTRAP_DEFAULT
+    unknown = [n for n in names if n not in _BOOTSTRAP_SECTIONS]
+    if unknown or not names:
+        return _json_response(400, {'error': f"Unknown section(s): {', '.join(unknown)}",
+                                    'sections': list(_BOOTSTRAP_SECTIONS)})
+    track = req.query.get('track') == '1'
+    if track:
+        record_visit(req.headers)
+    resources = tuple(_BOOTSTRAP_SECTIONS[n][0] for n in names)
+
+    def build(versions):
+        db = get_db_connection()
+        try:
+            sections = {n: _BOOTSTRAP_SECTIONS[n][1](db) for n in names}
+        finally:
+            db['conn'].close()
+        return _json_response(200, {
+            'versions': {n: versions[_BOOTSTRAP_SECTIONS[n][0]] for n in names},
+            'sections': sections
+        })
+
+    status, headers, body = _serve_cached(req, 'bootstrap', resources, build, cache_max_age=300,
+                                          variant='bootstrap?' + ','.join(names))
+    if track:
+        # Every tracked page view has to reach the function to be counted
+        headers['Cache-Control'] = 'no-cache'
+    return status, headers, body
+
+# ----- POST endpoints -----
+@_route('POST', 'messages')
+def _post_messages(req):
+    data = req.data
+    try:
+        data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
+        data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+        db = get_db_connection()
+        values, extras = _split_record('messages', data)
+        db_execute(db, """
+            INSERT INTO messages (id, name, phone, email, message, data, timestamp, epoch_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (data['id'], *values, extras, data['timestamp'], _epoch_ms(data['timestamp'])))
+        index_search_document(db, 'messages', data['id'], data['timestamp'], _search_text(*values))
+        db['conn'].commit()
+        db['conn'].close()
+        return _json_response(200, {'success': True, 'id': data['id']})
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /messages: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+
+def _insert_review(data, default_approved):
+    """Validate and insert a review; returns (status, payload)."""
+    author = (data.get('author') or data.get('name') or '').strip()
+    comment = (data.get('comment') or '').strip()
+    rating = data.get('rating')
+    approved = bool(data.get('approved')) if 'approved' in data else default_approved
+    if not author or not comment or rating is None:
+        return 400, {'error': 'Lipsește author, rating sau comment'}
+    r = int(rating)
+    if r < 1 or r > 5:
+        return 400, {'error': 'Rating între 1 și 5'}
+    rid = datetime.now().strftime('%Y%m%d%H%M%S') + uuid.uuid4().hex[:8]
+    dt = datetime.now().strftime('%Y-%m-%d')
+    db = get_db_connection()
+    bump_resource_version(db, 'reviews')
+    db_execute(db, "INSERT INTO reviews (id, author, rating, comment, date, approved) VALUES (?, ?, ?, ?, ?, ?)",
+               (rid, author, r, comment, dt, approved), commit=True)
+    db['conn'].close()
+    return 200, {'success': True, 'id': rid, 'date': dt}
+
+@_route('POST', 'reviews')
+def _post_reviews(req):
+    try:
+        # Public submissions cannot choose their own approval state
+        data = {k: v for k, v in req.data.items() if k != 'approved'}
+        status, payload = _insert_review(data, default_approved=True)
+        payload.pop('date', None)
+        return _json_response(status, payload)
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /reviews: {str(e)}")
+        print(traceback.format_exc())
+        return _json_response(500, {'error': str(e)})
+
+@_route('POST', 'admin/reviews', auth=True)
+def _post_admin_reviews(req):
+    try:
+        return _json_response(*_insert_review(req.data, default_approved=True))
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /admin/reviews: {str(e)}")
+        print(traceback.format_exc())
+        return _json_response(500, {'error': str(e)})
+
+@_route('POST', 'certificates', auth=True)
+def _post_certificates(req):
+    data = req.data
+    try:
+        data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
+        data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
+        cert_type = data.get('type', 'certificat')
+
+        print(f"📝 POST /certificates: Saving certificate id={data['id']}, type={cert_type}, title={data.get('title', 'N/A')}")
+
+        db = get_db_connection()
+        print(f"📊 Database connection: type={db['type']}, is_neon={db.get('is_neon', False)}")
+
+        # Embedded base64 images go to the blob store; the JSON keeps only the URL
+        if _externalize_image(db, data):
+            print(f"✅ Certificate image stored at {data['image']}")
+        elif not data.get('image'):
+            print(f"⚠️ No image provided for certificate")
+        bump_resource_version(db, 'certificates')
+        values, extras = _split_record('certificates', data)
+        db_execute(db, """
+            INSERT INTO certificates (id, title, description, image, data, type, timestamp, epoch_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, description = EXCLUDED.description,
+                image = EXCLUDED.image, data = EXCLUDED.data, type = EXCLUDED.type,
+                timestamp = EXCLUDED.timestamp, epoch_ms = EXCLUDED.epoch_ms
+        """, (data['id'], *values, extras, cert_type, data['timestamp'], _epoch_ms(data['timestamp'])), commit=True)
+        print(f"✅ Certificate saved successfully")
+        db['conn'].close()
+        return _json_response(200, {'success': True, 'id': data['id']})
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        traceback_str = traceback.format_exc()
+        print(f"❌ Error in POST /certificates: {error_msg}")
+        print(f"Traceback: {traceback_str}")
+        # Return error response instead of raising to show user
+        return _json_response(500, {'error': error_msg, 'success': False})
+
+@_route('POST', 'tiktok-videos', auth=True)
+def _post_tiktok_videos(req):
+    data = req.data
+    try:
+        videos = data.get('videos', [])
+        if not isinstance(videos, list):
+            return _json_response(400, {'error': 'Invalid videos'})
+
+        db = get_db_connection()
+        bump_resource_version(db, 'tiktok_videos')
+        db_execute(db, """
+            INSERT INTO tiktok_videos (id, videos, last_updated) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET videos = EXCLUDED.videos, last_updated = EXCLUDED.last_updated
+        """, (json.dumps(videos, ensure_ascii=False), datetime.now().isoformat()), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True})
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /tiktok-videos: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+
+@_route('POST', 'locations', auth=True)
+def _post_locations(req):
+    data = req.data
+    try:
+        # Extract locations array from data (admin.js sends { locations: [...] })
+        locations = data.get('locations') if isinstance(data, dict) and 'locations' in data else data
+        if not isinstance(locations, list):
+            locations = []
+
+        db = get_db_connection()
+        bump_resource_version(db, 'locations')
+        db_execute(db, """
+            INSERT INTO locations (id, data, last_updated) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, last_updated = EXCLUDED.last_updated
+        """, (json.dumps(locations, ensure_ascii=False), datetime.now().isoformat()), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True})
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /locations: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+
+@_route('POST', 'partners', auth=True)
+def _post_partners(req):
+    data = req.data
+    try:
+        data['timestamp'] = data.get('timestamp') or datetime.now().isoformat()
+        data['id'] = data.get('id') or datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+        db = get_db_connection()
+
+        # Embedded base64 images go to the blob store; the JSON keeps only the URL
+        if _externalize_image(db, data):
+            print(f"✅ Partner image stored at {data['image']}")
+        elif not data.get('image'):
+            print(f"⚠️ No image provided for partner")
+        bump_resource_version(db, 'partners')
+        values, extras = _split_record('partners', data)
+        db_execute(db, "INSERT INTO partners (id, title, image, data, timestamp, epoch_ms) VALUES (?, ?, ?, ?, ?, ?)",
+                   (data['id'], *values, extras, data['timestamp'], _epoch_ms(data['timestamp'])), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True, 'id': data['id']})
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /partners: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+
+@_route('POST', 'site-texts', auth=True)
+def _post_site_texts(req):
+    data = req.data
+    try:
+        db = get_db_connection()
+        bump_resource_version(db, 'site_texts')
+        db_execute(db, """
+            INSERT INTO site_texts (id, texts, last_updated) VALUES (1, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET texts = EXCLUDED.texts, last_updated = EXCLUDED.last_updated
+        """, (json.dumps(data, ensure_ascii=False), datetime.now().isoformat()), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True})
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        traceback_str = traceback.format_exc()
+        print(f"❌ Error in POST /site-texts: {error_msg}")
+        print(f"Traceback: {traceback_str}")
+        # Try to close connection if still open
+        try:
+            if 'db' in locals() and db and 'conn' in db:
                 db['conn'].close()
-                return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-            
-            elif path == 'chatbot-responses':
-                try:
-                    keyword = data.get('keyword', '').strip().lower()
-                    response_text = data.get('response', '').strip()
-                    
-                    if not keyword or not response_text:
-                        return 400, headers, json.dumps({'error': 'Missing keyword or response'}, ensure_ascii=False)
-                    
-                    db = get_db_connection()
-                    _ensure_chatbot_responses_table(db)
-                    cur = get_cursor(db)
-                    timestamp = datetime.now().isoformat()
-                    
-                    # Insert or update chatbot response
-                    sql = "INSERT INTO chatbot_responses (keyword, response, timestamp) VALUES (%s, %s, %s) ON CONFLICT (keyword) DO UPDATE SET response = EXCLUDED.response, timestamp = EXCLUDED.timestamp" if db['type'] == 'neon' else "INSERT OR REPLACE INTO chatbot_responses (keyword, response, timestamp) VALUES (?, ?, ?)"
-                    
-                    if db['type'] == 'neon':
-                        cur.execute(sql, (keyword, response_text, timestamp))
-                    else:
-                        cur.execute(sql, (keyword, response_text, timestamp))
-                    
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'keyword': keyword}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    error_msg = str(e)
-                    traceback_str = traceback.format_exc()
-                    print(f"❌ Error in POST /chatbot-responses: {error_msg}")
-                    print(f"Traceback: {traceback_str}")
-                    return 500, headers, json.dumps({'error': error_msg, 'success': False}, ensure_ascii=False)
-            
-            elif path == 'chatbot' or path == 'chatbot-messages':
-                # Save chatbot message (user or bot)
-                try:
-                    message_type = data.get('type', 'user')
-                    message_text = data.get('message', '')
-                    timestamp = data.get('timestamp') or datetime.now().isoformat()
-                    
-                    if not message_text:
-                        return 400, headers, json.dumps({'error': 'Missing message'}, ensure_ascii=False)
-                    
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    
-                    message_data = {
-                        'type': message_type,
-                        'message': message_text,
-                        'timestamp': timestamp
-                    }
-                    message_json = json.dumps(message_data, ensure_ascii=False)
-                    
-                    sql = "INSERT INTO chatbot_messages (data, timestamp) VALUES (%s, %s)" if db['type'] == 'neon' else "INSERT INTO chatbot_messages (data, timestamp) VALUES (?, ?)"
-                    cur.execute(sql, (message_json, timestamp))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    error_msg = str(e)
-                    print(f"Error in POST /chatbot: {error_msg}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    return 500, headers, json.dumps({'error': error_msg, 'success': False}, ensure_ascii=False)
-            
-            elif path == 'chatbot-ai':
-                # AI-powered chatbot response generation
-                try:
-                    user_message = data.get('message', '').strip()
-                    
-                    if not user_message:
-                        return 400, headers, json.dumps({'error': 'Missing message'}, ensure_ascii=False)
-                    
-                    if not OPENAI_API_KEY:
-                        # Fallback to keyword-based responses if OpenAI key is not configured
-                        db = get_db_connection()
-                        cur = get_cursor(db)
-                        cur.execute("SELECT keyword, response FROM chatbot_responses ORDER BY keyword")
-                        rows = cur.fetchall()
-                        responses = {}
-                        for row in rows:
-                            row_dict = dict(row) if db['type'] == 'neon' else row
-                            responses[row_dict['keyword']] = row_dict['response']
-                        db['conn'].close()
-                        
-                        message_lower = user_message.lower()
-                        for keyword, response in responses.items():
-                            if keyword != 'default' and keyword in message_lower:
-                                return 200, headers, json.dumps({'response': response}, ensure_ascii=False)
-                        
-                        default_response = responses.get('default', 'Vă mulțumim pentru întrebare! Pentru informații detaliate despre serviciile noastre de deratizare, dezinsecție sau dezinfecție, vă rugăm să ne contactați direct. Oferim consultație gratuită și intervenție rapidă în 24 de ore pentru probleme urgente.')
-                        return 200, headers, json.dumps({'response': default_response}, ensure_ascii=False)
-                    
-                    # Use OpenAI API
-                    try:
-                        from openai import OpenAI
-                        
-                        client = OpenAI(api_key=OPENAI_API_KEY)
-                        
-                        # Get conversation history (last 10 messages)
-                        db = get_db_connection()
-                        cur = get_cursor(db)
-                        cur.execute("SELECT data, timestamp FROM chatbot_messages ORDER BY timestamp DESC LIMIT 10")
-                        rows = cur.fetchall()
-                        db['conn'].close()
-                        
-                        messages = [
-                            {
-                                "role": "system",
-                                "content": "Ești un asistent virtual pentru Sofimar SERV, o companie care oferă servicii profesionale de deratizare, dezinsecție și dezinfecție în România. Răspunde întotdeauna în română. Fii prietenos, profesional și concis. Dacă nu știi ceva, îndrumă utilizatorul să contacteze compania direct pentru consultație gratuită."
-                            }
-                        ]
-                        
-                        db_type = db['type']
-                        for row in reversed(rows):
-                            row_dict = dict(row) if db_type == 'neon' else row
-                            msg_data = json.loads(row_dict['data']) if isinstance(row_dict['data'], str) else row_dict['data']
-                            role = 'user' if msg_data.get('type') == 'user' else 'assistant'
-                            content = msg_data.get('message', '')
-                            if content:
-                                messages.append({"role": role, "content": content})
-                        
-                        messages.append({"role": "user", "content": user_message})
-                        
-                        response = client.chat.completions.create(
-                            model="gpt-3.5-turbo",
-                            messages=messages,
-                            max_tokens=300,
-                            temperature=0.7
-                        )
-                        
-                        ai_response = response.choices[0].message.content.strip()
-                        return 200, headers, json.dumps({'response': ai_response}, ensure_ascii=False)
-                    
-                    except ImportError:
-                        return 500, headers, json.dumps({'error': 'OpenAI library not installed'}, ensure_ascii=False)
-                    except Exception as e:
-                        import traceback
-                        error_msg = str(e)
-                        print(f"Error calling OpenAI API: {error_msg}")
-                        print(f"Traceback: {traceback.format_exc()}")
-                        
-                        db = get_db_connection()
-                        cur = get_cursor(db)
-                        cur.execute("SELECT keyword, response FROM chatbot_responses WHERE keyword = 'default' LIMIT 1")
-                        row = cur.fetchone()
-                        db['conn'].close()
-                        
-                        if row:
-                            row_dict = dict(row) if db['type'] == 'neon' else row
-                            fallback = row_dict['response']
-                        else:
-                            fallback = 'Ne pare rău, am întâmpinat o eroare. Vă rugăm să ne contactați direct pentru mai multe informații.'
-                        
-                        return 200, headers, json.dumps({'response': fallback}, ensure_ascii=False)
-                
-                except Exception as e:
-                    import traceback
-                    error_msg = str(e)
-                    print(f"Error in POST /chatbot-ai: {error_msg}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    return 500, headers, json.dumps({'error': error_msg}, ensure_ascii=False)
-            
-            else:
-                return 404, headers, json.dumps({'error': 'Not found'}, ensure_ascii=False)
-        
-        # PUT endpoints
-        elif method == 'PUT':
-            if not _require_auth():
-                return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-            try:
-                put_data = body_data if isinstance(body_data, dict) else json.loads(body_data) if body_data else {}
-            except json.JSONDecodeError:
-                return 400, headers, json.dumps({'error': 'Invalid JSON'}, ensure_ascii=False)
-            
-            if path == 'chatbot-responses':
-                try:
-                    keyword = (put_data.get('keyword') or '').strip().lower()
-                    response_text = (put_data.get('response') or '').strip()
-                    if not keyword or not response_text:
-                        return 400, headers, json.dumps({'error': 'Missing keyword or response'}, ensure_ascii=False)
-                    db = get_db_connection()
-                    _ensure_chatbot_responses_table(db)
-                    cur = get_cursor(db)
-                    timestamp = datetime.now().isoformat()
-                    if db['type'] == 'neon':
-                        cur.execute("UPDATE chatbot_responses SET response = %s, timestamp = %s WHERE keyword = %s", (response_text, timestamp, keyword))
-                    else:
-                        cur.execute("UPDATE chatbot_responses SET response = ?, timestamp = ? WHERE keyword = ?", (response_text, timestamp, keyword))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True, 'keyword': keyword}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"❌ Error in PUT /chatbot-responses: {str(e)}\n{traceback.format_exc()}")
-                    return 500, headers, json.dumps({'error': str(e), 'success': False}, ensure_ascii=False)
-            
-            return 404, headers, json.dumps({'error': 'Not found'}, ensure_ascii=False)
-        
-        # DELETE endpoints
-        elif method == 'DELETE':
-            if not _require_auth():
-                return 401, headers, json.dumps({'error': 'Unauthorized'}, ensure_ascii=False)
-            # Check for 'all' parameter first (for clearing all items)
-            if query.get('all') == '1':
-                if path == 'messages':
-                    try:
-                        db = get_db_connection()
-                        cur = get_cursor(db)
-                        cur.execute("DELETE FROM messages")
-                        db['conn'].commit()
-                        db['conn'].close()
-                        return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                    except Exception as e:
-                        import traceback
-                        print(f"Error in DELETE /messages?all=1: {str(e)}")
-                        print(f"Traceback: {traceback.format_exc()}")
-                        raise
-                
-            item_id = query.get('id')
-            keyword_param = query.get('keyword')
-            if path == 'chatbot-responses':
-                if not keyword_param and not item_id:
-                    return 400, headers, json.dumps({'error': 'Missing keyword parameter'}, ensure_ascii=False)
-            elif not item_id:
-                return 400, headers, json.dumps({'error': 'Missing id parameter'}, ensure_ascii=False)
-            
-            if path == 'messages':
-                try:
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    sql = "DELETE FROM messages WHERE id = %s" if db['type'] == 'neon' else "DELETE FROM messages WHERE id = ?"
-                    cur.execute(sql, (item_id,))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in DELETE /messages: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'certificates':
-                try:
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    sql = "DELETE FROM certificates WHERE id = %s" if db['type'] == 'neon' else "DELETE FROM certificates WHERE id = ?"
-                    cur.execute(sql, (item_id,))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in DELETE /certificates: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'partners':
-                try:
-                    db = get_db_connection()
-                    cur = get_cursor(db)
-                    sql = "DELETE FROM partners WHERE id = %s" if db['type'] == 'neon' else "DELETE FROM partners WHERE id = ?"
-                    cur.execute(sql, (item_id,))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in DELETE /partners: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'admin/reviews':
-                try:
-                    db = get_db_connection()
-                    _ensure_reviews_table(db)
-                    cur = get_cursor(db)
-                    sql = "DELETE FROM reviews WHERE id = %s" if db['type'] == 'neon' else "DELETE FROM reviews WHERE id = ?"
-                    cur.execute(sql, (item_id,))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in DELETE /admin/reviews: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            elif path == 'chatbot-responses':
-                keyword = keyword_param or item_id
-                try:
-                    db = get_db_connection()
-                    _ensure_chatbot_responses_table(db)
-                    cur = get_cursor(db)
-                    sql = "DELETE FROM chatbot_responses WHERE keyword = %s" if db['type'] == 'neon' else "DELETE FROM chatbot_responses WHERE keyword = ?"
-                    cur.execute(sql, (keyword,))
-                    db['conn'].commit()
-                    db['conn'].close()
-                    return 200, headers, json.dumps({'success': True}, ensure_ascii=False)
-                except Exception as e:
-                    import traceback
-                    print(f"Error in DELETE /chatbot-responses: {str(e)}")
-                    print(f"Traceback: {traceback.format_exc()}")
-                    raise
-            
-            else:
-                return 404, headers, json.dumps({'error': 'Not found'}, ensure_ascii=False)
-        
+        except:
+            pass
+        return _json_response(500, {'error': f'Failed to save site texts: {error_msg}', 'success': False})
+
+@_route('POST', 'admin-password', auth=True)
+def _post_admin_password(req):
+    data = req.data
+    current = data.get('currentPassword') or data.get('current')
+    new_pass = data.get('newPassword') or data.get('password')
+    if not new_pass or len(new_pass) < 6:
+        return _json_response(400, {'error': 'Missing or weak new password (min 6 chars)'})
+    client = _request_client(req)
+    wait = _login_throttle.check(client)
+    if wait:
+        return _throttled_response(wait)
+    import hmac
+    db = get_db_connection()
+    try:
+        stored = get_admin_password(db)
+        if not stored:
+            return _json_response(400, {'error': 'No password set'})
+        if _looks_like_hash(stored):
+            ok = bool(current) and _check_password(current, stored)
         else:
-            return 405, headers, json.dumps({'error': 'Method not allowed'}, ensure_ascii=False)
-    
+            ok = bool(current) and hmac.compare_digest(current.encode('utf-8'), stored.encode('utf-8'))
+        if not ok:
+            _login_throttle.failed(client)
+            return _json_response(401, {'error': 'Current password incorrect'})
+        hashed = _hash_password(new_pass)
+        # New auth epoch: every token issued so far stops working, except the one returned here
+        bump_resource_version(db, 'admin_password')
+        epoch = get_resource_versions(db, _AUTH_RESOURCES)['admin_password']
+        set_admin_password(db, hashed, epoch)
+    except _PasswordHashBusy:
+        return _hash_busy_response()
+    finally:
+        db['conn'].close()
+    token = _create_jwt(ADMIN_USERNAME, epoch)
+    if hasattr(token, 'decode'):
+        token = token.decode('utf-8')
+    return _json_response(200, {'success': True, 'token': token})
+
+@_route('POST', 'chatbot-responses', auth=True)
+def _post_chatbot_responses(req):
+    data = req.data
+    try:
+        keyword = data.get('keyword', '').strip().lower()
+        response_text = data.get('response', '').strip()
+
+        if not keyword or not response_text:
+            return _json_response(400, {'error': 'Missing keyword or response'})
+
+        # Insert or update chatbot response
+        db = get_db_connection()
+        bump_resource_version(db, 'chatbot_responses')
+        db_execute(db, """
+            INSERT INTO chatbot_responses (keyword, response, timestamp) VALUES (?, ?, ?)
+            ON CONFLICT (keyword) DO UPDATE SET response = EXCLUDED.response, timestamp = EXCLUDED.timestamp
+        """, (keyword, response_text, datetime.now().isoformat()), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True, 'keyword': keyword})
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        traceback_str = traceback.format_exc()
+        print(f"❌ Error in POST /chatbot-responses: {error_msg}")
+        print(f"Traceback: {traceback_str}")
+        return _json_response(500, {'error': error_msg, 'success': False})
+
+@_route('POST', 'chatbot', auth=True)
+@_route('POST', 'chatbot-messages', auth=True)
+def _post_chatbot_message(req):
+    # Save chatbot message (user or bot)
+    data = req.data
+    try:
+        message_type = data.get('type', 'user')
+        message_text = data.get('message', '')
+        timestamp = data.get('timestamp') or datetime.now().isoformat()
+
+        if not message_text:
+            return _json_response(400, {'error': 'Missing message'})
+
+        conversation_id = data.get('conversation_id')
+        if not _is_conversation_id(conversation_id):
+            conversation_id = None
+        db = get_db_connection()
+        record_chatbot_messages(db, conversation_id, [(message_type, message_text, timestamp)])
+        db['conn'].close()
+
+        return _json_response(200, {'success': True})
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        print(f"Error in POST /chatbot: {error_msg}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return _json_response(500, {'error': error_msg, 'success': False})
+
+_DEFAULT_CHATBOT_RESPONSE = 'Vă mulțumim pentru întrebare! Pentru informații detaliate despre serviciile noastre de deratizare, dezinsecție sau dezinfecție, vă rugăm să ne contactați direct. Oferim consultație gratuită și intervenție rapidă în 24 de ore pentru probleme urgente.'
+
+@_route('POST', 'chatbot-ai')
+@_route('POST', 'chatbot-ai/stream')
+def _post_chatbot_ai(req):
+    # Chatbot widget: AI response (keyword fallback), kept per conversation.
+    # /stream or Accept: text/event-stream relays the answer as Server-Sent Events.
+    try:
+        error, chat = _chatbot_request(req)
+        if error:
+            return error
+        conversation_id, user_message, asked_at, stream = chat
+        if stream:
+            return 200, _sse_headers(), _chatbot_event_stream(conversation_id, user_message, asked_at)
+
+        try:
+            reply = ''.join(_chatbot_reply_pieces(conversation_id, user_message)).strip()
+        except ImportError:
+            return _json_response(500, {'error': 'OpenAI library not installed'})
+        _save_chatbot_exchange(conversation_id, user_message, asked_at, reply)
+        return _json_response(200, {'response': reply, 'conversation_id': conversation_id})
+
+    except Exception as e:
+        import traceback
+        error_msg = str(e)
+        print(f"Error in POST /chatbot-ai: {error_msg}")
+        print(f"Traceback: {traceback.format_exc()}")
+        return _json_response(500, {'error': error_msg})
+
+def _chatbot_request(req):
+    """
+    Validate and rate-limit a /chatbot-ai request: (error response, None) or
+    (None, (conversation_id, message, asked_at, stream)). A missing or malformed
+    conversation id starts a new conversation; a well-formed id is taken as is
+    (an id no instance has seen simply has no history yet).
+    """
+    data = req.data
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return _json_response(400, {'error': 'Missing message'}), None
+    if len(user_message) > CHATBOT_MAX_MESSAGE_CHARS:
+        return _json_response(400, {'error': 'Message too long'}), None
+    if CHATBOT_RATE_LIMIT > 0:
+        wait = _chatbot_rate_limit.hit(_request_client(req))
+        if wait:
+            return _throttled_response(wait, 'Too many messages, try again later'), None
+
+    conversation_id = data.get('conversation_id')
+    if not _is_conversation_id(conversation_id):
+        conversation_id = _new_conversation_id()
+        _conversation_cache.put(conversation_id, ())
+    accept = (req.headers.get('Accept') or req.headers.get('accept') or '') if hasattr(req.headers, 'get') else ''
+    stream = req.path.endswith('/stream') or 'text/event-stream' in accept
+    return None, (conversation_id, user_message, datetime.now().isoformat(), stream)
+
+def _sse_headers():
+    headers = _api_headers()
+    headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    headers['Cache-Control'] = 'no-cache'
+    headers['X-Accel-Buffering'] = 'no'
+    return headers
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+def _chatbot_event_stream(conversation_id, user_message, asked_at):
+    """
+    SSE body for /chatbot-ai: 'conversation' {conversation_id}, then 'delta'
+    {text} per piece, then 'done' {response, conversation_id} once the exchange
+    is saved ('error' {error} instead if it fails).
+    """
+    yield _sse_event('conversation', {'conversation_id': conversation_id})
+    parts = []
+    try:
+        for piece in _chatbot_reply_pieces(conversation_id, user_message, stream=True):
+            parts.append(piece)
+            yield _sse_event('delta', {'text': piece})
+    except ImportError:
+        yield _sse_event('error', {'error': 'OpenAI library not installed'})
+        return
+    except Exception as e:
+        import traceback
+        print(f"Error in POST /chatbot-ai (stream): {str(e)}\n{traceback.format_exc()}")
+        yield _sse_event('error', {'error': str(e)})
+        return
+    reply = ''.join(parts).strip()
+    _save_chatbot_exchange(conversation_id, user_message, asked_at, reply)
+    yield _sse_event('done', {'response': reply, 'conversation_id': conversation_id})
+
+def _save_chatbot_exchange(conversation_id, user_message, asked_at, reply):
+    try:
+        db = get_db_connection()
+        record_chatbot_messages(db, conversation_id, [('user', user_message, asked_at),
+                                                      ('bot', reply, datetime.now().isoformat())])
+        db['conn'].close()
+    except Exception as e:
+        # Don't fail the answer because the transcript could not be saved
+        print(f"Error saving chatbot conversation: {str(e)}")
+
+_CHATBOT_SYSTEM_PROMPT = "Ești un asistent virtual pentru Sofimar SERV, o companie care oferă servicii profesionale de deratizare, dezinsecție și dezinfecție în România. Răspunde întotdeauna în română. Fii prietenos, profesional și concis. Dacă nu știi ceva, îndrumă utilizatorul să contacteze compania direct pentru consultație gratuită."
+_CHATBOT_ERROR_RESPONSE = 'Ne pare rău, am întâmpinat o eroare. Vă rugăm să ne contactați direct pentru mai multe informații.'
+
+def _chatbot_reply_pieces(conversation_id, user_message, stream=False):
+    """
+    Yield the answer in pieces: backend deltas when streaming, otherwise the
+    whole answer at once (also for cached and keyword answers). Falls back to
+    keywords on backend errors; raises ImportError without the OpenAI library.
+    """
+    answer, call = _chatbot_plan(conversation_id, user_message)
+    if call is None:
+        yield answer
+        return
+    backend, matcher, question, messages = call
+
+    parts = []
+    started = time.perf_counter()
+    try:
+        stream_fn = getattr(backend, 'stream', None) if stream else None
+        for piece in (stream_fn(messages) if stream_fn else (backend(messages),)):
+            if piece:
+                parts.append(piece)
+                yield piece
+    except ImportError:
+        raise
+    except Exception as e:
+        _log_chatbot_backend_error(e)
+        if not parts:
+            yield matcher.respond(user_message, _CHATBOT_ERROR_RESPONSE)
+        return
+    _chatbot_answered(matcher, question, ''.join(parts).strip(), started)
+
+def _chatbot_plan(conversation_id, user_message):
+    """
+    Everything before the backend call: (answer, None) when no call is needed
+    (no backend: keywords; cached opening question), else
+    (None, (backend, matcher, question, chat messages)).
+    """
+    backend = get_chatbot_backend()
+    matcher = get_chatbot_matcher()
+    if backend is None:
+        # Fallback to keyword-based responses if OpenAI key is not configured
+        return matcher.respond(user_message, _DEFAULT_CHATBOT_RESPONSE), None
+
+    history = get_conversation_history(conversation_id)
+    # Opening questions don't depend on any context, so their answers are shared
+    question = '' if history else _normalize_question(user_message)
+    if question:
+        cached = get_cached_answer(question, matcher.version)
+        if cached is not None:
+            return cached[0], None
+
+    messages = [{"role": "system", "content": _CHATBOT_SYSTEM_PROMPT}]
+    for message_type, content in history:
+        if content:
+            messages.append({"role": 'user' if message_type == 'user' else 'assistant', "content": content})
+    messages.append({"role": "user", "content": user_message})
+    return None, (backend, matcher, question, messages)
+
+def _log_chatbot_backend_error(e):
+    import traceback
+    print(f"Error calling OpenAI API: {str(e)}")
+    print(f"Traceback: {traceback.format_exc()}")
+
+def _chatbot_answered(matcher, question, reply, started):
+    """Count a completed backend call and share the answer to an opening question."""
+    latency_ms = int((time.perf_counter() - started) * 1000)
+    _count_answers(backend_calls=1, backend_ms=latency_ms)
+    if question and reply:
+        store_cached_answer(question, reply, matcher.version, latency_ms)
+
+# ----- PUT endpoints -----
+@_route('PUT', 'chatbot-responses', auth=True)
+def _put_chatbot_responses(req):
+    put_data = req.data
+    try:
+        keyword = (put_data.get('keyword') or '').strip().lower()
+        response_text = (put_data.get('response') or '').strip()
+        if not keyword or not response_text:
+            return _json_response(400, {'error': 'Missing keyword or response'})
+        db = get_db_connection()
+        bump_resource_version(db, 'chatbot_responses')
+        db_execute(db, "UPDATE chatbot_responses SET response = ?, timestamp = ? WHERE keyword = ?",
+                   (response_text, datetime.now().isoformat(), keyword), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True, 'keyword': keyword})
+    except Exception as e:
+        import traceback
+        print(f"❌ Error in PUT /chatbot-responses: {str(e)}\n{traceback.format_exc()}")
+        return _json_response(500, {'error': str(e), 'success': False})
+
+# ----- DELETE endpoints -----
+# Items are addressed either as ?id=<id> or as a path parameter (/certificates/<id>).
+def _delete_by_id(req, table, column='id', param='id'):
+    item_id = req.params.get(param) or req.query.get(param) or req.query.get('id')
+    if not item_id:
+        return _json_response(400, {'error': f'Missing {param} parameter'})
+    try:
+        db = get_db_connection()
+        bump_resource_version(db, table)
+        if table in SEARCH_SOURCES:
+            unindex_search_documents(db, table, item_id)
+        db_execute(db, f"DELETE FROM {table} WHERE {column} = ?", (item_id,), commit=True)
+        db['conn'].close()
+        return _json_response(200, {'success': True})
     except Exception as e:
         import traceback
-        error_info = {'error': str(e)}
-        if os.environ.get('VERCEL_ENV') != 'production':
-            error_info['traceback'] = traceback.format_exc()
-        return 500, headers, json.dumps(error_info, ensure_ascii=False)
+        print(f"Error in DELETE /{req.path}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        raise
+
+@_route('DELETE', 'messages', auth=True)
+@_route('DELETE', 'messages/<id>', auth=True)
+def _delete_messages(req):
+    # Check for 'all' parameter first (for clearing all items)
+    if req.query.get('all') == '1' and not req.params:
+        try:
+            db = get_db_connection()
+            unindex_search_documents(db, 'messages')
+            db_execute(db, "DELETE FROM messages", commit=True)
+            db['conn'].close()
+            return _json_response(200, {'success': True})
+        except Exception as e:
+            import traceback
+            print(f"Error in DELETE /messages?all=1: {str(e)}")
+            print(f"Traceback: {traceback.format_exc()}")
+            raise
+    return _delete_by_id(req, 'messages')
+
+@_route('DELETE', 'certificates', auth=True)
+@_route('DELETE', 'certificates/<id>', auth=True)
+def _delete_certificates(req):
+    return _delete_by_id(req, 'certificates')
+
+@_route('DELETE', 'partners', auth=True)
+@_route('DELETE', 'partners/<id>', auth=True)
+def _delete_partners(req):
+    return _delete_by_id(req, 'partners')
+
+@_route('DELETE', 'admin/reviews', auth=True)
+@_route('DELETE', 'admin/reviews/<id>', auth=True)
+def _delete_admin_reviews(req):
+    return _delete_by_id(req, 'reviews')
+
+@_route('DELETE', 'chatbot-responses', auth=True)
+@_route('DELETE', 'chatbot-responses/<keyword>', auth=True)
+def _delete_chatbot_responses(req):
+    return _delete_by_id(req, 'chatbot_responses', column='keyword', param='keyword')
+
 
 class handler(BaseHTTPRequestHandler):
     """Vercel Python serverless function handler"""
@@ -1678,6 +3668,7 @@ class handler(BaseHTTPRequestHandler):
         self._handle_request('OPTIONS')
     
     def _handle_request(self, method):
+        started = time.perf_counter()
         try:
             # Parse path - Vercel passes the full path including /api/
             raw_path = self.path
@@ -1693,33 +3684,232 @@ class handler(BaseHTTPRequestHandler):
                 query_params = parse_qs(parsed_url.query)
                 query = {k: v[0] if len(v) == 1 else v for k, v in query_params.items()}
             
-            # Get body
+            # Get body (always read it, so a kept-alive connection stays in sync)
             body_data = ''
-            if method in ['POST', 'PUT', 'PATCH']:
-                content_length = int(self.headers.get('Content-Length', 0))
-                if content_length > 0:
-                    body_str = self.rfile.read(content_length).decode('utf-8')
-                    try:
-                        body_data = json.loads(body_str)
-                    except:
-                        body_data = body_str
+            content_length = int(self.headers.get('Content-Length', 0))
+            raw_body = self.rfile.read(content_length) if content_length > 0 else b''
+            if method in ['POST', 'PUT', 'PATCH'] and raw_body:
+                body_str = raw_body.decode('utf-8')
+                try:
+                    body_data = json.loads(body_str)
+                except:
+                    body_data = body_str
             
             # Handle request
-            status_code, headers, body = handle_api_request(path, method, query, body_data, self.headers)
+            status_code, headers, body = handle_api_request(path, method, query, body_data, self.headers,
+                                                            self.client_address[0] if self.client_address else None)
             
             # Send response
-            self.send_response(status_code)
-            for key, value in headers.items():
-                self.send_header(key, value)
-            self.end_headers()
-            if body:
-                self.wfile.write(body.encode('utf-8'))
+            if isinstance(body, (str, bytes)):
+                self._send_body(status_code, headers, body.encode('utf-8') if isinstance(body, str) else body)
+            else:
+                self._send_stream(status_code, headers, body)
+            _record_phase('first_request', started)
+            # Deferred writes run once the client has its response
+            flush_visits(due_only=True)
+            maybe_run_retention()
         
         except Exception as e:
             import traceback
-            error_body = json.dumps({'error': str(e), 'traceback': traceback.format_exc()}, ensure_ascii=False)
+            error_body = json.dumps({'error': str(e), 'traceback': traceback.format_exc()}, ensure_ascii=False).encode('utf-8')
             self.send_response(500)
             self.send_header('Content-Type', 'application/json')
             self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Content-Length', str(len(error_body)))
             self.end_headers()
-            self.wfile.write(error_body.encode('utf-8'))
+            self.wfile.write(error_body)
+
+    def _send_body(self, status_code, headers, body):
+        self.send_response(status_code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status_code != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _send_stream(self, status_code, headers, chunks):
+        """Write an iterator of byte chunks as they are produced (chunked on HTTP/1.1)."""
+        chunked = self.protocol_version >= 'HTTP/1.1' and self.request_version >= 'HTTP/1.1'
+        self.send_response(status_code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            # HTTP/1.0 has no chunked encoding: the end of the body is the end of the connection
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if chunked:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                self.wfile.flush()
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            # Headers are already sent: log and drop the connection so the client sees a truncated body
+            import traceback
+            print(f"❌ Error while streaming response: {str(e)}\n{traceback.format_exc()}")
+            self.close_connection = True
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+# ============================================================
+# Cold start
+# ============================================================
+# A new instance pays for importing this module, the first DB connection
+# (psycopg2.connect with TLS to Neon), the schema check and the lazy imports
+# (jwt, werkzeug, openai) inside whichever request comes first. The first
+# duration of each phase is recorded (cheap, always on) and reported on
+# /health as `cold_start`; COLD_START_PROFILE=1 also logs each phase as it
+# completes. prewarm() runs those phases ahead of time: at module load with
+# PREWARM=1 (PREWARM=background in a daemon thread, so the first request
+# overlaps it), and always at startup of the standalone and ASGI servers.
+# PREWARM_PATHS are GET routes whose responses are built into the cache.
+
+COLD_START_PROFILE = os.environ.get('COLD_START_PROFILE', '0') != '0'
+PREWARM = os.environ.get('PREWARM', '0').lower()
+PREWARM_PATHS = tuple(p for p in os.environ.get('PREWARM_PATHS', '/api/bootstrap').split(',') if p)
+
+_cold_start_phases = {}
+
+def _record_phase(name, started):
+    """Record how long a cold-start phase took, the first time it completes."""
+    if name in _cold_start_phases:
+        return
+    ms = _cold_start_phases[name] = round((time.perf_counter() - started) * 1000, 2)
+    if COLD_START_PROFILE:
+        print(f"⏱️ cold start: {name} {ms:g} ms")
+
+def get_cold_start_profile():
+    """Phase -> ms for this instance (exposed on /health)."""
+    return {'pid': os.getpid(), 'prewarm': PREWARM, 'phases': dict(_cold_start_phases)}
+
+def _prewarm_imports():
+    modules = ['jwt', 'werkzeug.security']
+    if USE_NEON:
+        modules += ['psycopg2', 'psycopg2.extras']
+    if CHATBOT_BACKEND == 'openai' and OPENAI_API_KEY:
+        modules.append('openai')
+    import importlib
+    for name in modules:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"⚠️ Prewarm: cannot import {name}: {e}")
+            continue
+        _record_phase(f'import {name}', started)
+    _available_encodings()
+
+def prewarm():
+    """Import lazy dependencies, open a DB connection (migrating if needed) and fill hot caches."""
+    started = time.perf_counter()
+    try:
+        _prewarm_imports()
+        db = get_db_connection()
+        try:
+            db_query_one(db, "SELECT 1 AS ok")
+        finally:
+            db['conn'].close()
+        get_chatbot_matcher()
+        for path in PREWARM_PATHS:
+            status, _, body = handle_api_request(path, 'GET', {}, '', {})
+            if hasattr(body, 'close'):
+                body.close()
+            if status != 200:
+                print(f"⚠️ Prewarm: GET {path} returned {status}")
+    except Exception as e:
+        import traceback
+        print(f"❌ Prewarm failed: {str(e)}\n{traceback.format_exc()}")
+    _record_phase('prewarm', started)
+
+_record_phase('import', _IMPORT_STARTED)
+if PREWARM in ('1', 'true', 'on'):
+    prewarm()
+elif PREWARM == 'background':
+    threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+# ============================================================
+# Command line
+# ============================================================
+
+def _cli_migrate(args):
+    global _SCHEMA_READY
+    _SCHEMA_READY = True  # migrate explicitly below, not as a side effect of connecting
+    db = get_db_connection()
+    try:
+        if args.status:
+            cur = get_cursor(db)
+            current = _schema_version(db, cur)
+            db['conn'].commit()
+            print(f"{db['type']}: schema version {current}")
+            for version, name, _ in _MIGRATIONS:
+                print(f"  [{'x' if version <= current else ' '}] {version}: {name}")
+            return 0
+        applied = apply_migrations(db)
+        print(f"{db['type']}: applied {len(applied)} migration(s)" if applied else f"{db['type']}: schema is up to date")
+        return 0
+    finally:
+        db['conn'].close()
+
+def _cli_retention(args):
+    if args.status:
+        db = get_db_connection()
+        try:
+            for row in get_retention_status(db):
+                keep = f"{row['days']:g} days" if row['days'] > 0 else 'kept'
+                print(f"  {row['policy']}: {keep}, last run {row['last_run_at'] or 'never'} ({row['deleted'] or 0} deleted)")
+        finally:
+            db['conn'].close()
+        return 0
+    policies = [p for p in RETENTION_POLICIES if not args.policy or p.name in args.policy]
+    for name, deleted in run_retention(policies, force=True).items():
+        print(f"{name}: deleted {deleted} row(s)")
+    return 0
+
+def _cli_serve(args):
+    import sys
+    try:
+        from . import _server
+    except ImportError:
+        # Run as a script (this module is __main__): let _server's `import index`
+        # find this module instead of loading a second copy with its own pools and buffers
+        sys.modules.setdefault('index', sys.modules[__name__])
+        import _server
+    return _server.serve(args.host, args.port, args.workers, args.queue, args.static)
+
+def _cli(argv=None):
+    """Maintenance commands: python api/index.py migrate [--status] | retention [--status] [--policy NAME] | serve"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='python api/index.py', description='Sofimar SERV API maintenance commands')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('migrate', help='apply pending schema migrations')
+    p.add_argument('--status', action='store_true', help='list applied and pending migrations without applying')
+    p.set_defaults(func=_cli_migrate)
+    p = sub.add_parser('retention', help='delete rows past their retention period now')
+    p.add_argument('--status', action='store_true', help='show policies and their last run without deleting')
+    p.add_argument('--policy', action='append', choices=[p.name for p in RETENTION_POLICIES],
+                   help='only this policy (repeatable)')
+    p.set_defaults(func=_cli_retention)
+    p = sub.add_parser('serve', help='run the API and the static build (dist/) on a multi-threaded HTTP/1.1 server')
+    p.add_argument('--host', help='bind address (SERVER_HOST, default 0.0.0.0)')
+    p.add_argument('--port', type=int, help='port (PORT / SERVER_PORT, default 8000)')
+    p.add_argument('--workers', type=int, help='worker threads (SERVER_WORKERS, default 16)')
+    p.add_argument('--queue', type=int, help='accepted connections waiting for a worker before 503 (SERVER_QUEUE, default 64)')
+    p.add_argument('--static', help='static build directory (SERVER_STATIC_DIR, default dist/)')
+    p.set_defaults(func=_cli_serve)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(_cli())
@@ -1,18 +1,33 @@
 -- Neon PostgreSQL Schema pentru Sofimar SERV
 -- Rulează acest script în SQL Editor din Neon Dashboard
+-- Notă: api/index.py aplică automat aceeași schemă prin migrații versionate
+-- (tabela schema_version); manual: python api/index.py migrate
 
--- Messages table
+-- Applied migrations (managed by api/index.py)
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TEXT NOT NULL
+);
+
+-- Messages table (data = extra form fields, as JSON)
 CREATE TABLE IF NOT EXISTS messages (
     id TEXT PRIMARY KEY,
     data TEXT NOT NULL,
-    timestamp TEXT NOT NULL
+    timestamp TEXT NOT NULL,
+    name TEXT,
+    phone TEXT,
+    email TEXT,
+    message TEXT,
+    epoch_ms BIGINT
 );
 
 -- Chatbot messages table
 CREATE TABLE IF NOT EXISTS chatbot_messages (
     id SERIAL PRIMARY KEY,
     data TEXT NOT NULL,
-    timestamp TEXT NOT NULL
+    timestamp TEXT NOT NULL,
+    conversation_id TEXT
 );
 
 -- Visits table
@@ -26,14 +41,21 @@ CREATE TABLE IF NOT EXISTS certificates (
     id TEXT PRIMARY KEY,
     data TEXT NOT NULL,
     type TEXT NOT NULL DEFAULT 'certificat',
-    timestamp TEXT NOT NULL
+    timestamp TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    image TEXT,
+    epoch_ms BIGINT
 );
 
 -- Partners table
 CREATE TABLE IF NOT EXISTS partners (
     id TEXT PRIMARY KEY,
     data TEXT NOT NULL,
-    timestamp TEXT NOT NULL
+    timestamp TEXT NOT NULL,
+    title TEXT,
+    image TEXT,
+    epoch_ms BIGINT
 );
 
 -- Site texts table (single row with id = 1)
@@ -74,7 +96,7 @@ CREATE TABLE IF NOT EXISTS reviews (
     approved BOOLEAN NOT NULL DEFAULT false
 );
 CREATE INDEX IF NOT EXISTS idx_reviews_approved ON reviews(approved);
-CREATE INDEX IF NOT EXISTS idx_reviews_date ON reviews(date);
+CREATE INDEX IF NOT EXISTS idx_reviews_date_id ON reviews(date, id);
 
 -- Chatbot responses table
 CREATE TABLE IF NOT EXISTS chatbot_responses (
@@ -93,9 +115,70 @@ CREATE TABLE IF NOT EXISTS site_visits (
 );
 CREATE INDEX IF NOT EXISTS idx_site_visits_date ON site_visits(visit_date);
 
+-- Imagini (certificate/parteneri), adresate după SHA-256: /api/images/<hash>
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    content_type TEXT NOT NULL,
+    data BYTEA NOT NULL,
+    size INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Versiuni per resursă (ETag pentru GET-urile publice), incrementate la fiecare scriere
+CREATE TABLE IF NOT EXISTS resource_versions (
+    resource TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+-- Chatbot answers cache (normalized question -> answer)
+CREATE TABLE IF NOT EXISTS chatbot_answers (
+    question TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    responses_version INTEGER NOT NULL,
+    latency_ms INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Daily visitor rollups (exact counts + HyperLogLog sketch of the day's IPs)
+CREATE TABLE IF NOT EXISTS visit_rollups (
+    visit_date TEXT PRIMARY KEY,
+    unique_visitors INTEGER NOT NULL,
+    total_accesses INTEGER NOT NULL,
+    hll BYTEA NOT NULL
+);
+
+-- Last run of each retention policy
+CREATE TABLE IF NOT EXISTS retention_runs (
+    policy TEXT PRIMARY KEY,
+    last_run_at TEXT NOT NULL,
+    deleted INTEGER NOT NULL,
+    duration_ms INTEGER NOT NULL
+);
+
+-- Admin search (/api/admin/search): one document per message / chatbot message
+CREATE TABLE IF NOT EXISTS search_documents (
+    id SERIAL PRIMARY KEY,
+    source TEXT NOT NULL,
+    ref_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    body TEXT NOT NULL,
+    tsv tsvector,
+    UNIQUE (source, ref_id)
+);
+CREATE INDEX IF NOT EXISTS idx_search_documents_tsv ON search_documents USING GIN (tsv);
+CREATE INDEX IF NOT EXISTS idx_search_documents_source_timestamp ON search_documents(source, timestamp);
+
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp_id ON messages(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_messages_name ON messages(name);
+CREATE INDEX IF NOT EXISTS idx_messages_phone ON messages(phone);
+CREATE INDEX IF NOT EXISTS idx_messages_email ON messages(email);
+CREATE INDEX IF NOT EXISTS idx_messages_epoch_ms ON messages(epoch_ms);
 CREATE INDEX IF NOT EXISTS idx_chatbot_messages_timestamp ON chatbot_messages(timestamp);
+CREATE INDEX IF NOT EXISTS idx_chatbot_messages_conversation ON chatbot_messages(conversation_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_chatbot_answers_created_at ON chatbot_answers(created_at);
 CREATE INDEX IF NOT EXISTS idx_certificates_id ON certificates(id);
-CREATE INDEX IF NOT EXISTS idx_certificates_timestamp ON certificates(timestamp);
-CREATE INDEX IF NOT EXISTS idx_partners_timestamp ON partners(timestamp);
+CREATE INDEX IF NOT EXISTS idx_certificates_timestamp_id ON certificates(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_certificates_type_timestamp_id ON certificates(type, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_partners_timestamp_id ON partners(timestamp, id);
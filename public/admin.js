@@ -91,6 +91,11 @@ async function login(username, password) {
             body: JSON.stringify({ username: (username || '').trim(), password: password || '' })
         });
         const data = await res.json().catch(() => ({}));
+        if (res.status === 429) {
+            errEl.textContent = `Prea multe încercări eșuate. Încearcă din nou peste ${data.retry_after || res.headers.get('Retry-After') || 'câteva'} secunde.`;
+            errEl.classList.add('show');
+            return false;
+        }
         if (!res.ok || !data.token) {
             errEl.textContent = data.error || 'Utilizator sau parolă incorectă!';
             errEl.classList.add('show');
@@ -156,6 +161,16 @@ function initializeEventListeners() {
         });
     }
 
+    // Search messages (debounced; empty box shows the full list again)
+    const messageSearch = document.getElementById('messageSearch');
+    if (messageSearch) {
+        let searchTimer = null;
+        messageSearch.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(loadMessages, 300);
+        });
+    }
+
     // Add video button
     const addVideoBtn = document.getElementById('addVideoBtn');
     if (addVideoBtn) {
@@ -511,12 +526,14 @@ async function loadMessages() {
         return;
     }
     
-    const messages = await getMessages();
+    const searchInput = document.getElementById('messageSearch');
+    const query = searchInput ? searchInput.value.trim() : '';
+    const messages = query ? await searchMessages(query) : await getMessages();
     console.log('Total messages to display:', messages.length);
     
     const withId = messages.filter((msg) => msg && msg.id);
     if (withId.length === 0) {
-        messagesList.innerHTML = '<p class="empty-state">Nu există mesaje.</p>';
+        messagesList.innerHTML = `<p class="empty-state">${query ? 'Niciun mesaj găsit.' : 'Nu există mesaje.'}</p>`;
         return;
     }
 
@@ -543,7 +560,7 @@ async function loadMessages() {
                         <button type="button" class="message-delete" data-message-id="${mid}" onclick="deleteMessage(this)">Șterge</button>
                     </div>
                 </div>
-                <div class="message-content">${escapeHtml(msg.message)}</div>
+                <div class="message-content">${msg.snippet != null ? msg.snippet : escapeHtml(msg.message)}</div>
             </div>
         `;
     }).join('');
@@ -556,6 +573,14 @@ async function getMessages() {
     return Array.isArray(messages) ? messages : [];
 }
 
+async function searchMessages(query) {
+    // Ranked full-text search; snippet is HTML-escaped by the API, with matches in <mark>
+    const res = await apiRequest(`admin/search?source=messages&q=${encodeURIComponent(query)}`);
+    if (!res || !res.ok) return [];
+    const data = await res.json().catch(() => ({}));
+    return (data.items || []).filter((item) => item.record).map((item) => ({ ...item.record, snippet: item.snippet }));
+}
+
 async function saveMessages(messages) {
     // No-op: messages are stored only in the API database.
     void messages;
@@ -1486,6 +1511,8 @@ async function changePassword() {
             errorDiv.classList.add('show');
             return;
         }
+        // Older sessions are revoked; keep this one with the token issued for the new password
+        if (data.token) setToken(data.token);
         successDiv.textContent = 'Parola a fost schimbată cu succes!';
         successDiv.classList.add('show');
         document.getElementById('changePasswordForm').reset();
@@ -3,6 +3,29 @@ const API_BASE_URL = window.location.hostname.includes('vercel.app') || window.l
     ? `${window.location.protocol}//${window.location.hostname}/api`
     : `http://${window.location.hostname}:8001/api`;
 
+// Page bootstrap: all public sections (and the visit count) in one request.
+// fetchSection() answers from it and falls back to the section's own endpoint.
+let bootstrapPromise = null;
+function loadBootstrap() {
+    if (!bootstrapPromise) {
+        bootstrapPromise = fetch(`${API_BASE_URL}/bootstrap?track=1`)
+            .then(response => response.ok ? response.json() : null)
+            .catch(() => null);
+    }
+    return bootstrapPromise;
+}
+
+async function fetchSection(name) {
+    const bootstrap = await loadBootstrap();
+    if (bootstrap && bootstrap.sections && name in bootstrap.sections) {
+        return new Response(JSON.stringify(bootstrap.sections[name]), {
+            status: 200,
+            headers: { 'Content-Type': 'application/json' }
+        });
+    }
+    return fetch(`${API_BASE_URL}/${name}`);
+}
+
 // Mobile Menu Toggle
 const mobileMenuToggle = document.querySelector('.mobile-menu-toggle');
 const navMenu = document.querySelector('.nav-menu');
@@ -237,7 +260,7 @@ let chatbotResponses = {};
 // Load chatbot responses from API
 async function loadChatbotResponses() {
     try {
-        const response = await fetch(`${API_BASE_URL}/chatbot-responses`);
+        const response = await fetchSection('chatbot-responses');
         if (response.ok) {
             chatbotResponses = await response.json();
             console.log('Chatbot responses loaded:', Object.keys(chatbotResponses).length, 'responses');
@@ -283,6 +306,81 @@ function addMessage(content, isUser = false) {
     
     // Scroll to bottom
     chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+    return messageContent;
+}
+
+// Conversation id issued by /chatbot-ai, kept for the browser tab
+let chatbotConversationId = null;
+try {
+    chatbotConversationId = sessionStorage.getItem('chatbotConversationId');
+} catch (e) {}
+
+function rememberConversationId(id) {
+    if (!id) return;
+    chatbotConversationId = id;
+    try {
+        sessionStorage.setItem('chatbotConversationId', id);
+    } catch (e) {}
+}
+
+// Parse one Server-Sent Events block ("event: x\ndata: {...}")
+function parseChatbotEvent(block) {
+    let event = 'message';
+    let data = '';
+    for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+    }
+    try {
+        return { event: event, data: data ? JSON.parse(data) : {} };
+    } catch (e) {
+        return null;
+    }
+}
+
+// Ask the API (AI with this conversation's history), streaming the answer into
+// onDelta as it is generated; local keywords if the request fails
+async function askChatbot(message, onDelta) {
+    let text = '';
+    try {
+        const response = await fetch(`${API_BASE_URL}/chatbot-ai/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+            },
+            body: JSON.stringify({ message: message, conversation_id: chatbotConversationId })
+        });
+        if (response.ok && response.body) {
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let end;
+                while ((end = buffer.indexOf('\n\n')) >= 0) {
+                    const parsed = parseChatbotEvent(buffer.slice(0, end));
+                    buffer = buffer.slice(end + 2);
+                    if (!parsed) continue;
+                    if (parsed.event === 'conversation') {
+                        rememberConversationId(parsed.data.conversation_id);
+                    } else if (parsed.event === 'delta') {
+                        text += parsed.data.text || '';
+                        onDelta(text);
+                    } else if (parsed.event === 'done') {
+                        rememberConversationId(parsed.data.conversation_id);
+                        return parsed.data.response || text;
+                    }
+                }
+            }
+            if (text) return text;
+        }
+    } catch (error) {
+        console.error('API server not available, using local chatbot responses:', error);
+    }
+    return text || getChatbotResponse(message);
 }
 
 function sendMessage() {
@@ -292,55 +390,28 @@ function sendMessage() {
     // Add user message
     addMessage(message, true);
     
-    // Save user message immediately
-    const userMessage = {
-        type: 'user',
-        message: message,
-        timestamp: new Date().toISOString()
-    };
-    
-    // Try to save to API server
-    fetch(`${API_BASE_URL}/chatbot`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(userMessage)
-    }).catch(error => {
-        console.error('API server not available, chatbot message not saved:', error);
-    });
-    
     // Dispatch custom event for admin panel
     window.dispatchEvent(new CustomEvent('chatbotMessageAdded'));
     
     chatbotInput.value = '';
     
-    // Simulate bot thinking
-    setTimeout(() => {
-        const response = getChatbotResponse(message);
-        addMessage(response, false);
-        
-        // Save bot response
-        const botMessage = {
-            type: 'bot',
-            message: response,
-            timestamp: new Date().toISOString()
-        };
-        
-        // Try to save to API server
-        fetch(`${API_BASE_URL}/chatbot`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(botMessage)
-        }).catch(error => {
-            console.error('API server not available, chatbot response not saved:', error);
-        });
+    // The bot message fills in as the answer streams; the API stores both
+    // the question and the answer under the conversation
+    let botContent = null;
+    const showReply = text => {
+        if (!botContent) {
+            botContent = addMessage(text, false);
+        } else {
+            botContent.textContent = text;
+            chatbotMessages.scrollTop = chatbotMessages.scrollHeight;
+        }
+    };
+    askChatbot(message, showReply).then(response => {
+        showReply(response);
         
         // Dispatch custom event for admin panel
         window.dispatchEvent(new CustomEvent('chatbotMessageAdded'));
-    }, 500);
+    });
 }
 
 // Send message on button click
@@ -363,7 +434,7 @@ const TIKTOK_USERNAME = 'sofimar_serv.srl';
 // Get TikTok video IDs from API or use defaults
 async function getTikTokVideoIds() {
     try {
-        const response = await fetch(`${API_BASE_URL}/tiktok-videos`);
+        const response = await fetchSection('tiktok-videos');
         if (response.ok) {
             const videos = await response.json();
             if (Array.isArray(videos) && videos.length > 0) {
@@ -471,7 +542,10 @@ function escapeHtml(text) {
 // Track page visits (IP-based via server)
 function trackPageVisit() {
     try {
-        fetch(`${API_BASE_URL}/track-visit`, { method: 'GET' }).catch(() => {});
+        // Counted by the bootstrap request; only fall back if that failed
+        loadBootstrap().then(bootstrap => {
+            if (!bootstrap) fetch(`${API_BASE_URL}/track-visit`, { method: 'GET' }).catch(() => {});
+        });
     } catch (e) {}
 }
 
@@ -587,7 +661,7 @@ async function initRomaniaMap() {
     let officeLocations = [];
     
     try {
-        const response = await fetch(`${API_BASE_URL}/locations`);
+        const response = await fetchSection('locations');
         if (response.ok) {
             officeLocations = await response.json();
             console.log('Loaded locations from API:', officeLocations.length);
@@ -745,7 +819,7 @@ async function loadPartnersOnPage() {
     
     try {
         // Try to fetch from API server
-        const response = await fetch(`${API_BASE_URL}/partners`);
+        const response = await fetchSection('partners');
         if (response.ok) {
             partners = await response.json();
             if (!Array.isArray(partners)) {
@@ -956,7 +1030,7 @@ async function loadSiteTexts() {
     
     try {
         // Try to fetch from API server
-        const response = await fetch(`${API_BASE_URL}/site-texts`);
+        const response = await fetchSection('site-texts');
         if (response.ok) {
             texts = await response.json();
             console.log('Loaded texts from API:', texts);
@@ -1358,7 +1432,7 @@ async function loadReviews() {
     if (!reviewsContainer) return;
 
     try {
-        const response = await fetch('/api/reviews');
+        const response = await fetchSection('reviews');
         if (!response.ok) {
             reviewsContainer.innerHTML = '<div class="reviews-loading"><p>Nu există recenzii disponibile momentan.</p></div>';
             return;
@@ -0,0 +1,81 @@
+"""
+Cold-start benchmark: time from importing api/index.py to the first response,
+in fresh processes, broken down by phase (see "Cold start" in index.py).
+Exits with status 1 when the median exceeds the budget, so it can gate CI.
+
+    python scripts/bench_cold_start.py [--runs 5] [--budget-ms 800] [--path /api/bootstrap] [--prewarm]
+
+The database is the one configured by the environment (NEON_DB_URL for Neon,
+otherwise a temporary SQLite file). The schema is migrated once beforehand,
+as it is in production, so the runs measure the schema check, not the
+migrations. --prewarm sets PREWARM=1: the phases move to module load and the
+first request finds warm connections and caches.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--runs', type=int, default=5)
+parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('COLD_START_BUDGET_MS', '800')),
+                    help='maximum median cold start (import + first request), default COLD_START_BUDGET_MS or 800')
+parser.add_argument('--path', default='/api/bootstrap', help='first request (GET)')
+parser.add_argument('--prewarm', action='store_true', help='run with PREWARM=1')
+args = parser.parse_args()
+
+# Runs in a fresh interpreter; the last stdout line is the result
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import index
+request_started = time.perf_counter()
+status, _, body = index.handle_api_request(sys.argv[2], 'GET', {}, '', {})
+if not isinstance(body, (str, bytes)):
+    body = b''.join(body)
+index._record_phase('first_request', request_started)
+print(json.dumps({'status': status, 'total': (time.perf_counter() - started) * 1000,
+                  'phases': index.get_cold_start_profile()['phases']}))
+'''
+
+
+def run_once(env, cwd):
+    out = subprocess.run([sys.executable, '-c', CHILD, API_DIR, args.path], env=env, cwd=cwd,
+                         capture_output=True, text=True, check=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    if result['status'] != 200:
+        raise SystemExit(f"GET {args.path} returned {result['status']}")
+    return result
+
+
+def main():
+    cwd = tempfile.mkdtemp()  # site.db lives in the working directory
+    env = dict(os.environ, RETENTION_INTERVAL='0', COLD_START_PROFILE='0', PREWARM='1' if args.prewarm else '0')
+    subprocess.run([sys.executable, os.path.join(API_DIR, 'index.py'), 'migrate'], env=env, cwd=cwd,
+                   check=True, capture_output=True)
+
+    results = [run_once(env, cwd) for _ in range(args.runs)]
+    phases = list(dict.fromkeys(name for r in results for name in r['phases']))
+    print(f"{args.runs} cold starts, GET {args.path}{', PREWARM=1' if args.prewarm else ''} (median / max ms)")
+    for name in phases:
+        values = [r['phases'][name] for r in results if name in r['phases']]
+        print(f"  {name:<24} {statistics.median(values):8.1f} {max(values):8.1f}")
+    totals = [r['total'] for r in results]
+    median = statistics.median(totals)
+    print(f"  {'total':<24} {median:8.1f} {max(totals):8.1f}   budget {args.budget_ms:g}")
+    if median > args.budget_ms:
+        print(f"❌ Cold start {median:.0f} ms is over the {args.budget_ms:g} ms budget")
+        return 1
+    print("✅ Within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
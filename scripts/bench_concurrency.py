@@ -0,0 +1,108 @@
+"""
+Concurrency benchmark: the synchronous API (what `handler` runs, one request
+at a time per worker) against the ASGI app in api/_asgi.py (one process,
+many requests in flight).
+
+Both serve the same batch of requests in-process, without sockets, on a
+temporary SQLite database. POST /chatbot-ai uses the stub backend, whose
+CHATBOT_STUB_DELAY stands in for the OpenAI round trip; every question is
+unique so the answer cache never hits. "--mix" interleaves cached public GETs.
+
+    python scripts/bench_concurrency.py [--requests 40] [--delay 0.5] [--workers 1] [--mix]
+
+--workers is the number of synchronous workers (concurrent Vercel
+invocations, or handler threads); the ASGI app gets all requests at once.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--requests', type=int, default=40)
+parser.add_argument('--delay', type=float, default=0.5, help='simulated backend latency in seconds')
+parser.add_argument('--workers', type=int, default=1, help='synchronous workers')
+parser.add_argument('--mix', action='store_true', help='every other request is GET /certificates')
+args = parser.parse_args()
+
+os.environ['CHATBOT_BACKEND'] = 'stub'
+os.environ['CHATBOT_STUB_DELAY'] = str(args.delay)
+os.environ.setdefault('RETENTION_INTERVAL', '0')
+os.environ['CHATBOT_RATE_LIMIT'] = '0'  # every request comes from the same client
+os.chdir(tempfile.mkdtemp())  # site.db lives in the working directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+import index as api  # noqa: E402
+import _asgi  # noqa: E402
+
+api.get_db_connection()['conn'].close()  # migrations outside the timings
+
+
+def requests_for(run):
+    out = []
+    for i in range(args.requests):
+        if args.mix and i % 2:
+            out.append(('GET', '/api/certificates', b''))
+        else:
+            out.append(('POST', '/api/chatbot-ai', f'{{"message": "intrebare {run} {i}"}}'.encode()))
+    return out
+
+
+# Latencies are measured from the moment the whole batch is submitted, so
+# time spent queued behind a busy synchronous worker counts, as it would for a client.
+
+def call_sync(submitted, method, path, body):
+    status, _, _ = api.handle_api_request(path, method, {}, json.loads(body) if body else '', {})
+    assert status == 200, status
+    return time.perf_counter() - submitted
+
+
+async def call_asgi(submitted, method, path, body):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(b'content-type', b'application/json')]}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await _asgi.app(scope, receive, send)
+    assert sent[0]['status'] == 200, sent[0]['status']
+    return time.perf_counter() - submitted
+
+
+def report(label, wall, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{label:<22} {wall:8.2f} s  {len(latencies) / wall:8.1f} req/s  "
+          f"p50 {statistics.median(latencies) * 1000:7.0f} ms  p95 {p95 * 1000:7.0f} ms")
+
+
+def main():
+    print(f"{args.requests} requests, backend delay {args.delay}s{', mixed with GETs' if args.mix else ''}")
+
+    batch = requests_for('sync')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        latencies = list(pool.map(lambda r: call_sync(started, *r), batch))
+    report(f"sync x{args.workers} worker(s)", time.perf_counter() - started, latencies)
+
+    async def run_asgi():
+        batch = requests_for('asgi')
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(call_asgi(started, *r) for r in batch))
+        return time.perf_counter() - started, latencies
+
+    wall, latencies = asyncio.run(run_asgi())
+    report("asgi (1 process)", wall, latencies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark: API dispatch cost per request, before and after the route table.
+
+"before" replays the old handle_api_request prologue: path normalization plus the
+if/elif chain of method/path comparisons (and the per-call _require_auth closure).
+"after" is _normalize_api_path + _match_route from api/index.py.
+Only dispatch is measured; no handler runs and no database is touched.
+
+Usage: python scripts/bench_router.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+import index as api  # noqa: E402
+
+# Order of the branches in the old handle_api_request chain
+_LEGACY_CHAIN = {
+    'GET': ['', 'track-visit', 'test', 'health', 'validate', 'admin/visitor-stats', 'stats', 'messages',
+            'certificates', 'partners', 'tiktok-videos', 'locations', 'reviews', 'admin/reviews',
+            'chatbot-responses', 'site-texts'],
+    'POST': ['messages', 'reviews', 'admin/reviews', 'certificates', 'tiktok-videos', 'locations', 'partners',
+             'site-texts', 'admin-password', 'chatbot-responses', 'chatbot', 'chatbot-messages', 'chatbot-ai'],
+    'PUT': ['chatbot-responses'],
+    'DELETE': ['messages', 'certificates', 'partners', 'admin/reviews', 'chatbot-responses'],
+}
+
+
+def legacy_dispatch(path, method, query):
+    """Old prologue: normalize the path several times, then walk the chain."""
+    path = (path or '').strip()
+    if path.startswith('/api/'):
+        path = path[5:]
+    elif path.startswith('api/'):
+        path = path[4:]
+    elif path == '/api' or path == '/api/':
+        path = ''
+    if path.startswith('/'):
+        path = path[1:]
+    if path == 'index.py' and query.get('path'):
+        path = query.pop('path') or ''
+        if isinstance(path, list):
+            path = path[0] if path else ''
+        path = (path or '').strip().lstrip('/').rstrip('/') or path
+    path = (path or '').rstrip('/') or path
+    if method == 'POST' and path == 'login':
+        return 'login'
+
+    def _require_auth():
+        return True
+    _require_auth  # closure is rebuilt on every call, as before
+
+    for candidate in _LEGACY_CHAIN.get(method, ()):
+        if path == candidate:
+            return candidate
+    return None
+
+
+def new_dispatch(path, method, query):
+    route, _ = api._match_route(method, api._normalize_api_path(path, query))
+    return route
+
+
+def _time_per_call(fn, path, method, iterations):
+    best = min(timeit.repeat(lambda: fn(path, method, {}), number=iterations, repeat=5))
+    return best / iterations * 1e9
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # Every route that existed before the route table, plus POST /login
+    legacy_requests = [('/api/login', 'POST')]
+    for method, paths in _LEGACY_CHAIN.items():
+        legacy_requests.extend((f'/api/{p}', method) for p in paths)
+    param_requests = []
+    for routes in api._PARAM_ROUTES.values():
+        for r in routes:
+            param_requests.append(('/api/' + '/'.join('x1' if s.startswith('<') else s for s in r.segments), r.method))
+
+    print(f"{len(legacy_requests)} existing routes, {iterations} iterations each (ns/dispatch)")
+    print(f"  {'route':<32} {'before':>8} {'after':>8}")
+    totals = {'before': [], 'after': []}
+    for path, method in legacy_requests:
+        before = _time_per_call(legacy_dispatch, path, method, iterations)
+        after = _time_per_call(new_dispatch, path, method, iterations)
+        totals['before'].append(before)
+        totals['after'].append(after)
+        print(f"  {method + ' ' + path:<32} {before:8.0f} {after:8.0f}")
+    for label in ('before', 'after'):
+        vals = totals[label]
+        print(f"  {label:<7} mean {sum(vals) / len(vals):8.0f}  worst {max(vals):8.0f}")
+    print(f"Path-parameter routes (after only):")
+    for path, method in param_requests:
+        print(f"  {method + ' ' + path:<32} {'':>8} {_time_per_call(new_dispatch, path, method, iterations):8.0f}")
+
+
+if __name__ == '__main__':
+    main()